@@ -0,0 +1,23 @@
+"""Generate the uncompressed test data that tests read from the compressed AHN3 file in testdata."""
+import os
+
+import laspy
+
+_TEST_DATA_SOURCE = 'testdata'
+_COMPRESSED_FILE_NAME = 'AHN3.laz'
+_LAS_FILE_NAME = 'AHN3.las'
+_NORMALIZED_PLY_FILE_NAME = 'AHN3.ply'
+_NORMALIZATION_CELL_SIZE = 5
+
+
+def pytest_sessionstart(session):
+    """Create AHN3.las and its normalized AHN3.ply version if they do not exist yet, before tests are collected."""
+    las_path = os.path.join(_TEST_DATA_SOURCE, _LAS_FILE_NAME)
+    ply_path = os.path.join(_TEST_DATA_SOURCE, _NORMALIZED_PLY_FILE_NAME)
+    if not os.path.exists(las_path):
+        laspy.read(os.path.join(_TEST_DATA_SOURCE, _COMPRESSED_FILE_NAME)).write(las_path)
+    if not os.path.exists(ply_path):
+        from laserchicken import export, load
+        from laserchicken.normalize import normalize
+        point_cloud = normalize(load(las_path), cell_size=_NORMALIZATION_CELL_SIZE)
+        export(point_cloud, ply_path)
@@ -1,12 +1,17 @@
 import sys
 import math
+import struct
+import logging
+import itertools
+
 import numpy as np
 from scipy.spatial import cKDTree
 from psutil import virtual_memory
 
 from laserchicken import utils, kd_tree
-from laserchicken.volume_specification import Sphere, InfiniteCylinder, Cell, Cube
+from laserchicken.volume_specification import Sphere, InfiniteCylinder, Cell, Cube, KNearest
 from laserchicken.keys import point
+from laserchicken.neighborhoods import Neighborhoods, get_index_dtype
 
 
 def frange(x_value, y_value, jump):
@@ -15,138 +20,471 @@ def frange(x_value, y_value, jump):
         x_value += jump
 
 
-MEMORY_THRESHOLD = 0.5
-POINT_CLOUD_DIST = 10
+# Fraction of the currently available memory that is used for neighborhoods when no memory budget is given
+AVAILABLE_MEMORY_FRACTION = 0.5
+# Neighbor indices are returned as lists of Python ints: a pointer in the list plus the int object itself
+BYTES_PER_NEIGHBOR = struct.calcsize('P') + sys.getsizeof(2 ** 30)
+# Overhead of the (empty) list object that holds a single neighborhood
+BYTES_PER_NEIGHBORHOOD = sys.getsizeof([])
+# Number of targets at which the environment is sampled to estimate the point density
+DENSITY_SAMPLE_SIZE = 1000
+FILTER_CHUNK_SIZE = 10000
+# Maximum deviation, as a fraction of the cell size, of targets from the cell centers of a grid
+GRID_TOLERANCE = 1e-6
+# Number of consecutive targets whose neighborhoods are subsampled with the same derived random generator
+SUBSAMPLE_CHUNK_SIZE = 10000
+# Number of neighborhoods of which samples are drawn with a single array operation
+SUBSAMPLE_BLOCK_SIZE = 256
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_point_density(environment_pc, target_pc=None, radius=None, sample_size=DENSITY_SAMPLE_SIZE):
+    """
+    Estimate the number of environment points per square meter (in the xy plane).
+
+    If targets and a radius are given, the number of neighbors is counted for an evenly spaced sample of the targets,
+    which takes into account that targets might lie in denser or sparser parts of the environment. Otherwise, the
+    density is estimated from the number of points and the area of the bounding box of the environment point cloud.
+
+    :param environment_pc: environment point cloud
+    :param target_pc: optional point cloud of targets at which the density is sampled
+    :param radius: search radius used for sampling
+    :param sample_size: maximum number of targets that are sampled
+    :return: estimated number of points per square meter
+    """
+    env_x = environment_pc[point]['x']['data']
+    env_y = environment_pc[point]['y']['data']
+    n_env_points = len(env_x)
+    if n_env_points == 0:
+        return 0.
+
+    if target_pc is not None and radius:
+        target_x = target_pc[point]['x']['data']
+        target_y = target_pc[point]['y']['data']
+        if len(target_x) > 0:
+            env_tree = kd_tree.get_kdtree_for_pc(environment_pc)
+            target_points = np.column_stack((target_x, target_y))
+            mean_count = _estimate_neighbors_per_target(env_tree, target_points, radius, sample_size=sample_size)
+            return mean_count / (math.pi * radius ** 2)
+
+    area = (np.max(env_x) - np.min(env_x)) * (np.max(env_y) - np.min(env_y))
+    if area <= 0:
+        return float(n_env_points)
+    return n_env_points / area
+
+
+def plan_target_batch_size(environment_pc, target_pc, radius, memory_budget=None):
+    """
+    Choose the number of targets for which cylinder neighborhoods are computed at once.
+
+    The number of neighbors per target is estimated from the point density of the environment, so that the
+    neighborhoods of one batch fit within the memory budget.
+
+    :param environment_pc: environment point cloud
+    :param target_pc: point cloud that contains the points at which neighborhoods are to be calculated
+    :param radius: search radius for neighbors
+    :param memory_budget: number of bytes that the neighborhoods of a single batch may use; if None (default), a
+                          fraction of the currently available memory is used
+    :return: number of targets per batch
+    """
+    n_targets = len(target_pc[point]['x']['data'])
+    density = estimate_point_density(environment_pc, target_pc, radius)
+    logger.info('Estimated point density of the environment: %.1f points/m2', density)
+    return _plan_batch_size(n_targets, density * math.pi * radius ** 2, memory_budget)
 
 
-def compute_cylinder_neighborhood(environment_pc, target_pc, radius):
+def _estimate_neighbors_per_target(tree, target_points, radius, p=2., sample_size=DENSITY_SAMPLE_SIZE):
+    """Average number of points of the tree within the radius of an evenly spaced sample of the target points."""
+    n_targets = len(target_points)
+    sample = np.unique(np.linspace(0, n_targets - 1, min(sample_size, n_targets)).astype(int))
+    counts = tree.query_ball_point(target_points[sample], radius, p=p, return_length=True)
+    return float(np.mean(counts))
+
+
+def _plan_batch_size(n_targets, neighbors_per_target, memory_budget=None):
+    if memory_budget is None:
+        memory_budget = AVAILABLE_MEMORY_FRACTION * virtual_memory().available
+    bytes_per_target = neighbors_per_target * BYTES_PER_NEIGHBOR + BYTES_PER_NEIGHBORHOOD
+    batch_size = int(min(max(math.floor(memory_budget / bytes_per_target), 1), max(n_targets, 1)))
+    logger.info('Neighborhood plan: %.1f neighbors per target, memory budget %d bytes, %d targets in batches of %d',
+                neighbors_per_target, memory_budget, n_targets, batch_size)
+    return batch_size
+
+
+def compute_cylinder_neighborhood(environment_pc, target_pc, radius, memory_budget=None, n_workers=1):
     """Find the indices of points within a cylindrical neighbourhood (using KD Tree) for a given point of a target
     point cloud among the points from an environment point cloud.
 
     :param environment_pc: environment point cloud
     :param target_pc: point cloud that contains the points at which neighborhoods are to be calculated
     :param radius: search radius for neighbors
+    :param memory_budget: number of bytes that the neighborhoods of a single batch of targets may use; if None
+                          (default), a fraction of the currently available memory is used
+    :param n_workers: number of cores used to query the KD tree; -1 means all cores. With more than one worker, the
+                      targets of each batch are divided over the workers and the indices within each neighborhood
+                      are sorted. Neighborhoods are always yielded in the order of the targets.
     :return: indices of neighboring points from the environment point cloud for each target point
              the returned indices also contains the index of the target point.
     """
-    avg_points_cyl = (radius * radius * math.pi) * POINT_CLOUD_DIST
-    target_points = target_pc[point]['x']['data']
+    target_x = target_pc[point]['x']['data']
+    n_targets = np.size(target_x)
 
     if len(environment_pc[point]['x']['data']) == 0:
-        for _ in target_points:
+        for _ in target_x:
             yield []
         return
 
-    cyl_size = avg_points_cyl * np.size(target_points) * sys.getsizeof(int)
-    mem_size = virtual_memory().total
-
-    print("Cylinder size in Bytes: %s" % cyl_size)
-    print("Memory size in Bytes: %s" % mem_size)
-
-    if cyl_size > mem_size * MEMORY_THRESHOLD:
-        y = target_pc[point]['y']['data']
-
-        num_points = int(math.floor(mem_size * MEMORY_THRESHOLD / (avg_points_cyl * sys.getsizeof(int))))
-        print("Number of points: %d" % num_points)
-
-        env_tree = kd_tree.get_kdtree_for_pc(environment_pc)
+    env_tree = kd_tree.get_kdtree_for_pc(environment_pc)
+    batch_size = plan_target_batch_size(environment_pc, target_pc, radius, memory_budget)
 
-        for range_start in range(0, np.size(target_points), num_points):
-            range_end = min(range_start + num_points, np.size(target_points))
-            box_points = np.column_stack((target_points[range_start:range_end], y[range_start:range_end]))
-            target_box_tree = cKDTree(box_points, compact_nodes=False, balanced_tree=False)
-            for neighborhood in target_box_tree.query_ball_tree(env_tree, radius):
-                yield neighborhood
-
-    else:
-        print("Start tree creation")
-        env_tree = kd_tree.get_kdtree_for_pc(environment_pc)
-        print("Done with env tree creation")
+    if batch_size >= n_targets and n_workers == 1:
         target_tree = kd_tree.get_kdtree_for_pc(target_pc)
-        print("Done with target tree creation")
         for neighborhood in target_tree.query_ball_tree(env_tree, radius):
             yield neighborhood
+        return
+
+    target_y = target_pc[point]['y']['data']
+    for range_start in range(0, n_targets, batch_size):
+        range_end = min(range_start + batch_size, n_targets)
+        logger.debug('Computing neighborhoods of targets %d to %d', range_start, range_end)
+        box_points = np.column_stack((target_x[range_start:range_end], target_y[range_start:range_end]))
+        if n_workers == 1:
+            target_box_tree = cKDTree(box_points, compact_nodes=False, balanced_tree=False)
+            neighborhoods = target_box_tree.query_ball_tree(env_tree, radius)
+        else:
+            neighborhoods = env_tree.query_ball_point(box_points, radius, workers=n_workers)
+        for neighborhood in neighborhoods:
+            yield neighborhood
 
 
-def compute_sphere_neighborhood(environment_pc, target_pc, radius):
+def compute_sphere_neighborhood(environment_pc, target_pc, radius, memory_budget=None, n_workers=1):
     """
     Find the indices of points within a spherical neighbourhood for a given point of a target point cloud among the
     points from an environment point cloud.
 
+    The environment is queried directly in x, y and z using a 3D KD tree.
+
     :param environment_pc: environment point cloud
     :param target_pc: point cloud that contains the points at which neighborhoods are to be calculated
     :param radius: search radius for neighbors
+    :param memory_budget: number of bytes that the neighborhoods of a single batch of targets may use
+    :param n_workers: number of cores used to query the KD tree; -1 means all cores
     :return: indices of neighboring points from the environment point cloud for each target point
     """
-    neighborhoods = compute_cylinder_neighborhood(environment_pc, target_pc, radius)
-    for target_i, neighborhood_indices in enumerate(neighborhoods):
-        target_x, target_y, target_z = utils.get_point(target_pc, target_i)
-        result_indices = []
-        for neighbor_j in neighborhood_indices:
-            env_x, env_y, env_z = utils.get_point(environment_pc, neighbor_j)
-            if abs(target_z - env_z) > radius:
-                continue
-            if (env_x - target_x) ** 2 + (env_y - target_y) ** 2 + (env_z - target_z) ** 2 <= radius ** 2:
-                result_indices.append(neighbor_j)
-        yield result_indices
+    return _compute_3d_neighborhood(environment_pc, target_pc, radius, 2., memory_budget, n_workers)
 
 
-def compute_cell_neighborhood(environment_pc, target_pc, side_length):
+def compute_cell_neighborhood(environment_pc, target_pc, side_length, memory_budget=None, n_workers=1,
+                              grid_origin=None):
     """
     Find the indices of points within a square neighbourhood for a given point of a target point cloud among the
     points from an environment point cloud.
 
+    If the targets are centers of cells of a regular grid with the given side length, like the grids created for
+    normalization, the neighborhoods are found by binning the environment points into the grid cells instead of
+    using KD trees. Otherwise, the cylinder neighborhoods that circumscribe the cells are filtered.
+
     :param environment_pc: environment point cloud
     :param target_pc: point cloud that contains the points at which neighborhoods are to be calculated
     :param side_length: search radius for neighbors
+    :param memory_budget: number of bytes that the neighborhoods of a single batch of targets may use
+    :param n_workers: number of cores used to query the KD tree; -1 means all cores
+    :param grid_origin: optional (x, y) of the lower left corner of the grid of which the targets are cell centers;
+                        if None (default), it is detected whether the targets lie on a grid
     :return: indices of neighboring points from the environment point cloud for each target point
     """
+    target_cells = _get_target_grid_cells(target_pc, side_length, grid_origin)
+    if target_cells is not None:
+        return compute_grid_cell_neighborhood(environment_pc, side_length, *target_cells)
+    if grid_origin is not None:
+        raise ValueError('Targets are not centers of the cells of the grid with origin {} and side length {}.'
+                         .format(grid_origin, side_length))
+
+    neighborhoods = compute_cylinder_neighborhood(environment_pc, target_pc, _get_circumscribed_radius(side_length),
+                                                 memory_budget, n_workers)
+
+    def is_inside_cell(dx, dy, _):
+        return _is_inside_square(dx, dy, side_length)
+
+    return _filter_neighborhoods(environment_pc, target_pc, neighborhoods, is_inside_cell)
+
+
+def compute_grid_cell_neighborhood(environment_pc, side_length, grid_origin, target_columns, target_rows):
+    """
+    Find the indices of points within grid cells by assigning every environment point to its cell.
 
-    max_radius = 0.5 * math.sqrt((side_length ** 2) + (side_length ** 2))
+    Points are sorted by cell once, after which the neighborhood of every cell is a contiguous range. Like the square
+    neighborhoods around cell centers, points on the border of two cells belong to both cells.
 
-    neighborhoods = compute_cylinder_neighborhood(
-        environment_pc, target_pc, max_radius)
+    :param environment_pc: environment point cloud
+    :param side_length: side length of the grid cells
+    :param grid_origin: (x, y) of the lower left corner of the grid
+    :param target_columns: column number (in x) of the cell of each target
+    :param target_rows: row number (in y) of the cell of each target
+    :return: indices of neighboring points from the environment point cloud for each target point
+    """
+    sorted_point_indices, starts, ends = _get_grid_cell_ranges(environment_pc, side_length, grid_origin,
+                                                               target_columns, target_rows)
+    for start, end in zip(starts, ends):
+        yield sorted_point_indices[start:end].tolist()
 
-    for target_i, neighborhood_indices in enumerate(neighborhoods):
-        target_x, target_y, _ = utils.get_point(target_pc, target_i)
-        result_indices = []
-        for neighbor_j in neighborhood_indices:
-            env_x, env_y, _ = utils.get_point(environment_pc, neighbor_j)
-            if ((abs(target_x - env_x)) > 0.5 * side_length) or ((abs(target_y - env_y)) > 0.5 * side_length):
-                continue
-            else:
-                result_indices.append(neighbor_j)
-        yield result_indices
 
+def _get_grid_cell_ranges(environment_pc, side_length, grid_origin, target_columns, target_rows):
+    """
+    Sort the environment points by grid cell.
 
-def compute_cube_neighborhood(environment_pc, target_pc, side_length):
+    :return: sorted point indices, and for each target the start and end of the range of its cell in them
+    """
+    env_x, env_y, _ = utils.get_point(environment_pc, slice(None))
+    point_indices, columns, rows = _assign_points_to_cells(env_x, env_y, grid_origin, side_length)
+
+    min_column, max_column = np.min(target_columns), np.max(target_columns)
+    min_row, max_row = np.min(target_rows), np.max(target_rows)
+    n_columns = max_column - min_column + 1
+    in_target_range = (columns >= min_column) & (columns <= max_column) & (rows >= min_row) & (rows <= max_row)
+    point_indices = point_indices[in_target_range]
+    cell_ids = (rows[in_target_range] - min_row) * n_columns + columns[in_target_range] - min_column
+
+    order = np.lexsort((point_indices, cell_ids))
+    sorted_cell_ids = cell_ids[order]
+    sorted_point_indices = point_indices[order]
+
+    target_cell_ids = (target_rows - min_row) * n_columns + target_columns - min_column
+    starts = np.searchsorted(sorted_cell_ids, target_cell_ids, side='left')
+    ends = np.searchsorted(sorted_cell_ids, target_cell_ids, side='right')
+    return sorted_point_indices, starts, ends
+
+
+def _get_target_grid_cells(target_pc, side_length, grid_origin=None):
+    """
+    Get the grid cell of each target if all targets are centers of cells of a single grid.
+
+    :return: tuple of grid origin, column numbers and row numbers, or None if the targets are not on a grid
+    """
+    target_x, target_y, _ = utils.get_point(target_pc, slice(None))
+    if len(target_x) == 0:
+        return None
+    if grid_origin is None:
+        grid_origin = (np.min(target_x) - 0.5 * side_length, np.min(target_y) - 0.5 * side_length)
+
+    cells = []
+    for coordinates, origin in zip((target_x, target_y), grid_origin):
+        position = (coordinates - origin) / side_length - 0.5
+        cell = np.rint(position)
+        if np.any(np.abs(position - cell) > GRID_TOLERANCE):
+            return None
+        cells.append(cell.astype(np.int64))
+    return (grid_origin,) + tuple(cells)
+
+
+def _assign_points_to_cells(x, y, grid_origin, side_length):
+    """
+    Assign points to grid cells. Points on the border of two or four cells are assigned to all of them.
+
+    :return: point indices, column numbers and row numbers of all point-cell pairs
+    """
+    columns, in_column = _get_cells_along_axis(x, grid_origin[0], side_length)
+    rows, in_row = _get_cells_along_axis(y, grid_origin[1], side_length)
+
+    in_single_cell = in_column[:, 1] & in_row[:, 1] & ~(in_column[:, 0] | in_column[:, 2] | in_row[:, 0] |
+                                                          in_row[:, 2])
+    single = np.flatnonzero(in_single_cell)
+    other = np.flatnonzero(~in_single_cell)
+    in_cells = in_column[other][:, :, None] & in_row[other][:, None, :]
+    i_other, column_shift, row_shift = np.nonzero(in_cells)
+    point_indices = np.concatenate((single, other[i_other]))
+    columns = np.concatenate((columns[single], columns[other][i_other] + column_shift - 1))
+    rows = np.concatenate((rows[single], rows[other][i_other] + row_shift - 1))
+    return point_indices, columns, rows
+
+
+def _get_cells_along_axis(coordinates, origin, side_length):
+    """
+    Get the cell number along one axis for each coordinate.
+
+    :return: cell numbers and a boolean array of shape (n, 3) that tells whether each coordinate lies within the
+             previous, the same and the next cell, using the same test as the square neighborhoods
+    """
+    cells = np.floor((coordinates - origin) / side_length).astype(np.int64)
+    in_cells = np.empty((len(cells), 3), dtype=bool)
+    for i_shift, shift in enumerate((-1, 0, 1)):
+        centers = origin + side_length * (cells + shift + 0.5)
+        in_cells[:, i_shift] = np.abs(coordinates - centers) <= 0.5 * side_length
+    return cells, in_cells
+
+
+def compute_cube_neighborhood(environment_pc, target_pc, side_length, memory_budget=None, n_workers=1):
     """
     Find the indices of points within a square neighbourhood for a given point of a target point cloud among the
     points from an environment point cloud.
 
+    Points are selected within half the side length from the target in x and y, and within the side length in z.
+    Candidates are found with a Chebyshev distance query on a 3D KD tree and then filtered to the box in x and y.
+
     :param environment_pc: environment point cloud
     :param target_pc: point cloud that contains the points at which neighborhoods are to be calculated
     :param side_length: search radius for neighbors
+    :param memory_budget: number of bytes that the neighborhoods of a single batch of targets may use
+    :param n_workers: number of cores used to query the KD tree; -1 means all cores
+    :return: indices of neighboring points from the environment point cloud for each target point
+    """
+    neighborhoods = _compute_3d_neighborhood(environment_pc, target_pc, side_length, np.inf, memory_budget,
+                                             n_workers)
+
+    def is_inside_cube(dx, dy, _):
+        return _is_inside_square(dx, dy, side_length)
+
+    return _filter_neighborhoods(environment_pc, target_pc, neighborhoods, is_inside_cube)
+
+
+def _compute_3d_neighborhood(environment_pc, target_pc, radius, p, memory_budget, n_workers):
+    """
+    Find the indices of environment points within the given Minkowski p-norm distance from each target point in xyz.
+
+    :param environment_pc: environment point cloud
+    :param target_pc: point cloud that contains the points at which neighborhoods are to be calculated
+    :param radius: search radius for neighbors
+    :param p: which Minkowski p-norm to use, 2 for euclidean distance and np.inf for Chebyshev distance
+    :param memory_budget: number of bytes that the neighborhoods of a single batch of targets may use
+    :param n_workers: number of cores used to query the KD tree; -1 means all cores
     :return: indices of neighboring points from the environment point cloud for each target point
     """
+    target_points = np.column_stack(utils.get_point(target_pc, slice(None)))
+    n_targets = len(target_points)
+
+    if len(environment_pc[point]['x']['data']) == 0:
+        for _ in range(n_targets):
+            yield []
+        return
+    if n_targets == 0:
+        return
+
+    env_tree = kd_tree.get_3d_kdtree_for_pc(environment_pc)
+    neighbors_per_target = _estimate_neighbors_per_target(env_tree, target_points, radius, p)
+    batch_size = _plan_batch_size(n_targets, neighbors_per_target, memory_budget)
+
+    for range_start in range(0, n_targets, batch_size):
+        range_end = min(range_start + batch_size, n_targets)
+        logger.debug('Computing neighborhoods of targets %d to %d', range_start, range_end)
+        for neighborhood in env_tree.query_ball_point(target_points[range_start:range_end], radius, p=p,
+                                                      workers=n_workers):
+            yield neighborhood
+
+
+def compute_knn_neighborhood(environment_pc, target_pc, k, dimensions=3, max_radius=None, memory_budget=None,
+                             n_workers=1):
+    """
+    Find the indices of the k nearest points in the environment point cloud for each point of a target point cloud.
+
+    :param environment_pc: environment point cloud
+    :param target_pc: point cloud that contains the points at which neighborhoods are to be calculated
+    :param k: number of neighbors
+    :param dimensions: 2 for distances in the xy plane, 3 for distances in xyz
+    :param max_radius: optional maximum distance of neighbors; neighborhoods can have less than k points if given
+    :param memory_budget: number of bytes that the neighborhoods of a single batch of targets may use
+    :param n_workers: number of cores used to query the KD tree; -1 means all cores
+    :return: indices of neighboring points, sorted by distance, from the environment point cloud for each target point
+    """
+    n_env_points = len(environment_pc[point]['x']['data'])
+    for neighbors in _query_k_nearest(environment_pc, target_pc, k, dimensions, max_radius, memory_budget, n_workers):
+        for neighborhood in neighbors:
+            yield neighborhood[neighborhood < n_env_points].tolist()
+
+
+def _compute_knn_neighborhoods_as_csr(environment_pc, target_pc, k, dimensions, max_radius, memory_budget, n_workers):
+    """Build a Neighborhoods object directly from the dense neighbor matrices without creating lists."""
+    n_env_points = len(environment_pc[point]['x']['data'])
+    index_dtype = get_index_dtype(n_env_points)
+    length_batches = []
+    index_batches = []
+    for neighbors in _query_k_nearest(environment_pc, target_pc, k, dimensions, max_radius, memory_budget, n_workers):
+        is_found = neighbors < n_env_points
+        length_batches.append(np.sum(is_found, axis=1))
+        index_batches.append(neighbors[is_found].astype(index_dtype))
+    lengths = np.concatenate(length_batches) if length_batches else np.zeros(0, dtype=np.int64)
+    indices = np.concatenate(index_batches) if index_batches else np.zeros(0, dtype=index_dtype)
+    return Neighborhoods.from_lengths(lengths, indices)
+
+
+def _query_k_nearest(environment_pc, target_pc, k, dimensions, max_radius, memory_budget, n_workers):
+    """
+    Query the k nearest neighbors for batches of targets.
+
+    :return: generator of (n_batch_targets, k) index matrices; missing neighbors have the number of environment
+             points as index
+    """
+    attribute_names = ['x', 'y', 'z'][:dimensions]
+    target_points = np.column_stack([target_pc[point][name]['data'] for name in attribute_names])
+    n_targets = len(target_points)
+    n_env_points = len(environment_pc[point]['x']['data'])
+    if n_targets == 0:
+        return
+    if n_env_points == 0:
+        yield np.zeros((n_targets, k), dtype=np.int64)
+        return
+
+    env_tree = kd_tree.get_kdtree_for_pc(environment_pc) if dimensions == 2 \
+        else kd_tree.get_3d_kdtree_for_pc(environment_pc)
+    batch_size = _plan_batch_size(n_targets, k, memory_budget)
+    distance_upper_bound = np.inf if max_radius is None else max_radius
+    for range_start in range(0, n_targets, batch_size):
+        range_end = min(range_start + batch_size, n_targets)
+        _, neighbors = env_tree.query(target_points[range_start:range_end], k=k,
+                                      distance_upper_bound=distance_upper_bound, workers=n_workers)
+        yield np.reshape(neighbors, (range_end - range_start, k))
 
-    neighborhoods = compute_cell_neighborhood(
-        environment_pc, target_pc, side_length)
 
-    for target_i, neighborhood_indices in enumerate(neighborhoods):
-        _, _, target_z = utils.get_point(target_pc, target_i)
-        result_indices = []
-        for neighbor_j in neighborhood_indices:
-            _, _, env_z = utils.get_point(environment_pc, neighbor_j)
-            if abs(target_z - env_z) > side_length:
-                continue
-            else:
-                result_indices.append(neighbor_j)
-        yield result_indices
+def _get_circumscribed_radius(side_length):
+    """Radius of the circle that circumscribes a square with the given side length."""
+    return 0.5 * math.sqrt((side_length ** 2) + (side_length ** 2))
 
 
+def _is_inside_square(dx, dy, side_length):
+    half_side = 0.5 * side_length
+    return (np.abs(dx) <= half_side) & (np.abs(dy) <= half_side)
 
-def compute_neighborhoods(env_pc, target_pc, volume_description, sample_size=None):
+
+def _filter_neighborhoods(environment_pc, target_pc, neighborhoods, is_inside, chunk_size=FILTER_CHUNK_SIZE):
+    """
+    Filter candidate neighborhoods with a vectorized test, a chunk of targets at a time.
+
+    The candidates of all targets in a chunk are flattened into a single index array so that their coordinates can be
+    gathered at once. The test is then applied to the coordinate differences between each candidate and its target.
+
+    :param environment_pc: environment point cloud
+    :param target_pc: point cloud that contains the points at which neighborhoods are to be calculated
+    :param neighborhoods: iterable of candidate neighborhoods (lists of indices), one for each target point
+    :param is_inside: function of the arrays dx, dy and dz returning a boolean array that is true for points to keep
+    :param chunk_size: number of targets that are processed together
+    :return: indices of neighboring points from the environment point cloud for each target point
+    """
+    env_x, env_y, env_z = utils.get_point(environment_pc, slice(None))
+    target_x, target_y, target_z = utils.get_point(target_pc, slice(None))
+    neighborhoods = iter(neighborhoods)
+    chunk_start = 0
+    while True:
+        chunk = list(itertools.islice(neighborhoods, chunk_size))
+        if not chunk:
+            return
+        n_targets = len(chunk)
+        lengths = np.fromiter((len(neighborhood) for neighborhood in chunk), dtype=np.intp, count=n_targets)
+        candidates = np.fromiter(itertools.chain.from_iterable(chunk), dtype=np.intp, count=lengths.sum())
+        owners = np.repeat(np.arange(n_targets), lengths)
+        targets = owners + chunk_start
+
+        keep = is_inside(env_x[candidates] - target_x[targets],
+                         env_y[candidates] - target_y[targets],
+                         env_z[candidates] - target_z[targets])
+
+        kept_lengths = np.bincount(owners[keep], minlength=n_targets)
+        for neighborhood in np.split(candidates[keep], np.cumsum(kept_lengths)[:-1]):
+            yield neighborhood.tolist()
+        chunk_start += n_targets
+
+
+def compute_neighborhoods(env_pc, target_pc, volume_description, sample_size=None, as_csr=False, memory_budget=None,
+                          n_workers=1, grid_origin=None, random_state=None, count_only=False):
     """
     Find a subset of points in a neighbourhood in the environment point cloud for each point in a target point cloud.
 
@@ -154,33 +492,164 @@ def compute_neighborhoods(env_pc, target_pc, volume_description, sample_size=Non
     :param target_pc: point cloud that contains the points at which neighborhoods are to be calculated
     :param volume_description: volume object that describes the shape and size of the search volume
     :param sample_size: maximum number of neighbors returned per target point; if None (default), all are returned
+    :param as_csr: if true, return a Neighborhoods object holding all neighborhoods in two flat arrays instead of a
+                   generator of lists
+    :param memory_budget: number of bytes that the neighborhoods of a single batch of targets may use; if None
+                          (default), a fraction of the currently available memory is used
+    :param n_workers: number of cores used to query the KD tree; -1 means all cores. The order of the neighborhoods
+                      does not depend on the number of workers.
+    :param grid_origin: only for cell volumes: (x, y) of the lower left corner of the grid of which the targets are
+                        cell centers; if None (default), it is detected whether the targets lie on a grid
+    :param random_state: seed (int), numpy.random.SeedSequence or numpy.random.Generator used to draw the samples of
+                         neighborhoods larger than sample_size; if None (default), the seed is drawn from the global
+                         numpy random state. With the same seed, the samples do not depend on n_workers or
+                         memory_budget.
+    :param count_only: if true, return only the number of points in each neighborhood (after subsampling), as an
+                       integer array, without creating lists of indices where possible
     :return: indices of neighboring points from the environment point cloud for each target point
     """
+    if count_only:
+        if as_csr:
+            raise ValueError('Neighborhoods can not be returned both as counts and in CSR format.')
+        return compute_neighborhood_counts(env_pc, target_pc, volume_description, sample_size, memory_budget,
+                                           n_workers, grid_origin)
+
     volume_type = volume_description.get_type()
 
     if volume_type == Cell.TYPE:
-        neighborhoods = compute_cell_neighborhood(env_pc, target_pc, volume_description.side_length)
+        neighborhoods = compute_cell_neighborhood(env_pc, target_pc, volume_description.side_length, memory_budget,
+                                                  n_workers, grid_origin)
     elif volume_type == Cube.TYPE:
-        neighborhoods = compute_cube_neighborhood(env_pc, target_pc, volume_description.side_length)
+        neighborhoods = compute_cube_neighborhood(env_pc, target_pc, volume_description.side_length, memory_budget,
+                                                  n_workers)
     elif volume_type == Sphere.TYPE:
-        neighborhoods = compute_sphere_neighborhood(env_pc, target_pc, volume_description.radius)
+        neighborhoods = compute_sphere_neighborhood(env_pc, target_pc, volume_description.radius, memory_budget,
+                                                    n_workers)
     elif volume_type == InfiniteCylinder.TYPE:
-        neighborhoods = compute_cylinder_neighborhood(env_pc, target_pc, volume_description.radius)
+        neighborhoods = compute_cylinder_neighborhood(env_pc, target_pc, volume_description.radius, memory_budget,
+                                                      n_workers)
+    elif volume_type == KNearest.TYPE:
+        if as_csr and not sample_size:
+            return _compute_knn_neighborhoods_as_csr(env_pc, target_pc, volume_description.k,
+                                                     volume_description.dimensions, volume_description.max_radius,
+                                                     memory_budget, n_workers)
+        neighborhoods = compute_knn_neighborhood(env_pc, target_pc, volume_description.k,
+                                                 volume_description.dimensions, volume_description.max_radius,
+                                                 memory_budget, n_workers)
     else:
         raise ValueError(
             'Neighborhood computation error because volume type "{}" is unknown.'.format(volume_type))
 
-    return _subsample_if_necessary(neighborhoods, sample_size)
+    neighborhoods = _subsample_if_necessary(neighborhoods, sample_size, random_state)
+    if as_csr:
+        n_env_points = len(env_pc[point]['x']['data'])
+        return Neighborhoods.from_lists(neighborhoods, dtype=get_index_dtype(n_env_points))
+    return neighborhoods
+
+
+def compute_neighborhood_counts(env_pc, target_pc, volume_description, sample_size=None, memory_budget=None,
+                                n_workers=1, grid_origin=None):
+    """
+    Count the points in the neighbourhood in the environment point cloud of each point in a target point cloud.
 
+    Cylinder and sphere neighborhoods are counted by the KD tree without creating any lists of indices, and cell
+    neighborhoods of targets on a grid are counted from the ranges of the grid cells. Other neighborhoods are computed
+    a batch at a time and only their lengths are kept.
 
-def _subsample_if_necessary(neighborhoods, sample_size):
+    :param env_pc: environment point cloud
+    :param target_pc: point cloud that contains the points at which neighborhoods are to be calculated
+    :param volume_description: volume object that describes the shape and size of the search volume
+    :param sample_size: maximum number of neighbors per target point; if None (default), all are counted
+    :param memory_budget: number of bytes that the neighborhoods of a single batch of targets may use
+    :param n_workers: number of cores used to query the KD tree; -1 means all cores
+    :param grid_origin: only for cell volumes, see compute_neighborhoods
+    :return: integer array with the number of neighbors of each target point
+    """
+    volume_type = volume_description.get_type()
+    n_targets = len(target_pc[point]['x']['data'])
+    n_env_points = len(env_pc[point]['x']['data'])
+    target_cells = _get_target_grid_cells(target_pc, volume_description.side_length, grid_origin) \
+        if volume_type == Cell.TYPE else None
+
+    if n_env_points == 0 or n_targets == 0:
+        counts = np.zeros(n_targets, dtype=np.intp)
+    elif volume_type == InfiniteCylinder.TYPE:
+        target_points = np.column_stack((target_pc[point]['x']['data'], target_pc[point]['y']['data']))
+        counts = kd_tree.get_kdtree_for_pc(env_pc).query_ball_point(
+            target_points, volume_description.radius, return_length=True, workers=n_workers)
+    elif volume_type == Sphere.TYPE:
+        target_points = np.column_stack(utils.get_point(target_pc, slice(None)))
+        counts = kd_tree.get_3d_kdtree_for_pc(env_pc).query_ball_point(
+            target_points, volume_description.radius, return_length=True, workers=n_workers)
+    elif target_cells is not None:
+        _, starts, ends = _get_grid_cell_ranges(env_pc, volume_description.side_length, *target_cells)
+        counts = ends - starts
+    elif volume_type == KNearest.TYPE:
+        counts = np.concatenate([np.sum(neighbors < n_env_points, axis=1) for neighbors in _query_k_nearest(
+            env_pc, target_pc, volume_description.k, volume_description.dimensions, volume_description.max_radius,
+            memory_budget, n_workers)])
+    else:
+        neighborhoods = compute_neighborhoods(env_pc, target_pc, volume_description, memory_budget=memory_budget,
+                                              n_workers=n_workers, grid_origin=grid_origin)
+        counts = np.fromiter((len(neighborhood) for neighborhood in neighborhoods), dtype=np.intp, count=n_targets)
+
+    counts = np.asarray(counts, dtype=np.intp)
     if sample_size:
-        sampled = (_subsample(neighborhood, sample_size) if len(neighborhood) > sample_size else neighborhood for
-                   neighborhood in neighborhoods)
-        return sampled
+        counts = np.minimum(counts, sample_size)
+    return counts
+
+
+def _subsample_if_necessary(neighborhoods, sample_size, random_state=None):
+    if sample_size:
+        return _subsample(neighborhoods, sample_size, _get_seed_sequence(random_state))
     else:
         return neighborhoods
 
 
-def _subsample(neighborhood, sample_size=None):
-    return list(np.random.choice(neighborhood, sample_size, replace=False))
+def _get_seed_sequence(random_state):
+    if isinstance(random_state, np.random.SeedSequence):
+        return random_state
+    if isinstance(random_state, np.random.Generator):
+        return np.random.SeedSequence(random_state.integers(2 ** 63))
+    if random_state is None:
+        return np.random.SeedSequence(np.random.randint(2 ** 31))
+    return np.random.SeedSequence(random_state)
+
+
+def _subsample(neighborhoods, sample_size, seed_sequence):
+    """
+    Randomly sample sample_size indices without replacement from each neighborhood that is larger than that.
+
+    Neighborhoods are processed in fixed chunks of targets, each with its own generator derived from the seed sequence,
+    so that the samples do not depend on how the neighborhoods were computed.
+    """
+    neighborhoods = iter(neighborhoods)
+    for chunk_number in itertools.count():
+        chunk = list(itertools.islice(neighborhoods, SUBSAMPLE_CHUNK_SIZE))
+        if not chunk:
+            return
+        chunk_seed = np.random.SeedSequence(seed_sequence.entropy,
+                                           spawn_key=seed_sequence.spawn_key + (chunk_number,))
+        yield from _subsample_chunk(chunk, sample_size, np.random.default_rng(chunk_seed))
+
+
+def _subsample_chunk(neighborhoods, sample_size, generator):
+    lengths = np.fromiter((len(neighborhood) for neighborhood in neighborhoods), dtype=np.int64,
+                          count=len(neighborhoods))
+    large = np.flatnonzero(lengths > sample_size)
+    if len(large) == 0:
+        return neighborhoods
+    neighborhoods = list(neighborhoods)
+    # Blocks of neighborhoods of similar length, so that little padding is needed to draw their samples at once
+    large = large[np.argsort(lengths[large], kind='stable')]
+    for block_start in range(0, len(large), SUBSAMPLE_BLOCK_SIZE):
+        block = large[block_start:block_start + SUBSAMPLE_BLOCK_SIZE]
+        block_lengths = lengths[block]
+        # The sample_size smallest of independent uniform keys are a uniformly random subset of each neighborhood
+        random_keys = generator.random((len(block), block_lengths[-1]))
+        random_keys[np.arange(block_lengths[-1]) >= block_lengths[:, None]] = np.inf
+        positions = np.argpartition(random_keys, sample_size - 1, axis=1)[:, :sample_size]
+        for i, neighborhood_positions in zip(block.tolist(), positions.tolist()):
+            neighborhood = neighborhoods[i]
+            neighborhoods[i] = [neighborhood[position] for position in neighborhood_positions]
+    return neighborhoods
@@ -6,8 +6,11 @@ See https://github.com/eEcoLiDAR/eEcoLiDAR/issues/21
 import numpy as np
 
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
+from laserchicken.neighborhoods import Neighborhoods
 from laserchicken.utils import get_attributes_per_neighborhood
 
+SUPPORTED_VOLUMES = ['infinite cylinder', 'cell']
+
 
 def _to_unmasked_array(masked_array):
     """Creates a 'normal' numpy array from a masked array, inputting nans for masked values."""
@@ -64,17 +67,15 @@ class BandRatioFeatureExtractor(FeatureExtractor):
         :param volume_description: volume object that describes the shape and size of the search volume
         :return: feature value
         """
-        supported_volumes = ['infinite cylinder', 'cell']
-        if volume_description.TYPE not in supported_volumes:
-            raise ValueError('The volume must be a cylinder')
+        _check_volume(volume_description)
 
         attribute = get_attributes_per_neighborhood(point_cloud, neighborhoods, [self.data_key])
         z = attribute[:, 0, :]
         n_total_points = attribute.shape[2]
         n_masked_points_per_neighborhood = attribute.mask[:, 0, :].sum(axis=1)
         n_points_per_neighborhood = -n_masked_points_per_neighborhood + n_total_points
-        is_point_below_upper_limit = z < self.upper_limit if self.upper_limit else np.ones_like(z)
-        is_point_above_lower_limit = z > self.lower_limit if self.lower_limit else np.ones_like(z)
+        is_point_below_upper_limit = z < self.upper_limit if self.upper_limit is not None else np.ones_like(z)
+        is_point_above_lower_limit = z > self.lower_limit if self.lower_limit is not None else np.ones_like(z)
         n_points_within_band = np.sum(is_point_below_upper_limit * is_point_above_lower_limit, axis=1)
         return _to_unmasked_array(n_points_within_band / n_points_per_neighborhood)
 
@@ -85,3 +86,99 @@ class BandRatioFeatureExtractor(FeatureExtractor):
         Needed for provenance.
         """
         return (self.lower_limit, self.upper_limit, self.data_key)
+
+
+class BandRatioSetFeatureExtractor(FeatureExtractor):
+    """
+    Feature extractor for the band ratios of a set of consecutive bands, computed in a single pass.
+
+    The bands are given by their break points, for instance [None, 1, 2, 3, None] gives the same four features as
+    BandRatioFeatureExtractor(None, 1), (1, 2), (2, 3) and (3, None). Only the first and the last break point can
+    be None, for bands without lower or upper limit. As for a single band, the limits are exclusive, so points exactly
+    on a break point are not in any band.
+    """
+
+    def __init__(self, break_points, data_key='z'):
+        break_points = list(break_points)
+        if len(break_points) < 2:
+            raise ValueError('At least two break points are needed for a band, got {}.'.format(break_points))
+        if any(break_point is None for break_point in break_points[1:-1]):
+            raise ValueError('Only the first and last break points can be None, got {}.'.format(break_points))
+        finite_break_points = [break_point for break_point in break_points if break_point is not None]
+        if np.any(np.diff(finite_break_points) <= 0):
+            raise ValueError('Break points should be increasing, got {}.'.format(break_points))
+        self.break_points = break_points
+        self.data_key = data_key
+
+    def requires(self):
+        """
+        Get a list of names of the point attributes that are needed for this feature extraction.
+
+        :return: List of feature names
+        """
+        return []
+
+    def provides(self):
+        """
+        Get a list of names of the feature values, one for each band, named as by BandRatioFeatureExtractor.
+
+        :return: List of feature names
+        """
+        return [BandRatioFeatureExtractor(lower_limit, upper_limit, self.data_key).provides()[0]
+                for lower_limit, upper_limit in zip(self.break_points[:-1], self.break_points[1:])]
+
+    def extract(self, point_cloud, neighborhoods, target_point_cloud, target_index, volume_description):
+        """
+        Extract the feature value(s) of the point cloud at location of the target.
+
+        The band of every point in the neighborhoods is looked up once, after which the points of all bands of all
+        neighborhoods are counted with a single bincount.
+
+        :param point_cloud: environment (search space) point cloud
+        :param neighborhoods: array of array of indices of points within the point_cloud argument
+        :param target_point_cloud: point cloud that contains target point
+        :param target_index: index of the target point in the target point cloud
+        :param volume_description: volume object that describes the shape and size of the search volume
+        :return: list with an array of ratios for each band, or a single array if there is one band
+        """
+        _check_volume(volume_description)
+        neighborhoods = Neighborhoods.from_lists(neighborhoods)
+        values = np.asarray(neighborhoods.gather(point_cloud, self.data_key), dtype=float)
+        bands, is_in_band = self._get_bands(values)
+
+        n_bands = len(self.break_points) - 1
+        n_neighborhoods = len(neighborhoods)
+        owners = neighborhoods.get_owners()
+        counts = np.bincount(owners[is_in_band] * n_bands + bands[is_in_band],
+                             minlength=n_neighborhoods * n_bands).reshape(n_neighborhoods, n_bands)
+        with np.errstate(invalid='ignore'):
+            ratios = counts / neighborhoods.lengths[:, np.newaxis]
+        if n_bands == 1:
+            return ratios[:, 0]
+        return [ratios[:, i] for i in range(n_bands)]
+
+    def _get_bands(self, values):
+        """Band number of each value, and whether the value is in a band at all."""
+        finite_break_points = np.array([b for b in self.break_points if b is not None], dtype=float)
+        bands = np.searchsorted(finite_break_points, values, side='left')
+        is_in_band = ~np.isnan(values)
+        if len(finite_break_points) > 0:
+            next_break_points = finite_break_points[np.minimum(bands, len(finite_break_points) - 1)]
+            is_in_band &= next_break_points != values
+        if self.break_points[0] is not None:
+            bands -= 1
+        is_in_band &= (bands >= 0) & (bands < len(self.break_points) - 1)
+        return bands, is_in_band
+
+    def get_params(self):
+        """
+        Return a tuple of parameters involved in the current feature extractor object.
+
+        Needed for provenance.
+        """
+        return (list(self.break_points), self.data_key)
+
+
+def _check_volume(volume_description):
+    if volume_description.TYPE not in SUPPORTED_VOLUMES:
+        raise ValueError('The volume must be a cylinder')
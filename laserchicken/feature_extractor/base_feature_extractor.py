@@ -36,7 +36,8 @@ class FeatureExtractor(object):
         Extract the feature value(s) of the point cloud at location of the target.
 
         :param point_cloud: environment (search space) point cloud
-        :param neighborhoods: list of arrays of indices of points within the point_cloud argument
+        :param neighborhoods: list of arrays of indices of points within the point_cloud argument, or a
+                              Neighborhoods object that iterates in the same way
         :param target_point_cloud: point cloud that contains target point
         :param target_indices: list of indices of the target point in the target point cloud
         :param volume_description: volume object that describes the shape and size of the search volume
@@ -45,6 +46,19 @@ class FeatureExtractor(object):
         raise NotImplementedError(
             "Class %s doesn't implement extract_features()" % (self.__class__.__name__))
 
+    def needs_only_counts(self, volume_description):
+        """
+        Tell whether this extractor only uses the number of points in each neighborhood and not the points themselves.
+
+        If this is true for all features that are computed, compute_features computes the neighborhoods by only
+        counting their points, and extract gets a NeighborhoodCounts object instead of neighborhoods, also when the
+        neighborhoods were given to compute_features.
+
+        :param volume_description: volume object that describes the shape and size of the search volume
+        :return: True if only the number of points in each neighborhood is used
+        """
+        return False
+
     def get_params(self):
         """
         Returns a tuple of parameters involved in the current feature extractor
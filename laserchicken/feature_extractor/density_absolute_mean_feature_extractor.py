@@ -6,19 +6,15 @@ See https://github.com/eEcoLiDAR/eEcoLiDAR/issues/23.
 import numpy as np
 
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
-from laserchicken.keys import point, normalized_height
-
-# classification according to
-# http://www.asprs.org/wp-content/uploads/2010/12/LAS_1-4_R6.pdf
-GROUND_TAGS = [2]
-
-
-def _is_ground(i, point_cloud):
-    return point_cloud[point]['raw_classification']["data"][i] in GROUND_TAGS
+from laserchicken.feature_extractor.ground_mask import GROUND_TAGS, get_ground_per_neighbor
+from laserchicken.keys import point
+from laserchicken.neighborhoods import Neighborhoods
 
 
 class DensityAbsoluteMeanFeatureExtractor(FeatureExtractor):
     """Feature extractor for the point density."""
+    ground_tags = GROUND_TAGS
+
     def __init__(self, data_key='z'):
         self.data_key = data_key
 
@@ -30,35 +26,39 @@ class DensityAbsoluteMeanFeatureExtractor(FeatureExtractor):
         return ['density_absolute_mean_' + self.data_key]
 
     def extract(self, point_cloud, neighborhoods, target_point_cloud, target_indices, volume_description):
-        return [self._extract_one(point_cloud, neighborhood) for neighborhood in neighborhoods]
-
-    def _extract_one(self, point_cloud, neighborhood):
+        """
+        Compute the percentage of non ground points with a value above the mean of the non ground points.
+
+        Ground points are found with a mask that is shared with the pulse penetration extractor. Values are compared to
+        a segmented mean of all neighborhoods at once. That mean can differ from np.mean by rounding, so neighborhoods
+        with values within rounding of their mean are counted again with np.mean, which gives the same counts as
+        comparing to np.mean of every neighborhood.
+        """
+        neighborhoods = Neighborhoods.from_lists(neighborhoods)
+        if len(neighborhoods) == 0:
+            return np.zeros(0)
         if 'raw_classification' not in point_cloud[point]:
             raise ValueError(
                 'Missing raw_classification attribute which is necessary for calculating density_absolute_mean.')
 
-        non_ground_indices = [i for i in neighborhood if not _is_ground(i, point_cloud)]
-        density_absolute_mean_z = self._get_density_absolute_mean(non_ground_indices, point_cloud)
-
-        return density_absolute_mean_z
-
-    @staticmethod
-    def _get_ground_indices(point_cloud, ground_tags):
-        index_grd = []
-        for ipt, c in enumerate(point_cloud):
-            if c in ground_tags:
-                index_grd.append(ipt)
-        return index_grd
-
-    def _get_density_absolute_mean(self, non_ground_indices, source_point_cloud):
-        n_non_ground = len(non_ground_indices)
-        data_non_ground = source_point_cloud[point][self.data_key]["data"][non_ground_indices]
-        if n_non_ground == 0:
-            density_absolute_mean = 0.
-        else:
-            density_absolute_mean = float(
-                len(data_non_ground[data_non_ground > np.mean(data_non_ground)])) / n_non_ground * 100.
+        is_non_ground = ~get_ground_per_neighbor(point_cloud, neighborhoods, self.ground_tags)
+        values = np.asarray(neighborhoods.gather(point_cloud, self.data_key), dtype=float)[is_non_ground]
+        n_non_ground = neighborhoods.reduce(np.add, is_non_ground, empty_value=0).astype(int)
+        non_ground_neighborhoods = Neighborhoods.from_lengths(n_non_ground, values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = non_ground_neighborhoods.reduce(np.add, values) / n_non_ground
+            n_above_mean = non_ground_neighborhoods.reduce(np.add, values > np.repeat(mean, n_non_ground),
+                                                           empty_value=0)
+            # Upper bound of the difference between two means of the same values that are summed in different orders
+            tolerance = 2 * np.finfo(float).eps * non_ground_neighborhoods.reduce(np.add, np.abs(values))
+            is_near_mean = np.abs(values - np.repeat(mean, n_non_ground)) <= np.repeat(tolerance, n_non_ground)
+        for i in np.flatnonzero(non_ground_neighborhoods.reduce(np.add, is_near_mean, empty_value=0) > 0):
+            neighborhood_values = values[non_ground_neighborhoods.offsets[i]:non_ground_neighborhoods.offsets[i + 1]]
+            n_above_mean[i] = np.sum(neighborhood_values > np.mean(neighborhood_values))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            density_absolute_mean = n_above_mean / n_non_ground * 100.
+        density_absolute_mean[n_non_ground == 0] = 0.
         return density_absolute_mean
 
     def get_params(self):
-        return ()
+        return (list(self.ground_tags),)
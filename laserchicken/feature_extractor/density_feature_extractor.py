@@ -1,6 +1,9 @@
+import numpy as np
+
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
 from laserchicken.keys import point
-from laserchicken.volume_specification import Sphere, InfiniteCylinder
+from laserchicken.neighborhoods import Neighborhoods, NeighborhoodCounts
+from laserchicken.volume_specification import Sphere, InfiniteCylinder, KNearest
 
 
 class PointDensityFeatureExtractor(FeatureExtractor):
@@ -42,20 +45,52 @@ class PointDensityFeatureExtractor(FeatureExtractor):
         :param volume_description: volume object that describes the shape and size of the search volume
         :return: feature values
         """
-        return [self._extract_one(point_cloud, neighborhood, volume_description) for neighborhood in neighborhoods]
+        if volume_description.get_type() == KNearest.TYPE:
+            return self._extract_k_nearest(point_cloud, neighborhoods, target_point_cloud, target_indices,
+                                           volume_description)
+        if not isinstance(neighborhoods, (Neighborhoods, NeighborhoodCounts)):
+            neighborhoods = Neighborhoods.from_lists(neighborhoods)
+        return neighborhoods.lengths / volume_description.calculate_area_or_volume()
 
-    def _extract_one(self, source_pc, neighborhood, volume_description):
+    @staticmethod
+    def _extract_k_nearest(source_pc, neighborhoods, target_pc, target_indices, volume_description):
         """
-        Extract the feature value(s) of the point cloud at location of the target.
+        Extract the point density of k nearest neighbor neighborhoods.
+
+        The density is the number of neighbors divided by the area or volume of the circle or sphere through the
+        farthest (k-th) neighbor. If a neighborhood has less than k neighbors because of the maximum radius, the
+        area or volume at the maximum radius is used instead.
 
         :param source_pc: environment (search space) point cloud
-        :param neighborhood: array of indices of points within the point_cloud argument
-        :param volume_description: volume object that describes the shape and size of the search volume
-        :return: feature value
+        :param neighborhoods: list of arrays of indices of points within the point_cloud argument
+        :param target_pc: point cloud that contains target point
+        :param target_indices: list of indices of the target point in the target point cloud
+        :param volume_description: k nearest neighbors volume
+        :return: feature values
         """
-        n_points = len(source_pc[point]['x']['data'][neighborhood])
-        area_or_volume = volume_description.calculate_area_or_volume()
-        return float(n_points) / area_or_volume
+        if target_pc is None or target_indices is None:
+            raise ValueError('Target point cloud and indices are required for k nearest neighbor point density.')
+        neighborhoods = Neighborhoods.from_lists(neighborhoods)
+        owners = np.asarray(target_indices)[neighborhoods.get_owners()]
+        indices = neighborhoods.flat_indices
+        squared_distances = np.zeros(len(indices))
+        for dimension in ['x', 'y', 'z'][:volume_description.dimensions]:
+            squared_distances += (source_pc[point][dimension]['data'][indices] -
+                                  target_pc[point][dimension]['data'][owners]) ** 2
+        radius = np.sqrt(neighborhoods.reduce(np.maximum, squared_distances, empty_value=0))
+
+        n_points = neighborhoods.lengths
+        if volume_description.max_radius is not None:
+            radius[n_points < volume_description.k] = volume_description.max_radius
+        area_or_volume = volume_description.calculate_area_or_volume(radius)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            density = n_points / area_or_volume
+        density[n_points == 0] = 0.
+        return density
+
+    def needs_only_counts(self, volume_description):
+        """The density of k nearest neighbors depends on the distance to the farthest neighbor, else only on counts."""
+        return volume_description.get_type() != KNearest.TYPE
 
     def get_params(self):
         """
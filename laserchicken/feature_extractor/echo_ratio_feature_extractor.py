@@ -7,7 +7,8 @@ import numpy as np
 
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
 from laserchicken.keys import point
-from laserchicken.utils import get_xyz_per_neighborhood, get_point
+from laserchicken.neighborhoods import Neighborhoods
+from laserchicken.utils import get_point
 
 
 class EchoRatioFeatureExtractor(FeatureExtractor):
@@ -49,6 +50,8 @@ class EchoRatioFeatureExtractor(FeatureExtractor):
         :param volume_description: volume object that describes the shape and size of the search volume
         :return: feature value
         """
+        # Points are tested on the flat arrays of all neighbors, so memory scales with the number of neighbors and not
+        # with the number of targets times the size of the largest neighborhood
         if volume_description.TYPE != 'infinite cylinder':
             raise ValueError('The volume must be a cylinder')
 
@@ -58,17 +61,17 @@ class EchoRatioFeatureExtractor(FeatureExtractor):
         if target_index is None:
             raise ValueError('Target point index required')
 
-        # xyz = self.get_neighborhood_positions(point_cloud, neighborhood)
-        xyz = get_xyz_per_neighborhood(point_cloud, neighborhoods)
-        n_cylinder = np.sum(xyz.mask[:, 0, :] == False, axis=1, dtype=float)
-
-        x0, y0, z0 = get_point(target_point_cloud, target_index)
-        xyz0 = np.column_stack((x0, y0, z0))
-
-        difference = xyz - xyz0[:, :, None]
-        sum_of_squares = np.sum(difference ** 2, 1)
-        n_sphere = np.sum(sum_of_squares <= volume_description.radius ** 2, axis=1)
-        return n_sphere / n_cylinder
+        neighborhoods = Neighborhoods.from_lists(neighborhoods)
+        lengths = neighborhoods.lengths
+        target_xyz = [np.atleast_1d(coordinates) for coordinates in get_point(target_point_cloud, target_index)]
+
+        sum_of_squares = np.zeros(len(neighborhoods.flat_indices))
+        for dimension, target_coordinates in zip(['x', 'y', 'z'], target_xyz):
+            difference = neighborhoods.gather(point_cloud, dimension) - np.repeat(target_coordinates, lengths)
+            sum_of_squares += difference ** 2
+        n_sphere = neighborhoods.reduce(np.add, sum_of_squares <= volume_description.radius ** 2, empty_value=0)
+        # Empty neighborhoods have an echo ratio of 0, like the masked values of the padded version this replaced
+        return n_sphere / np.maximum(lengths, 1)
 
     @staticmethod
     def get_target_positions(target_point_cloud, target_index):
@@ -1,10 +1,13 @@
 import numpy as np
 
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
-from laserchicken.utils import get_xyz_per_neighborhood
+from laserchicken.keys import point
+from laserchicken.neighborhoods import Neighborhoods
 
 
 class EigenValueVectorizeFeatureExtractor(FeatureExtractor):
+    # Minimum number of points in a neighborhood to calculate eigen values and normals
+    MINIMUM_POINTS = 3
 
     @classmethod
     def requires(cls):
@@ -15,59 +18,53 @@ class EigenValueVectorizeFeatureExtractor(FeatureExtractor):
         return ['eigenv_1', 'eigenv_2', 'eigenv_3', 'normal_vector_1', 'normal_vector_2', 'normal_vector_3', 'slope']
 
     def extract(self, sourcepc, neighborhoods, targetpc, targetindex, volume):
-        if not (isinstance(neighborhoods[0], list) or isinstance(neighborhoods[0], range)):
+        """
+        Extract eigen values, the normal vector and the slope of the covariance matrix of the points per neighborhood.
+
+        Eigen values are sorted from large to small. The normal is the eigen vector of the smallest eigen value,
+        pointing upwards. Neighborhoods with fewer than 3 points get eigen values of 0 and NaN normals and slopes.
+        """
+        if not isinstance(neighborhoods, Neighborhoods) and \
+                not (isinstance(neighborhoods[0], list) or isinstance(neighborhoods[0], range)):
             neighborhoods = [neighborhoods]
+        neighborhoods = Neighborhoods.from_lists(neighborhoods)
 
-        xyz_grp = get_xyz_per_neighborhood(sourcepc, neighborhoods)
-        self._mask_rows_with_too_few_points(xyz_grp)
+        cov_mat = self._get_cov(sourcepc, neighborhoods)
+        is_valid = neighborhoods.lengths >= self.MINIMUM_POINTS
+        cov_mat[~is_valid] = np.eye(3)
 
-        e_vals, eigvects = self._get_eigen_values_and_vectors(xyz_grp)
+        e_vals, eigvects = self._get_eigen_values_and_vectors(cov_mat)
         normals = self._get_normals(eigvects)
         alpha = np.arccos(np.dot(normals, np.array([0., 0., 1.])))
         slope = np.tan(alpha)
 
+        e_vals[~is_valid] = 0
+        normals[~is_valid] = np.nan
+        slope[~is_valid] = np.nan
         return e_vals[:, 0], e_vals[:, 1], e_vals[:, 2], normals[:, 0], normals[:, 1], normals[:, 2], slope
 
     @staticmethod
-    def _get_cov(xyz):
-        n_max = xyz.shape[2]
-        n = (xyz.mask.sum(axis=2, keepdims=True) * -1) + n_max
-        m = xyz - xyz.sum(2, keepdims=True) / n
-        return np.einsum('ijk,ilk->ijl', m, m) / (n - 1)
-
-    def _get_eigen_values_and_vectors(self, xyz_grp):
-        cov_mat = self._get_cov(xyz_grp)
-        eigval, eigvects = np.linalg.eig(cov_mat)
-        return self._sort_eigen_values_and_vectors_by_value(eigval, eigvects)
-
-    def _sort_eigen_values_and_vectors_by_value(self, eigval, eigvects):
-        val_indices = np.argsort(eigval, axis=1)[:, ::-1]
-        ordered_vects = self._reorder_vectors(eigvects, val_indices)
-        ordered_eigval = np.take_along_axis(eigval, val_indices, axis=1)
-        return ordered_eigval, ordered_vects
+    def _get_cov(sourcepc, neighborhoods):
+        """Sample covariance matrices of x, y and z per neighborhood, from segmented sums without padding."""
+        n = neighborhoods.lengths
+        deviations = []
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for dimension in ['x', 'y', 'z']:
+                values = np.asarray(neighborhoods.gather(sourcepc, dimension), dtype=float)
+                mean = neighborhoods.reduce(np.add, values) / n
+                deviations.append(values - np.repeat(mean, n))
+            cov_mat = np.empty((len(neighborhoods), 3, 3))
+            for i in range(3):
+                for j in range(i, 3):
+                    cov_mat[:, i, j] = cov_mat[:, j, i] = \
+                        neighborhoods.reduce(np.add, deviations[i] * deviations[j]) / (n - 1)
+        return cov_mat
 
     @staticmethod
-    def _reorder_vectors(eigen_vectors, new_vector_indices):
-        """
-        Swaps the order of the eigen vectors according to the given new indices. Note that each single vector is kept
-        unchanged.
-        :param eigen_vectors:
-        :param new_vector_indices:
-        :return: The input eigen vectors in their new order.
-        """
-        # I'm reordering vectors in the last two dimensions while keeping the first dimension unchanged. I can't find
-        # any existing functions that do this exactly the way it needs to be sorted. Therefore I have to transpose
-        # and reshape and even repeat some indices to get the behavior I'm looking for.
-        vects_t = eigen_vectors.transpose([0, 2, 1])  # Eigen vectors used as column vectors. Making row vectors here.
-        flattened_vects_t = vects_t.reshape(-1, 3 * 3)  # Flatten the (eigen) vector dimension
-        vect_indices = np.zeros_like(flattened_vects_t, dtype=int) + [0, 1, 2, 0, 1, 2, 0, 1, 2]  # 0,1,2 for x,y,z
-        vect_indices[:, :3] += new_vector_indices[:, 0:1] * 3  # Because x,y,z, indices have to be increased by 3.
-        vect_indices[:, 3:6] += new_vector_indices[:, 1:2] * 3
-        vect_indices[:, 6:9] += new_vector_indices[:, 2:3] * 3
-        ordered_flattened_vects_t = np.take_along_axis(flattened_vects_t, vect_indices, axis=1)
-        ordered_vects_t = ordered_flattened_vects_t.reshape(eigen_vectors.shape)
-        ordered_vects = ordered_vects_t
-        return ordered_vects.transpose([0, 2, 1])
+    def _get_eigen_values_and_vectors(cov_mat):
+        """Eigen values sorted from large to small, with the eigen vectors as columns in the same order."""
+        eigval, eigvects = np.linalg.eigh(cov_mat)
+        return eigval[:, ::-1], eigvects[:, :, ::-1]
 
     @staticmethod
     def _get_normals(eigen_vectors):
@@ -81,10 +78,41 @@ class EigenValueVectorizeFeatureExtractor(FeatureExtractor):
         normals[mask_of_downward_pointing_vectors] = -normals[mask_of_downward_pointing_vectors]
         return normals
 
-    @staticmethod
-    def _mask_rows_with_too_few_points(xyz_grp):
-        minimum_for_calculation = 3
-        invalid_cells = xyz_grp.mask == False
-        invalid_neighbors = np.any(invalid_cells, axis=1)
-        invalid_rows = np.sum(invalid_neighbors, axis=1) < minimum_for_calculation
-        xyz_grp.mask[invalid_rows, :, :] = True
+
+class EigenGeometryFeatureExtractor(FeatureExtractor):
+    """
+    Shape features derived from the eigen values of the covariance matrix of the points per neighborhood.
+
+    With eigen values sorted from large to small (l1 >= l2 >= l3) and e_i = l_i / (l1 + l2 + l3), these are
+    linearity (l1 - l2) / l1, planarity (l2 - l3) / l1, sphericity l3 / l1, omnivariance (e1 * e2 * e3) ** (1 / 3),
+    anisotropy (l1 - l3) / l1, eigenentropy -sum(e_i * ln(e_i)) and change of curvature l3 / (l1 + l2 + l3).
+
+    The eigen values are taken from the target point cloud, where they were stored by the eigen value extractor for the
+    same chunk of targets. Neighborhoods without eigen values (fewer than 3 points) get NaN values.
+    """
+
+    @classmethod
+    def requires(cls):
+        return ['eigenv_1', 'eigenv_2', 'eigenv_3']
+
+    @classmethod
+    def provides(cls):
+        return ['linearity', 'planarity', 'sphericity', 'omnivariance', 'anisotropy', 'eigenentropy',
+                'change_of_curvature']
+
+    def extract(self, sourcepc, neighborhoods, targetpc, targetindex, volume):
+        if targetpc is None or targetindex is None:
+            raise ValueError('Target point cloud and indices are required to read the eigen values from.')
+        l1, l2, l3 = [np.maximum(targetpc[point][name]['data'][targetindex], 0.) for name in self.requires()]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            total = l1 + l2 + l3
+            linearity = (l1 - l2) / l1
+            planarity = (l2 - l3) / l1
+            sphericity = l3 / l1
+            anisotropy = (l1 - l3) / l1
+            change_of_curvature = l3 / total
+            normalized = np.array([l1, l2, l3]) / total
+            omnivariance = np.cbrt(np.prod(normalized, axis=0))
+            eigenentropy = -np.sum(np.where(normalized > 0, normalized * np.log(normalized), 0.), axis=0)
+        eigenentropy[~(total > 0)] = np.nan
+        return linearity, planarity, sphericity, omnivariance, anisotropy, eigenentropy, change_of_curvature
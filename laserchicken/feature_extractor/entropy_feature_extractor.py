@@ -1,8 +1,11 @@
 """Shannan entropy calculation. For more info see https://rdrr.io/cran/lidR/man/entropy.html"""
 
 import numpy as np
-from laserchicken import keys
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
+from laserchicken.neighborhoods import Neighborhoods
+
+# Maximum number of histogram bins of all neighborhoods together that are counted at once
+MAX_BINS_PER_BATCH = 10 ** 7
 
 
 class EntropyFeatureExtractor(FeatureExtractor):
@@ -24,22 +27,96 @@ class EntropyFeatureExtractor(FeatureExtractor):
         return [self.layer_thickness, self.min_val, self.max_val]
 
     def extract(self, point_cloud, neighborhoods, target_point_cloud, target_indices, volume):
-        return [self._extract_one(point_cloud, neighborhood) for neighborhood in neighborhoods]
-
-    def _extract_one(self, source_pc, neighborhood):
-        if len(neighborhood) == 0:
-            return 0
-        source_data = source_pc[keys.point][self.data_key]["data"][neighborhood]
-        data_min = np.min(source_data) if self.min_val is None else self.min_val
-        data_max = np.max(source_data) if self.max_val is None else self.max_val
-        if data_min == data_max:
-            return 0
-        n_bins = int(np.ceil((data_max - data_min) / self.layer_thickness))
-        data = np.histogram(source_data, bins=n_bins, range=(data_min, data_max), density=True)[0]
-        entropy_func = np.vectorize(_x_log_2x)
-        norm = np.sum(data)
-        return -(entropy_func(data / norm)).sum()
-
-
-def _x_log_2x(x):
-    return 0 if x == 0 else x * np.log2(x)
+        """
+        Compute the entropy of the histogram of the attribute values of every neighborhood.
+
+        The histograms of many neighborhoods are counted together with a single bincount over combined neighborhood
+        and bin numbers. Values are assigned to bins with the same rule as np.histogram, so the result is the same as
+        that of a histogram per neighborhood up to rounding. Like np.histogram, a neighborhood whose range is not finite
+        (for instance because of NaN values) or that has a minimum above its maximum raises a ValueError.
+        """
+        neighborhoods = Neighborhoods.from_lists(neighborhoods)
+        values = np.asarray(neighborhoods.gather(point_cloud, self.data_key), dtype=float)
+        lengths = neighborhoods.lengths
+        offsets = neighborhoods.local_offsets
+
+        data_min = neighborhoods.reduce(np.minimum, values) if self.min_val is None \
+            else np.full(len(neighborhoods), self.min_val, dtype=float)
+        data_max = neighborhoods.reduce(np.maximum, values) if self.max_val is None \
+            else np.full(len(neighborhoods), self.max_val, dtype=float)
+        with np.errstate(invalid='ignore'):
+            is_regular = np.isfinite(data_min) & np.isfinite(data_max) & (data_min <= data_max)
+            has_histogram = (lengths > 0) & is_regular & (data_min != data_max)
+        irregular = np.flatnonzero((lengths > 0) & ~is_regular)
+        if len(irregular) > 0:
+            i = irregular[0]
+            raise ValueError('The histogram range [{}, {}] of neighborhood {} is not finite or not increasing.'
+                             .format(data_min[i], data_max[i], i))
+        n_bins = np.zeros(len(neighborhoods), dtype=np.intp)
+        n_bins[has_histogram] = np.ceil((data_max[has_histogram] - data_min[has_histogram]) / self.layer_thickness)
+
+        entropy = np.zeros(len(neighborhoods))
+        for start, stop in _get_batches(n_bins):
+            batch_values = values[offsets[start]:offsets[stop]]
+            entropy[start:stop] = _get_entropies(batch_values, lengths[start:stop], data_min[start:stop],
+                                                 data_max[start:stop], n_bins[start:stop])
+        return entropy
+
+
+def _get_batches(n_bins):
+    """Split neighborhoods into consecutive ranges that have at most MAX_BINS_PER_BATCH bins (or a single one)."""
+    cumulative_bins = np.cumsum(n_bins)
+    start = 0
+    while start < len(n_bins):
+        bins_before = cumulative_bins[start - 1] if start > 0 else 0
+        stop = max(start + 1, np.searchsorted(cumulative_bins, bins_before + MAX_BINS_PER_BATCH, side='right'))
+        yield start, stop
+        start = stop
+
+
+def _get_entropies(values, lengths, data_min, data_max, n_bins):
+    """
+    Entropy of the histograms of the values of consecutive neighborhoods, 0 for neighborhoods without bins.
+
+    Bins are those of np.histogram(values, bins=n_bins, range=(data_min, data_max)) of each neighborhood, including
+    its correction of values that are within rounding of a bin edge.
+    """
+    entropy = np.zeros(len(lengths))
+    has_bins = n_bins > 0
+    if not np.any(has_bins):
+        return entropy
+
+    owners = np.repeat(np.arange(len(lengths)), lengths)
+    first_edge = data_min[owners]
+    last_edge = data_max[owners]
+    n_bins_of_values = n_bins[owners]
+    step = (data_max - data_min) / np.where(has_bins, n_bins, 1)
+    with np.errstate(invalid='ignore'):
+        is_kept = (n_bins_of_values > 0) & (values >= first_edge) & (values <= last_edge)
+    owners, values, first_edge, last_edge, n_bins_of_values = \
+        owners[is_kept], values[is_kept], first_edge[is_kept], last_edge[is_kept], n_bins_of_values[is_kept]
+
+    def get_edge(bin_index, row):
+        return np.where(bin_index == n_bins[row], data_max[row], bin_index * step[row] + data_min[row])
+
+    bin_indices = ((values - first_edge) / (last_edge - first_edge) * n_bins_of_values).astype(np.intp)
+    bin_indices[bin_indices == n_bins_of_values] -= 1
+    bin_indices[values < get_edge(bin_indices, owners)] -= 1
+    bin_indices[(values >= get_edge(bin_indices + 1, owners)) & (bin_indices != n_bins_of_values - 1)] += 1
+
+    bin_offsets = np.zeros(len(n_bins) + 1, dtype=np.intp)
+    np.cumsum(n_bins, out=bin_offsets[1:])
+    counts = np.bincount(bin_offsets[owners] + bin_indices, minlength=bin_offsets[-1])
+
+    bin_owners = np.repeat(np.arange(len(n_bins)), n_bins)
+    bin_numbers = np.arange(bin_offsets[-1]) - bin_offsets[bin_owners]
+    widths = get_edge(bin_numbers + 1, bin_owners) - get_edge(bin_numbers, bin_owners)
+    starts = bin_offsets[:-1][has_bins]
+    repeats = n_bins[has_bins]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        density = counts / widths / np.repeat(np.add.reduceat(counts, starts), repeats)
+        probabilities = density / np.repeat(np.add.reduceat(density, starts), repeats)
+        x_log_2x = np.where(probabilities == 0, 0, probabilities * np.log2(probabilities))
+    entropy[has_bins] = -np.add.reduceat(x_log_2x, starts)
+    return entropy
+
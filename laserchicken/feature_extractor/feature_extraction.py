@@ -1,18 +1,50 @@
 """Feature extractor module."""
+import collections
+import concurrent.futures
+import contextlib
 import copy
 import itertools
+import logging
+import math
+import os
 import sys
 import time
 
 import numpy as np
+from psutil import virtual_memory
 
 from laserchicken import utils
 from laserchicken.keys import point, provenance
+from laserchicken.compute_neighbors import compute_neighborhoods, AVAILABLE_MEMORY_FRACTION
+from laserchicken.neighborhoods import Neighborhoods, NeighborhoodCounts
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
 from laserchicken.feature_extractor.feature_map import create_default_feature_map, _create_name_extractor_pairs
+from laserchicken.feature_extractor.percentile_feature_extractor import PercentileFeatureExtractor, \
+    GroupedPercentileFeatureExtractor
+from laserchicken.feature_extractor.shared_point_cloud import SharedPointCloud
 
 FEATURES = create_default_feature_map()
 
+# Number of targets of which the features are computed at once, unless chosen otherwise
+DEFAULT_CHUNK_SIZE = 100000
+# Number of targets of the first chunk in automatic mode, whose neighborhood sizes are used to size the other chunks
+AUTO_FIRST_CHUNK_SIZE = 1000
+# Estimated memory used per neighbor while features of a chunk are computed by one thread: the indices, gathered
+# attribute values and temporary arrays of the extractors. All default features together peak at about 115 bytes.
+BYTES_PER_NEIGHBOR_IN_CHUNK = 128
+# Estimated memory used per target and per feature while features of a chunk are computed
+BYTES_PER_TARGET_IN_CHUNK = 64
+BYTES_PER_FEATURE_VALUE = 8
+
+# Maximum number of chunks that are submitted to worker processes but not yet collected
+CHUNKS_IN_FLIGHT = 2
+
+logger = logging.getLogger(__name__)
+
+# Environment point cloud of a worker process, attached to shared memory by _initialize_worker
+_worker_shared_environment = None
+_worker_environment = None
+
 
 def list_feature_names():
     return FEATURES  # [feature_name for feature_name in FEATURES]
@@ -23,7 +55,8 @@ def register_new_feature_extractor(extractor: FeatureExtractor):
         FEATURES[name] = extractor
 
 
-def compute_features(env_point_cloud, neighborhoods, target_point_cloud, feature_names, volume, verbose=True, **kwargs):
+def compute_features(env_point_cloud, neighborhoods, target_point_cloud, feature_names, volume, verbose=True, n_jobs=1,
+                     n_threads=1, chunk_size=DEFAULT_CHUNK_SIZE, memory_budget=None, **kwargs):
     """
     Compute features for each target and store result as point attributes in target point cloud.
 
@@ -40,18 +73,47 @@ def compute_features(env_point_cloud, neighborhoods, target_point_cloud, feature
 
     Results of the example above are stored in the target point cloud as extra point attributes.
 
+    Features are computed for chunks of targets at a time. Larger chunks have less overhead per chunk (and fewer
+    provenance entries), smaller chunks need less memory. With chunk_size='auto', the features of a first small chunk
+    are computed, after which the other chunks are sized so that their neighborhoods of the observed average size fit
+    within the memory budget.
+
+    With n_jobs > 1, the features of parts of each chunk of targets are computed by a pool of worker processes. The
+    point attributes of the environment point cloud are copied to shared memory once, so that the workers do not get
+    their own copy. The values and the provenance are the same as when the features are computed in this process.
+
+    With n_threads > 1, extractors of the same chunk of targets that do not depend on each other's features are run
+    concurrently by a pool of threads, which helps because most of their work is done by numpy without holding the
+    global interpreter lock. Keyword arguments are set on copies of the registered extractors, so that concurrent
+    calls in one process do not affect each other.
+
     :param env_point_cloud: environment point cloud
-    :param neighborhoods: list of neighborhoods which are themselves lists of indices referring to the environment
+    :param neighborhoods: list of neighborhoods which are themselves lists of indices referring to the environment,
+                          a Neighborhoods object as returned by compute_neighborhoods(..., as_csr=True), an integer
+                          array of neighborhood sizes as returned by compute_neighborhoods(..., count_only=True) if
+                          all features only need counts, or None to compute the neighborhoods of the given volume
+                          here. If all features only need counts (see FeatureExtractor.needs_only_counts), the
+                          points of neighborhoods that are computed here are only counted, and the extractors get
+                          just the sizes of given neighborhoods.
     :param target_point_cloud: point cloud of targets
     :param feature_names: list of features that are to be calculated
     :param volume: object describing the volume that contains the neighborhood points
     :param kwargs: keyword arguments for the individual feature extractors
     :param verbose: if true, output extra information
+    :param n_jobs: number of worker processes that compute features; 1 (default) computes them in this process and
+                   -1 uses all cores
+    :param n_threads: number of threads (per process) that run independent extractors of a chunk concurrently; 1
+                      (default) runs them one after another and -1 uses as many threads as there are cores
+    :param chunk_size: number of targets of which the features are computed at once, or 'auto' to size chunks from
+                       the memory budget
+    :param memory_budget: number of bytes that computing the features of a chunk may use in automatic mode; if None
+                          (default), a fraction of the currently available memory is used
     :return: None, results are stored in attributes of the target point cloud
     """
-    _verify_feature_names(feature_names)
+    extended_features, plan, chunks, n_jobs, n_threads = _prepare_run(
+        env_point_cloud, neighborhoods, target_point_cloud, feature_names, volume, n_jobs, n_threads, chunk_size,
+        memory_budget, kwargs)
     wanted_feature_names = feature_names + [existing_feature for existing_feature in target_point_cloud[point]]
-    extended_features = _make_extended_feature_list(feature_names)
 
     for feature_name in extended_features:
         target_point_cloud[point][feature_name] = {"type": 'float64',
@@ -62,47 +124,375 @@ def compute_features(env_point_cloud, neighborhoods, target_point_cloud, feature
         utils.add_metadata(target_point_cloud, sys.modules[__name__],
                            {'env_point_cloud': {provenance: copy.copy(env_point_cloud[provenance])}})
 
-    _add_features(extended_features, env_point_cloud, neighborhoods, target_point_cloud, volume, verbose, kwargs)
+    for target_range, feature_values, chunk_provenance in _compute_all_chunks(
+            plan, env_point_cloud, chunks, target_point_cloud, volume, verbose, n_jobs, n_threads):
+        for feature_name, values in feature_values.items():
+            target_point_cloud[point][feature_name]['data'][target_range.start:target_range.stop] = values
+        target_point_cloud.setdefault(provenance, []).extend(chunk_provenance)
 
     _keep_only_wanted_features(target_point_cloud, wanted_feature_names)
 
 
-def _add_features(extended_features, env_point_cloud, neighborhoods, target_point_cloud, volume, verbose, kwargs):
-    chunk_size = 100000
-    n_targets = _get_point_cloud_size(target_point_cloud)
-    for chunk_no in range(_calculate_number_of_chunks(chunk_size, n_targets)):
-        i_start = chunk_no * chunk_size
-        i_end = min((chunk_no + 1) * chunk_size, n_targets)
-        target_indices = np.arange(i_start, i_end)
-        current_neighborhoods = list(itertools.islice(neighborhoods, i_end - i_start))
+def compute_features_in_chunks(env_point_cloud, neighborhoods, target_point_cloud, feature_names, volume, verbose=True,
+                               n_jobs=1, n_threads=1, chunk_size=DEFAULT_CHUNK_SIZE, memory_budget=None, **kwargs):
+    """
+    Compute features for chunks of targets, yielding the values of each chunk as soon as they are computed.
+
+    Unlike compute_features, the target point cloud is not changed: no feature attributes are added for all targets
+    and no provenance is recorded. This makes it possible to write results to disk one chunk at a time, to report
+    progress, or to compute features of more targets than their feature values would fit in memory. The neighborhoods
+    are consumed one chunk at a time if they are given as a generator.
+
+    Example:
+    >>> for target_range, values in compute_features_in_chunks(point_cloud, neighborhoods, targets,
+    >>>                                                        ['mean_z', 'std_z'], volume):
+    >>>     write_block(target_range.start, values['mean_z'], values['std_z'])
+
+    :param env_point_cloud: environment point cloud
+    :param neighborhoods: neighborhoods of the targets, like for compute_features
+    :param target_point_cloud: point cloud of targets
+    :param feature_names: list of features that are to be calculated
+    :param volume: object describing the volume that contains the neighborhood points
+    :param verbose: if true, output extra information
+    :param n_jobs: number of worker processes, like for compute_features
+    :param n_threads: number of threads that run independent extractors, like for compute_features
+    :param chunk_size: number of targets per chunk, or 'auto' to size chunks from the memory budget
+    :param memory_budget: number of bytes that computing the features of a chunk may use in automatic mode
+    :param kwargs: keyword arguments for the individual feature extractors
+    :return: generator of (range of target indices, dictionary with an array of values for each requested feature)
+    """
+    _, plan, chunks, n_jobs, n_threads = _prepare_run(env_point_cloud, neighborhoods, target_point_cloud, feature_names,
+                                                      volume, n_jobs, n_threads, chunk_size, memory_budget, kwargs)
+    return _generate_feature_chunks(feature_names, plan, env_point_cloud, chunks, target_point_cloud, volume, verbose,
+                                    n_jobs, n_threads)
+
+
+def _prepare_run(env_point_cloud, neighborhoods, target_point_cloud, feature_names, volume, n_jobs, n_threads,
+                 chunk_size, memory_budget, kwargs):
+    """
+    Check the arguments and plan the extractors and chunks of targets of a feature computation.
+
+    :return: extended feature list, plan of extractors, generator of chunks, number of jobs and number of threads
+    """
+    _verify_feature_names(feature_names)
+    n_jobs = _get_number_of_workers(n_jobs, 'jobs')
+    n_threads = _get_number_of_workers(n_threads, 'threads')
+    _verify_chunk_size(chunk_size)
+    extended_features = _make_extended_feature_list(feature_names)
+    extractors = _get_configured_extractors(extended_features, kwargs)
+    plan = _plan_extractors(extended_features, extractors, kwargs)
+    count_only = all(extractor.needs_only_counts(volume) for extractor in extractors.values())
+    neighborhoods = _get_neighborhoods(env_point_cloud, neighborhoods, target_point_cloud, extractors, volume,
+                                       count_only)
+    chunks = _iterate_chunks(neighborhoods, _get_point_cloud_size(target_point_cloud), chunk_size, memory_budget,
+                             len(extended_features), n_threads, count_only)
+    return extended_features, plan, chunks, n_jobs, n_threads
+
+
+def _generate_feature_chunks(feature_names, plan, env_point_cloud, chunks, target_point_cloud, volume, verbose, n_jobs,
+                             n_threads):
+    computed_chunks = _compute_all_chunks(plan, env_point_cloud, chunks, target_point_cloud, volume, verbose, n_jobs,
+                                          n_threads)
+    for target_range, feature_values, _ in computed_chunks:
+        yield target_range, {feature_name: feature_values[feature_name] for feature_name in feature_names}
+
+
+def _compute_all_chunks(plan, env_point_cloud, chunks, target_point_cloud, volume, verbose, n_jobs, n_threads):
+    """
+    Compute the features of all chunks, in this process or in a pool of worker processes.
+
+    This is the single implementation behind compute_features and compute_features_in_chunks.
+
+    :return: generator of (range of target indices, feature values, provenance) of each chunk
+    """
+    if n_jobs == 1:
+        return _compute_chunks(plan, env_point_cloud, chunks, target_point_cloud, volume, verbose, n_threads)
+    return _compute_chunks_in_parallel(plan, env_point_cloud, chunks, target_point_cloud, volume, verbose, n_jobs,
+                                       n_threads)
+
+
+def _get_configured_extractors(feature_names, kwargs):
+    """
+    Get copies of the registered extractors of the features, with the keyword arguments set as their attributes.
+
+    Features that are provided by the same registered extractor get the same copy. The registered extractors in
+    FEATURES are not changed, so that the keyword arguments of one call do not leak into other (concurrent) calls.
+    """
+    copies = {}
+    extractors = {}
+    for feature_name in feature_names:
+        registered = FEATURES[feature_name]
+        if id(registered) not in copies:
+            copies[id(registered)] = _configure_extractor(copy.copy(registered), kwargs)
+        extractors[feature_name] = copies[id(registered)]
+    return extractors
 
-        features_to_do = list(extended_features)
 
-        _compute_features_for_chunk(features_to_do, env_point_cloud, current_neighborhoods, target_point_cloud,
-                                    target_indices, volume, verbose, kwargs)
+def _configure_extractor(extractor, kwargs):
+    for key_word in kwargs:
+        setattr(extractor, key_word, kwargs[key_word])
+    return extractor
+
+
+def _plan_extractors(extended_features, extractors, kwargs):
+    """
+    Get the extractors that compute the features, in the order in which they are run for every chunk.
+
+    :param extended_features: features in the order of _make_extended_feature_list
+    :param extractors: configured extractor of each feature
+    :param kwargs: keyword arguments for extractors that are combined here, like grouped percentiles
+    :return: list of extractors
+    """
+    features_to_do = list(extended_features)
+    plan = []
+    while features_to_do:
+        extractor = _get_extractor(features_to_do[0], features_to_do, extractors)
+        if extractor is not extractors[features_to_do[0]]:
+            _configure_extractor(extractor, kwargs)
+        plan.append(extractor)
+        for provided_feature in extractor.provides():
+            if provided_feature in features_to_do:
+                features_to_do.remove(provided_feature)
+    return plan
+
+
+def _get_neighborhoods(env_point_cloud, neighborhoods, target_point_cloud, extractors, volume, count_only):
+    """
+    Compute the neighborhoods if they were not given, and wrap neighborhood counts.
+
+    If all extractors only need counts, neighborhoods are only counted when they are computed here, and a given
+    Neighborhoods object is reduced to its counts.
+    """
+    feature_names = list(extractors)
+    if neighborhoods is None:
+        neighborhoods = compute_neighborhoods(env_point_cloud, target_point_cloud, volume, count_only=count_only)
+    if isinstance(neighborhoods, np.ndarray) and neighborhoods.ndim == 1 and \
+            np.issubdtype(neighborhoods.dtype, np.integer):
+        if not count_only:
+            raise ValueError('Neighborhood counts were given, but not all of the features {} can be computed from '
+                             'counts only.'.format(feature_names))
+        return NeighborhoodCounts(neighborhoods)
+    if count_only and isinstance(neighborhoods, Neighborhoods):
+        return NeighborhoodCounts(neighborhoods.lengths)
+    return neighborhoods
+
+
+def _iterate_chunks(neighborhoods, n_targets, chunk_size, memory_budget, n_features, n_threads, count_only=False):
+    """
+    Generate the target range and neighborhoods of consecutive chunks of targets.
+
+    In automatic mode, the size of the chunks after the first is planned from the neighborhoods of the first chunk.
+    With count_only, neighborhoods that are given as lists are only counted.
+
+    :return: generator of (i_start, i_end, neighborhoods of the chunk)
+    """
+    if not isinstance(neighborhoods, (Neighborhoods, NeighborhoodCounts)):
+        neighborhoods = iter(neighborhoods)
+    is_auto = chunk_size == 'auto'
+    current_size = AUTO_FIRST_CHUNK_SIZE if is_auto else chunk_size
+    i_start = 0
+    while i_start < n_targets:
+        i_end = min(i_start + current_size, n_targets)
+        current_neighborhoods = _get_neighborhoods_chunk(neighborhoods, i_start, i_end, count_only)
+        if is_auto and i_start == 0:
+            current_size = _plan_chunk_size(current_neighborhoods, n_targets, n_features, n_threads, memory_budget)
+        yield i_start, i_end, current_neighborhoods
+        i_start = i_end
+
+
+def _plan_chunk_size(sample_neighborhoods, n_targets, n_features, n_threads, memory_budget=None):
+    """
+    Choose the number of targets per chunk so that computing the features of a chunk fits within the memory budget.
+
+    :param sample_neighborhoods: neighborhoods (or counts) of a sample of the targets, like the first chunk
+    :param n_targets: total number of targets
+    :param n_features: number of features that are computed
+    :param n_threads: number of extractors that may run at the same time
+    :param memory_budget: number of bytes per chunk; if None, a fraction of the currently available memory is used
+    :return: number of targets per chunk
+    """
+    if memory_budget is None:
+        memory_budget = AVAILABLE_MEMORY_FRACTION * virtual_memory().available
+    lengths = sample_neighborhoods.lengths
+    neighbors_per_target = 0. if isinstance(sample_neighborhoods, NeighborhoodCounts) or len(lengths) == 0 \
+        else float(np.mean(lengths))
+    bytes_per_target = neighbors_per_target * BYTES_PER_NEIGHBOR_IN_CHUNK * n_threads + BYTES_PER_TARGET_IN_CHUNK + \
+        n_features * BYTES_PER_FEATURE_VALUE
+    chunk_size = int(min(max(math.floor(memory_budget / bytes_per_target), 1), max(n_targets, 1)))
+    logger.info('Feature extraction plan: %.1f neighbors per target, memory budget %d bytes, %d targets in chunks '
+                'of %d', neighbors_per_target, memory_budget, n_targets, chunk_size)
+    return chunk_size
+
+
+def _create_thread_pool(n_threads):
+    """Thread pool to run extractors concurrently, or a context without pool (None) for a single thread."""
+    if n_threads == 1:
+        return contextlib.nullcontext()
+    return concurrent.futures.ThreadPoolExecutor(n_threads)
+
+
+def _compute_chunks(plan, env_point_cloud, chunks, target_point_cloud, volume, verbose, n_threads):
+    """
+    Compute the features of chunks in this process, each on its own point cloud with the targets of the chunk.
+
+    :return: generator of (range of target indices, feature values, provenance) of each chunk
+    """
+    with _create_thread_pool(n_threads) as thread_pool:
+        for i_start, i_end, current_neighborhoods in chunks:
+            target_chunk = _get_target_chunk(target_point_cloud, i_start, i_end, _get_planned_features(plan))
+            feature_values, chunk_provenance = _compute_target_chunk(plan, env_point_cloud, current_neighborhoods,
+                                                                     target_chunk, volume, verbose, thread_pool)
+            yield range(i_start, i_end), feature_values, chunk_provenance
+
+
+def _compute_chunks_in_parallel(plan, env_point_cloud, chunks, target_point_cloud, volume, verbose, n_jobs, n_threads):
+    """
+    Compute the features of chunks in a pool of worker processes, splitting each chunk in n_jobs parts.
+
+    Chunks are submitted and collected in order, with a limited number of chunks in flight so that a neighborhoods
+    generator is not consumed much ahead of the workers. The provenance that the workers record for the first part of
+    a chunk is used as the provenance of the chunk, which gives the same log as computing the chunk at once.
+
+    :return: generator of (range of target indices, feature values, provenance) of each chunk
+    """
+    planned_features = _get_planned_features(plan)
+    with SharedPointCloud(env_point_cloud) as shared_environment, \
+            concurrent.futures.ProcessPoolExecutor(n_jobs, initializer=_initialize_worker,
+                                                   initargs=(shared_environment,)) as executor:
+        in_flight = collections.deque()
+        for i_start, i_end, chunk_neighborhoods in chunks:
+            part_size = int(np.ceil((i_end - i_start) / n_jobs))
+            parts = []
+            for part_start in range(i_start, i_end, part_size):
+                part_end = min(part_start + part_size, i_end)
+                part_neighborhoods = _get_compact_part(chunk_neighborhoods, part_start - i_start, part_end - i_start)
+                part_targets = _get_target_chunk(target_point_cloud, part_start, part_end, planned_features)
+                future = executor.submit(_compute_features_in_worker, plan, part_neighborhoods, part_targets, volume,
+                                         n_threads)
+                parts.append((range(part_start, part_end), future))
+            in_flight.append((range(i_start, i_end), parts))
+            if len(in_flight) >= CHUNKS_IN_FLIGHT:
+                yield _collect_chunk(*in_flight.popleft(), verbose)
+        while in_flight:
+            yield _collect_chunk(*in_flight.popleft(), verbose)
+
+
+def _get_compact_part(chunk_neighborhoods, i_start, i_end):
+    """Get the neighborhoods of part of a chunk without references to those of other parts, to be pickled."""
+    part = chunk_neighborhoods[i_start:i_end]
+    if isinstance(part, Neighborhoods):
+        return Neighborhoods.from_lengths(part.lengths, part.flat_indices)
+    return part
+
+
+def _get_target_chunk(target_point_cloud, i_start, i_end, excluded_attributes=()):
+    """Get a point cloud with the targets of a chunk, with copies of their attributes except the excluded ones."""
+    return {point: {name: {'type': attribute.get('type'), 'data': np.asarray(attribute['data'])[i_start:i_end].copy()}
+                    for name, attribute in target_point_cloud[point].items() if name not in excluded_attributes}}
+
+
+def _get_planned_features(plan):
+    return [feature_name for extractor in plan for feature_name in extractor.provides()]
+
+
+def _compute_target_chunk(plan, env_point_cloud, neighborhoods, target_chunk, volume, verbose, thread_pool):
+    """
+    Compute the features of all targets of a point cloud with the targets of a chunk.
+
+    :return: dictionary with the values of each computed feature, and the provenance recorded by the extractors
+    """
+    n_targets = _get_point_cloud_size(target_chunk)
+    planned_features = _get_planned_features(plan)
+    for feature_name in planned_features:
+        target_chunk[point][feature_name] = {"type": 'float64', "data": np.zeros(n_targets, dtype=float)}
+    _compute_features_for_chunk(plan, env_point_cloud, neighborhoods, target_chunk, np.arange(n_targets), volume,
+                                verbose, thread_pool)
+    feature_values = {feature_name: target_chunk[point][feature_name]['data'] for feature_name in planned_features}
+    return feature_values, target_chunk.get(provenance, [])
+
+
+def _collect_chunk(target_range, parts, verbose):
+    """Wait for the parts of a chunk and combine their results."""
+    part_results = []
+    for part_range, future in parts:
+        feature_values, part_provenance, elapsed = future.result()
+        part_results.append((feature_values, part_provenance))
+        if verbose:
+            sys.stdout.write('Extracting features of targets {} to {} took {:.2f} seconds\n'
+                             .format(part_range.start, part_range.stop, elapsed))
+    feature_values = {feature_name: np.concatenate([values[feature_name] for values, _ in part_results])
+                      for feature_name in part_results[0][0]}
+    return target_range, feature_values, part_results[0][1]
+
+
+def _initialize_worker(shared_environment):
+    """Attach a worker process to the shared environment."""
+    global _worker_shared_environment, _worker_environment
+    _worker_shared_environment = shared_environment
+    _worker_environment = shared_environment.attach()
+
+
+def _compute_features_in_worker(plan, neighborhoods, target_chunk, volume, n_threads):
+    start = time.time()
+    with _create_thread_pool(n_threads) as thread_pool:
+        feature_values, chunk_provenance = _compute_target_chunk(plan, _worker_environment, neighborhoods,
+                                                                 target_chunk, volume, False, thread_pool)
+    return feature_values, chunk_provenance, time.time() - start
+
+
+def _get_number_of_workers(n_workers, kind):
+    if n_workers == -1:
+        return os.cpu_count() or 1
+    if not isinstance(n_workers, (int, np.integer)) or n_workers < 1:
+        raise ValueError('The number of {} should be a positive integer or -1, got {}.'.format(kind, n_workers))
+    return int(n_workers)
+
+
+def _get_neighborhoods_chunk(neighborhoods, i_start, i_end, count_only=False):
+    """
+    Get the neighborhoods of a chunk of targets as a new Neighborhoods object, or only their counts.
+
+    Each chunk gets its own object, so that the attribute values that its extractors gather are cached for exactly the
+    duration of the chunk.
+    """
+    if isinstance(neighborhoods, (Neighborhoods, NeighborhoodCounts)):
+        return neighborhoods[i_start:i_end]
+    chunk = itertools.islice(neighborhoods, i_end - i_start)
+    if count_only:
+        return NeighborhoodCounts(np.fromiter((len(neighborhood) for neighborhood in chunk), dtype=np.int64))
+    return Neighborhoods.from_lists(chunk)
 
 
 def _get_point_cloud_size(target_point_cloud):
     return len(target_point_cloud[point]['x']['data'])
 
 
-def _calculate_number_of_chunks(chunk_size, n_targets):
-    return int(np.ceil(n_targets / chunk_size))
+def _verify_chunk_size(chunk_size):
+    if chunk_size == 'auto':
+        return
+    if not isinstance(chunk_size, (int, np.integer)) or chunk_size < 1:
+        raise ValueError("The chunk size should be a positive integer or 'auto', got {}.".format(chunk_size))
 
 
-def _compute_features_for_chunk(features_to_do, env_point_cloud, current_neighborhoods, target_point_cloud,
-                                target_indices, volume,
-                                verbose, kwargs):
-    while features_to_do:
-        feature_name = features_to_do[0]
-        extractor = FEATURES[feature_name]
+def _compute_features_for_chunk(plan, env_point_cloud, current_neighborhoods, target_point_cloud, target_indices,
+                                volume, verbose, thread_pool=None):
+    """
+    Run the extractors of the plan on a chunk of targets, one after another or concurrently in a thread pool.
 
+    Provenance is added in the order of the plan in both cases.
+    """
+    if thread_pool is not None:
+        _run_extractors_concurrently(plan, env_point_cloud, current_neighborhoods, target_point_cloud,
+                                     target_indices, volume, verbose, thread_pool)
+        for extractor in plan:
+            utils.add_metadata(target_point_cloud, type(extractor).__module__, extractor.get_params())
+        return
+
+    for extractor in plan:
         if verbose:
             sys.stdout.write('Extracting feature(s) "{}"'.format(extractor.provides()))
             start = time.time()
 
-        for key_word in kwargs:
-            setattr(extractor, key_word, kwargs[key_word])
         _add_features_from_single_extractor(extractor, env_point_cloud, current_neighborhoods, target_point_cloud,
                                             target_indices, volume)
         utils.add_metadata(target_point_cloud, type(extractor).__module__, extractor.get_params())
@@ -111,13 +501,50 @@ def _compute_features_for_chunk(features_to_do, env_point_cloud, current_neighbo
             elapsed = time.time() - start
             sys.stdout.write('Extracting feature(s) "{}" took {:.2f} seconds\n'.format(extractor.provides(), elapsed))
 
-        for provided_feature in extractor.provides():
-            if provided_feature in features_to_do:
-                features_to_do.remove(provided_feature)
+
+def _run_extractors_concurrently(plan, env_point_cloud, current_neighborhoods, target_point_cloud, target_indices,
+                                 volume, verbose, thread_pool):
+    """
+    Run each extractor of the plan as soon as the extractors of the features it requires are done.
+
+    Only extractors earlier in the plan are waited for, like they are when the plan is run one after another.
+    """
+    provider_of = {feature_name: i for i, extractor in enumerate(plan) for feature_name in extractor.provides()}
+    dependencies = [{provider_of[required] for required in extractor.requires()
+                     if provider_of.get(required, i) < i} for i, extractor in enumerate(plan)]
+    done = set()
+    running = {}
+    while len(done) < len(plan):
+        started = set(running.values())
+        for i, extractor in enumerate(plan):
+            if i not in done and i not in started and dependencies[i] <= done:
+                running[thread_pool.submit(_add_features_from_single_extractor, extractor, env_point_cloud,
+                                           current_neighborhoods, target_point_cloud, target_indices, volume,
+                                           verbose)] = i
+        finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in finished:
+            future.result()
+            done.add(running.pop(future))
+
+
+def _get_extractor(feature_name, features_to_do, extractors=None):
+    """Get the extractor of a feature, combining all percentiles of the same attribute that are to do into one."""
+    if extractors is None:
+        extractors = FEATURES
+    extractor = extractors[feature_name]
+    if type(extractor) is not PercentileFeatureExtractor:
+        return extractor
+    percentile_extractors = [extractors[name] for name in features_to_do
+                             if type(extractors[name]) is PercentileFeatureExtractor]
+    percentiles = [other.percentile for other in percentile_extractors if other.data_key == extractor.data_key]
+    if len(percentiles) < 2:
+        return extractor
+    return GroupedPercentileFeatureExtractor(percentiles, extractor.data_key)
 
 
 def _add_features_from_single_extractor(extractor, env_point_cloud, current_neighborhoods, target_point_cloud,
-                                        target_indices, volume):
+                                        target_indices, volume, verbose=False):
+    start = time.time()
     provided_features = extractor.provides()
     n_features = len(provided_features)
     point_values = extractor.extract(env_point_cloud, current_neighborhoods, target_point_cloud,
@@ -133,6 +560,12 @@ def _add_features_from_single_extractor(extractor, env_point_cloud, current_neig
     for i in range(n_features):
         feature = provided_features[i]
         target_point_cloud[point][feature]['data'][target_indices] = feature_values[i]
+    # Values of these features that were gathered before (if the target is also the environment) are outdated now
+    if isinstance(current_neighborhoods, Neighborhoods):
+        current_neighborhoods.clear_gathered(provided_features)
+    if verbose:
+        sys.stdout.write('Extracting feature(s) "{}" took {:.2f} seconds\n'.format(provided_features,
+                                                                                   time.time() - start))
 
 
 def _keep_only_wanted_features(target_point_cloud, wanted_feature_names):
@@ -152,21 +585,21 @@ def _verify_feature_names(feature_names):
 
 
 def _make_extended_feature_list(feature_names):
-    feature_list = reversed(_make_extended_feature_list_helper(feature_names))
-    return _remove_duplicates(feature_list)
-
-
-def _remove_duplicates(feature_list):
-    seen = set()
-    return [f for f in feature_list if not (f in seen or seen.add(f))]
-
+    """
+    List the requested features, the features they depend on and the other features provided by the same extractors.
 
-def _make_extended_feature_list_helper(feature_names):
-    feature_list = list(feature_names)
+    Features come after the features they require, so that they can be computed in the order of the list.
+    """
+    feature_list = []
     for feature_name in feature_names:
-        extractor = FEATURES[feature_name]
-        dependencies = extractor.requires()
-        feature_list.extend(dependencies)
-        feature_list.extend(_make_extended_feature_list_helper(dependencies))
-        feature_list.extend(extractor.provides())
+        _add_feature_with_dependencies(feature_name, feature_list)
     return feature_list
+
+
+def _add_feature_with_dependencies(feature_name, feature_list):
+    if feature_name in feature_list:
+        return
+    extractor = FEATURES[feature_name]
+    for dependency in extractor.requires():
+        _add_feature_with_dependencies(dependency, feature_list)
+    feature_list.extend(provided for provided in extractor.provides() if provided not in feature_list)
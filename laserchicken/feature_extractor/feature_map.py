@@ -1,9 +1,9 @@
 from laserchicken import keys
-from laserchicken.feature_extractor.band_ratio_feature_extractor import BandRatioFeatureExtractor
+from laserchicken.feature_extractor.band_ratio_feature_extractor import BandRatioSetFeatureExtractor
 from .density_absolute_mean_feature_extractor import DensityAbsoluteMeanFeatureExtractor
 from .density_feature_extractor import PointDensityFeatureExtractor
 from .echo_ratio_feature_extractor import EchoRatioFeatureExtractor
-from .eigenvals_feature_extractor import EigenValueVectorizeFeatureExtractor
+from .eigenvals_feature_extractor import EigenValueVectorizeFeatureExtractor, EigenGeometryFeatureExtractor
 from .entropy_feature_extractor import EntropyFeatureExtractor
 from .kurtosis_feature_extractor import KurtosisFeatureExtractor
 from .mean_std_coeff_feature_extractor import MeanStdCoeffFeatureExtractor
@@ -36,6 +36,7 @@ def _get_default_extractors():
     return [PointDensityFeatureExtractor(),
             EchoRatioFeatureExtractor(),
             EigenValueVectorizeFeatureExtractor(),
+            EigenGeometryFeatureExtractor(),
             EntropyFeatureExtractor(),
             EntropyFeatureExtractor(data_key=keys.normalized_height),
             PulsePenetrationFeatureExtractor(),
@@ -56,9 +57,6 @@ def _get_default_extractors():
             RangeFeatureExtractor(data_key=keys.intensity),
             DensityAbsoluteMeanFeatureExtractor(),
             DensityAbsoluteMeanFeatureExtractor(data_key=keys.normalized_height),
-            BandRatioFeatureExtractor(None, 1, data_key=keys.normalized_height),
-            BandRatioFeatureExtractor(1, 2, data_key=keys.normalized_height),
-            BandRatioFeatureExtractor(2, 3, data_key=keys.normalized_height),
-            BandRatioFeatureExtractor(3, None, data_key=keys.normalized_height)] \
+            BandRatioSetFeatureExtractor([None, 1, 2, 3, None], data_key=keys.normalized_height)] \
            + [PercentileFeatureExtractor(percentile=p) for p in range(1, 101)] \
            + [PercentileFeatureExtractor(percentile=p, data_key=keys.normalized_height) for p in range(1, 101)]
@@ -0,0 +1,71 @@
+"""Which points of a point cloud are ground points, shared by the feature extractors that separate ground points."""
+import collections
+import threading
+import weakref
+
+import numpy as np
+
+from laserchicken.kd_tree import _get_fingerprint
+from laserchicken.keys import point
+
+# classification according to
+# http://www.asprs.org/wp-content/uploads/2010/12/LAS_1-4_R6.pdf
+GROUND_TAGS = [2]
+
+_cache = {}
+_lock = threading.Lock()
+
+_CacheEntry = collections.namedtuple('_CacheEntry', ['classification', 'fingerprint', 'mask'])
+
+
+def get_ground_mask(point_cloud, ground_tags=GROUND_TAGS):
+    """
+    Get for every point of a point cloud whether its raw_classification is one of the ground tags.
+
+    The mask is computed once per classification array and set of tags, and is kept until the array is garbage
+    collected. A fingerprint of a sample of the classification is checked on every call, so that the mask is computed
+    again if the sampled values were changed in place. Other changes in place are not detected; replace the
+    classification array instead.
+
+    :param point_cloud: point cloud with a raw_classification attribute
+    :param ground_tags: classification values of ground points
+    :return: read only boolean array with a value for every point
+    """
+    classification = point_cloud[point]['raw_classification']['data']
+    if not isinstance(classification, np.ndarray):
+        return np.isin(classification, ground_tags)
+
+    tags = tuple(sorted(set(ground_tags)))
+    key = (id(classification), tags)
+    fingerprint = _get_fingerprint([classification])
+    with _lock:
+        entry = _cache.get(key)
+    if entry is not None and entry.classification() is classification and entry.fingerprint == fingerprint:
+        return entry.mask
+
+    mask = np.isin(classification, tags)
+    mask.flags.writeable = False
+    with _lock:
+        if key not in _cache:
+            weakref.finalize(classification, _remove, key)
+        _cache[key] = _CacheEntry(weakref.ref(classification), fingerprint, mask)
+    return mask
+
+
+def get_ground_per_neighbor(point_cloud, neighborhoods, ground_tags=GROUND_TAGS):
+    """
+    Get whether each point of each neighborhood is a ground point.
+
+    :param point_cloud: environment point cloud with a raw_classification attribute
+    :param neighborhoods: Neighborhoods object
+    :param ground_tags: classification values of ground points
+    :return: boolean array aligned with neighborhoods.flat_indices
+    """
+    if len(neighborhoods.flat_indices) == 0:
+        return np.zeros(0, dtype=bool)
+    return get_ground_mask(point_cloud, ground_tags)[neighborhoods.flat_indices]
+
+
+def _remove(key):
+    with _lock:
+        _cache.pop(key, None)
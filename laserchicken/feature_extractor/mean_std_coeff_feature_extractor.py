@@ -1,7 +1,7 @@
 import numpy as np
 
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
-from laserchicken.keys import point
+from laserchicken.feature_extractor.moments import get_moments
 
 
 class MeanStdCoeffFeatureExtractor(FeatureExtractor):
@@ -18,14 +18,8 @@ class MeanStdCoeffFeatureExtractor(FeatureExtractor):
         return [base + str(self.data_key) for base in base_names]
 
     def extract(self, point_cloud, neighborhoods, target_point_cloud, target_indices, volume_description):
-        return np.array([self._extract_one(point_cloud, neighborhood) for neighborhood in neighborhoods]).T
-
-    def _extract_one(self, sourcepc, neighborhood):
-        if neighborhood:
-            z = sourcepc[point][self.data_key]['data'][neighborhood]
-            mean_z = np.mean(z)
-            std_z = np.std(z)
-            coeff_var_z = std_z / mean_z
-        else:
-            mean_z = std_z = coeff_var_z = np.nan
-        return mean_z, std_z, coeff_var_z
+        moments = get_moments(point_cloud, neighborhoods, self.data_key)
+        std = np.sqrt(moments.m2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            coeff_var = std / moments.mean
+        return np.array([moments.mean, std, coeff_var])
@@ -1,7 +1,7 @@
 import numpy as np
 
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
-from laserchicken.keys import point
+from laserchicken.utils import get_attribute_values_per_neighborhood
 
 
 class MedianFeatureExtractor(FeatureExtractor):
@@ -17,11 +17,12 @@ class MedianFeatureExtractor(FeatureExtractor):
         return ['median_' + self.data_key]
 
     def extract(self, point_cloud, neighborhoods, target_point_cloud, target_indices, volume_description):
-        return [self._extract_one(point_cloud, neighborhood) for neighborhood in neighborhoods]
+        values_per_neighborhood = get_attribute_values_per_neighborhood(point_cloud, neighborhoods, self.data_key)
+        return [self._extract_one(values) for values in values_per_neighborhood]
 
-    def _extract_one(self, point_cloud, neighborhood):
-        if neighborhood:
-            source_data = point_cloud[point][self.data_key]['data'][neighborhood]
+    @staticmethod
+    def _extract_one(source_data):
+        if len(source_data) > 0:
             median = np.median(source_data)
         else:
             median = np.nan
@@ -0,0 +1,79 @@
+"""Central moments of attribute values per neighborhood, shared by the moment based feature extractors."""
+import collections
+
+import numpy as np
+
+from laserchicken.neighborhoods import Neighborhoods
+
+Moments = collections.namedtuple('Moments', ['n', 'mean', 'm2', 'm3', 'm4'])
+
+
+def get_moments(point_cloud, neighborhoods, data_key):
+    """
+    Get the number of points, the mean and the 2nd, 3rd and 4th central moments of an attribute per neighborhood.
+
+    The central moments are the means of the powers of the deviations from the mean, like numpy.var and
+    scipy.stats.moment (without bias correction). All neighborhoods are done at once with segmented sums over the
+    flat values. Deviations are taken from the mean first, which is numerically stable for attributes with a large
+    offset like heights above sea level. Empty neighborhoods get NaN values.
+
+    If neighborhoods is a Neighborhoods object, the result is cached on it, so that all extractors of the same chunk
+    share a single computation per attribute.
+
+    :param point_cloud: environment point cloud
+    :param neighborhoods: list of lists of indices, or a Neighborhoods object
+    :param data_key: name of the attribute
+    :return: Moments tuple of arrays with one value per neighborhood
+    """
+    neighborhoods = Neighborhoods.from_lists(neighborhoods)
+    values = neighborhoods.gather(point_cloud, data_key)
+    return neighborhoods.get_derived('moments', values, lambda: _compute_moments(neighborhoods, values))
+
+
+def get_mean(point_cloud, neighborhoods, data_key):
+    """
+    Get the mean of an attribute per neighborhood, without computing the higher moments.
+
+    The mean is cached on Neighborhoods objects like the moments, and is shared with get_moments.
+
+    :param point_cloud: environment point cloud
+    :param neighborhoods: list of lists of indices, or a Neighborhoods object
+    :param data_key: name of the attribute
+    :return: array with one value per neighborhood, NaN for empty neighborhoods
+    """
+    neighborhoods = Neighborhoods.from_lists(neighborhoods)
+    values = neighborhoods.gather(point_cloud, data_key)
+    return _get_mean(neighborhoods, values)
+
+
+def _get_mean(neighborhoods, values):
+    def compute():
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return neighborhoods.reduce(np.add, np.asarray(values, dtype=float)) / neighborhoods.lengths
+    return neighborhoods.get_derived('mean', values, compute)
+
+
+def _compute_moments(neighborhoods, values):
+    n = neighborhoods.lengths
+    mean = _get_mean(neighborhoods, values)
+    values = np.asarray(values, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        deviations = values - np.repeat(mean, n)
+        squared_deviations = deviations ** 2
+        m2 = neighborhoods.reduce(np.add, squared_deviations) / n
+        m3 = neighborhoods.reduce(np.add, squared_deviations * deviations) / n
+        m4 = neighborhoods.reduce(np.add, squared_deviations ** 2) / n
+    return Moments(n, mean, m2, m3, m4)
+
+
+def is_constant(moments):
+    """
+    Get which neighborhoods have a variance that is zero up to the precision of their mean.
+
+    This is the same test that scipy.stats.skew and scipy.stats.kurtosis use to return NaN.
+
+    :param moments: Moments tuple
+    :return: boolean array with one value per neighborhood
+    """
+    with np.errstate(invalid='ignore'):
+        return moments.m2 <= (np.finfo(float).eps * moments.mean) ** 2
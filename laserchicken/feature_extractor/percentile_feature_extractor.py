@@ -1,7 +1,9 @@
+import numpy as np
 import scipy.stats as stats
 
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
-from laserchicken.keys import point
+from laserchicken.neighborhoods import Neighborhoods
+from laserchicken.utils import get_attribute_values_per_neighborhood
 
 
 class PercentileFeatureExtractor(FeatureExtractor):
@@ -21,11 +23,71 @@ class PercentileFeatureExtractor(FeatureExtractor):
         return 'perc_{}_{}'.format(percentile, self.data_key)
 
     def extract(self, point_cloud, neighborhoods, target_point_cloud, target_indices, volume_description):
-        return [self._extract_one(point_cloud, neighborhood) for neighborhood in neighborhoods]
+        values_per_neighborhood = get_attribute_values_per_neighborhood(point_cloud, neighborhoods, self.data_key)
+        return [self._extract_one(values) for values in values_per_neighborhood]
 
-    def _extract_one(self, point_cloud, neighborhood):
-        source_data = point_cloud[point][self.data_key]['data'][neighborhood]
+    def _extract_one(self, source_data):
         return stats.scoreatpercentile(source_data, self.percentile)
 
     def get_params(self):
         return ()
+
+
+class GroupedPercentileFeatureExtractor(FeatureExtractor):
+    """
+    Calculates several percentiles of the same attribute at once.
+
+    Every neighborhood is sorted only once for all percentiles. The results are the same as those of the separate
+    PercentileFeatureExtractor objects, which compute_features replaces by this extractor when several percentiles of
+    the same attribute are requested.
+    """
+    def __init__(self, percentiles, data_key='z'):
+        self.percentiles = list(percentiles)
+        self.data_key = data_key
+
+    @classmethod
+    def requires(cls):
+        return []
+
+    def provides(self):
+        return [PercentileFeatureExtractor(percentile, self.data_key).provides()[0] for percentile in self.percentiles]
+
+    def extract(self, point_cloud, neighborhoods, target_point_cloud, target_indices, volume_description):
+        neighborhoods = Neighborhoods.from_lists(neighborhoods)
+        sorted_values = _sort_per_neighborhood(neighborhoods.gather(point_cloud, self.data_key),
+                                               neighborhoods.get_owners())
+        starts = neighborhoods.local_offsets[:-1]
+        lengths = neighborhoods.lengths
+        is_empty = lengths == 0
+        last = np.maximum(lengths - 1, 0)
+        return [self._get_percentile(sorted_values, starts, last, is_empty, percentile)
+                for percentile in self.percentiles]
+
+    @staticmethod
+    def _get_percentile(sorted_values, starts, last, is_empty, percentile):
+        """Interpolate between the two closest ranks in the same way as scipy.stats.scoreatpercentile."""
+        if not 0 <= percentile <= 100:
+            raise ValueError("percentile must be in the range [0, 100]")
+        if len(sorted_values) == 0:
+            return np.full(len(starts), np.nan)
+        position = percentile / 100. * last
+        lower_rank = position.astype(int)
+        upper_rank = np.minimum(lower_rank + 1, last)
+        lower = sorted_values[np.where(is_empty, 0, starts + lower_rank)]
+        upper = sorted_values[np.where(is_empty, 0, starts + upper_rank)]
+        lower_weight = (lower_rank + 1) - position
+        upper_weight = position - lower_rank
+        with np.errstate(invalid='ignore'):
+            interpolated = (lower * lower_weight + upper * upper_weight) / (lower_weight + upper_weight)
+        result = np.where(lower_rank == position, lower, interpolated).astype(float)
+        result[is_empty] = np.nan
+        return result
+
+    def get_params(self):
+        return tuple(self.percentiles)
+
+
+def _sort_per_neighborhood(values, owners):
+    """Copy of values that is sorted within each neighborhood, with a single segmented sort of all neighborhoods."""
+    values = np.asarray(values)
+    return values[np.lexsort((values, owners))]
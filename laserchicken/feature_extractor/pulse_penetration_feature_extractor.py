@@ -6,19 +6,14 @@ See https://github.com/eEcoLiDAR/eEcoLiDAR/issues/23.
 import numpy as np
 
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
-from laserchicken.keys import point, normalized_height
-
-# classification according to
-# http://www.asprs.org/wp-content/uploads/2010/12/LAS_1-4_R6.pdf
-GROUND_TAGS = [2]
-
-
-def _is_ground(i, point_cloud):
-    return point_cloud[point]['raw_classification']["data"][i] in GROUND_TAGS
+from laserchicken.feature_extractor.ground_mask import GROUND_TAGS, get_ground_per_neighbor
+from laserchicken.keys import point
+from laserchicken.neighborhoods import Neighborhoods
 
 
 class PulsePenetrationFeatureExtractor(FeatureExtractor):
     """Feature extractor for the point density."""
+    ground_tags = GROUND_TAGS
 
     @classmethod
     def requires(cls):
@@ -56,33 +51,17 @@ class PulsePenetrationFeatureExtractor(FeatureExtractor):
         :param volume_description: volume object that describes the shape and size of the search volume
         :return: feature values
         """
-        return [self._extract_one(point_cloud, neighborhood) for neighborhood in neighborhoods]
-
-    def _extract_one(self, point_cloud, neighborhood):
+        neighborhoods = Neighborhoods.from_lists(neighborhoods)
+        if len(neighborhoods) == 0:
+            return np.zeros(0)
         if 'raw_classification' not in point_cloud[point]:
             raise ValueError(
                 'Missing raw_classification attribute which is necessary for calculating pulse_penetratio and '
                 'density_absolute_mean features.')
 
-        ground_indices = [i for i in neighborhood if _is_ground(i, point_cloud)]
-        pulse_penetration_ratio = self._get_pulse_penetration_ratio(
-            ground_indices, len(neighborhood))
-
-        return pulse_penetration_ratio
-
-    @staticmethod
-    def _get_ground_indices(point_cloud, ground_tags):
-        index_grd = []
-        for ipt, c in enumerate(point_cloud):
-            if c in ground_tags:
-                index_grd.append(ipt)
-        return index_grd
-
-    @staticmethod
-    def _get_pulse_penetration_ratio(ground_indices, n_total_points):
-        n_total = max(n_total_points, 1)
-        n_ground = len(ground_indices)
-        return float(n_ground) / n_total
+        is_ground = get_ground_per_neighbor(point_cloud, neighborhoods, self.ground_tags)
+        n_ground = neighborhoods.reduce(np.add, is_ground, empty_value=0)
+        return n_ground / np.maximum(neighborhoods.lengths, 1)
 
     def get_params(self):
         """
@@ -90,4 +69,4 @@ class PulsePenetrationFeatureExtractor(FeatureExtractor):
 
         Needed for provenance.
         """
-        return ()
+        return (list(self.ground_tags),)
@@ -1,7 +1,7 @@
 import numpy as np
 
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
-from laserchicken.keys import point
+from laserchicken.utils import get_attribute_values_per_neighborhood
 
 
 class RangeFeatureExtractor(FeatureExtractor):
@@ -22,11 +22,11 @@ class RangeFeatureExtractor(FeatureExtractor):
         return [base + str(self.data_key) for base in base_names]
 
     def extract(self, point_cloud, neighborhoods, target_point_cloud, target_indices, volume_description):
-        return np.array([self._extract_one(point_cloud, neighborhood) for neighborhood in neighborhoods]).T
+        values_per_neighborhood = get_attribute_values_per_neighborhood(point_cloud, neighborhoods, self.data_key)
+        return np.array([self._extract_one(values) for values in values_per_neighborhood]).T
 
-    def _extract_one(self, source_point_cloud, neighborhood):
-        if neighborhood:
-            source_data = source_point_cloud[point][self.data_key]['data'][neighborhood]
+    def _extract_one(self, source_data):
+        if len(source_data) > 0:
             max_z = np.max(source_data) if len(source_data) > 0 else self.DEFAULT_MAX
             min_z = np.min(source_data) if len(source_data) > 0 else self.DEFAULT_MIN
             range_z = max_z - min_z
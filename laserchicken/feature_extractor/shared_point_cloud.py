@@ -0,0 +1,96 @@
+"""Point clouds whose attribute arrays are shared with worker processes through shared memory."""
+import collections
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from laserchicken.keys import point
+
+_SharedAttribute = collections.namedtuple('_SharedAttribute', ['memory_name', 'shape', 'dtype', 'type'])
+
+
+class SharedPointCloud(object):
+    """
+    Copy of the point attributes of a point cloud in shared memory, to be attached to by other processes.
+
+    Only the (small) description of the shared arrays is pickled when this object is sent to another process, which
+    attaches to the shared memory with attach. This is meant for worker processes started by multiprocessing, which
+    share the resource tracker of the process that created the object. That process should call close when the
+    workers are done, which frees the shared memory. It can be used as a context manager to do so.
+    """
+
+    def __init__(self, point_cloud):
+        """
+        Copy the point attributes of a point cloud to shared memory.
+
+        Attributes that can not be stored as a plain array, like arrays of python objects, are pickled with the other
+        contents of the point cloud instead.
+
+        :param point_cloud: point cloud to share
+        """
+        self.shared_attributes = {}
+        self.other_attributes = {}
+        self.other_contents = {key: value for key, value in point_cloud.items() if key != point}
+        self.has_points = point in point_cloud
+        self._memories = []
+        self._attached_memories = []
+        try:
+            for name, attribute in point_cloud.get(point, {}).items():
+                data = np.asarray(attribute['data'])
+                if data.dtype.hasobject:
+                    self.other_attributes[name] = attribute
+                    continue
+                memory = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+                self._memories.append(memory)
+                np.ndarray(data.shape, dtype=data.dtype, buffer=memory.buf)[...] = data
+                self.shared_attributes[name] = _SharedAttribute(memory.name, data.shape, data.dtype.str,
+                                                                attribute.get('type'))
+        except BaseException:
+            self.close()
+            raise
+
+    def __getstate__(self):
+        return {'shared_attributes': self.shared_attributes,
+                'other_attributes': self.other_attributes,
+                'other_contents': self.other_contents,
+                'has_points': self.has_points}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._memories = []
+        self._attached_memories = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def attach(self):
+        """
+        Get the shared point cloud, with read only views on the shared memory as attribute data.
+
+        The returned point cloud can only be used as long as this object exists and close was not called by the
+        process that created it.
+
+        :return: point cloud
+        """
+        attributes = dict(self.other_attributes)
+        for name, shared in self.shared_attributes.items():
+            memory = shared_memory.SharedMemory(name=shared.memory_name)
+            self._attached_memories.append(memory)
+            data = np.ndarray(shared.shape, dtype=np.dtype(shared.dtype), buffer=memory.buf)
+            data.flags.writeable = False
+            attributes[name] = {'type': shared.type, 'data': data}
+        point_cloud = dict(self.other_contents)
+        if self.has_points:
+            point_cloud[point] = attributes
+        return point_cloud
+
+    def close(self):
+        """Free the shared memory; only to be called by the process that created this object."""
+        for memory in self._memories:
+            memory.close()
+            memory.unlink()
+        self._memories = []
+
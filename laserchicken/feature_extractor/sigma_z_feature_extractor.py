@@ -7,7 +7,12 @@ import numpy as np
 from numpy.linalg import LinAlgError
 
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
-from laserchicken.utils import get_point, fit_plane
+from laserchicken.feature_extractor.moments import get_mean
+from laserchicken.neighborhoods import Neighborhoods
+from laserchicken.utils import fit_plane
+
+# Relative size of the determinant of the normal equations below which a neighborhood is fitted point by point
+SINGULARITY_TOLERANCE = 1e-10
 
 
 class SigmaZFeatureExtractor(FeatureExtractor):
@@ -42,6 +47,11 @@ class SigmaZFeatureExtractor(FeatureExtractor):
         """
         Extract the feature value(s) of the point cloud at location of the target.
 
+        The planes of all neighborhoods are fitted at once, by solving the normal equations of the coordinates relative
+        to the centroid of each neighborhood in a single batched solve. Neighborhoods for which these equations are
+        (nearly) singular, like those with fewer than 3 points or with all points on a line, are fitted one by one
+        with a least squares solver as before.
+
         :param point_cloud: environment (search space) point cloud
         :param neighborhoods: list of arrays of indices of points within the point_cloud argument
         :param target_point_cloud: point cloud that contains target point
@@ -49,18 +59,50 @@ class SigmaZFeatureExtractor(FeatureExtractor):
         :param volume_description: volume object that describes the shape and size of the search volume
         :return: feature values
         """
-        return [self._extract_one(point_cloud, neighborhood) for neighborhood in neighborhoods]
+        neighborhoods = Neighborhoods.from_lists(neighborhoods)
+        n = neighborhoods.lengths
+        deviations = [self._get_deviations(point_cloud, neighborhoods, dimension) for dimension in ['x', 'y', 'z']]
+        sums = {(i, j): neighborhoods.reduce(np.add, deviations[i] * deviations[j], empty_value=0)
+                for i, j in [(0, 0), (0, 1), (1, 1), (0, 2), (1, 2)]}
+        normal_matrices = np.empty((len(neighborhoods), 2, 2))
+        normal_matrices[:, 0, 0] = sums[0, 0]
+        normal_matrices[:, 0, 1] = normal_matrices[:, 1, 0] = sums[0, 1]
+        normal_matrices[:, 1, 1] = sums[1, 1]
+        is_solvable = (n >= 3) & (np.linalg.det(normal_matrices) > SINGULARITY_TOLERANCE * sums[0, 0] * sums[1, 1])
+
+        slopes = np.zeros((len(neighborhoods), 2))
+        if np.any(is_solvable):
+            right_hand_sides = np.stack([sums[0, 2], sums[1, 2]], axis=1)[is_solvable, :, np.newaxis]
+            slopes[is_solvable] = np.linalg.solve(normal_matrices[is_solvable], right_hand_sides)[:, :, 0]
+        residuals = deviations[2] - np.repeat(slopes[:, 0], n) * deviations[0] \
+            - np.repeat(slopes[:, 1], n) * deviations[1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sigma_z = np.sqrt(neighborhoods.reduce(np.add, residuals ** 2) / n)
+
+        if not np.all(is_solvable):
+            xyz_per_neighborhood = [neighborhoods.gather_per_neighborhood(point_cloud, dimension)
+                                    for dimension in ['x', 'y', 'z']]
+            for i in np.flatnonzero(~is_solvable):
+                sigma_z[i] = self._extract_one(*[values[i] for values in xyz_per_neighborhood])
+        return sigma_z
+
+    @staticmethod
+    def _get_deviations(point_cloud, neighborhoods, dimension):
+        """Deviations of the values of an attribute from their mean in each neighborhood, aligned with flat_indices."""
+        values = np.asarray(neighborhoods.gather(point_cloud, dimension), dtype=float)
+        mean = get_mean(point_cloud, neighborhoods, dimension)
+        return values - np.repeat(mean, neighborhoods.lengths)
 
     @staticmethod
-    def _extract_one(source_point_cloud, neighborhood):
+    def _extract_one(x, y, z):
         """
         Extract the feature value(s) of the point cloud at location of the target.
 
-        :param source_point_cloud: environment (search space) point cloud
-        :param neighborhood: array of indices of points within the point_cloud argument
+        :param x: x coordinates of the points in the neighborhood
+        :param y: y coordinates of the points in the neighborhood
+        :param z: z coordinates of the points in the neighborhood
         :return:
         """
-        x, y, z = get_point(source_point_cloud, neighborhood)
         try:
             plane_estimator = fit_plane(x, y, z)
             normalized = z - plane_estimator(x, y)
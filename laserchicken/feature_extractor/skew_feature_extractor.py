@@ -1,8 +1,7 @@
 import numpy as np
-import scipy.stats as stats
 
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
-from laserchicken.keys import point
+from laserchicken.feature_extractor.moments import get_moments, is_constant
 
 
 class SkewFeatureExtractor(FeatureExtractor):
@@ -18,12 +17,6 @@ class SkewFeatureExtractor(FeatureExtractor):
         return ['skew_' + self.data_key]
 
     def extract(self, point_cloud, neighborhoods, target_point_cloud, target_indices, volume_description):
-        return [self._extract_one(point_cloud, neighborhood) for neighborhood in neighborhoods]
-
-    def _extract_one(self, point_cloud, neighborhood):
-        if neighborhood:
-            source_data = point_cloud[point][self.data_key]['data'][neighborhood]
-            skew = stats.skew(source_data)
-        else:
-            skew = np.nan
-        return skew
+        moments = get_moments(point_cloud, neighborhoods, self.data_key)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(is_constant(moments), np.nan, moments.m3 / moments.m2 ** 1.5)
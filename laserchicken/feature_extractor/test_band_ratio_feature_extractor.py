@@ -4,7 +4,8 @@ import numpy as np
 import pytest
 
 from laserchicken import keys
-from laserchicken.feature_extractor.band_ratio_feature_extractor import BandRatioFeatureExtractor
+from laserchicken.feature_extractor.band_ratio_feature_extractor import BandRatioFeatureExtractor, \
+    BandRatioSetFeatureExtractor
 from laserchicken.test_tools import create_point_cloud
 from laserchicken.volume_specification import Cell, Sphere, Cube, InfiniteCylinder
 
@@ -94,6 +95,13 @@ class TestBandRatioFeatureExtractorSimpleArtificialData(unittest.TestCase):
     def test_provides_with_only_lower_limit(self):
         self.assertEqual(['band_ratio_20_z'], BandRatioFeatureExtractor(20, None).provides())
 
+    def test_zero_limits(self):
+        point_cloud = create_point_cloud(np.zeros(4), np.zeros(4), np.array([-1., 0., 0.5, 2.]))
+        targets = create_point_cloud(np.zeros(1), np.zeros(1), np.zeros(1))
+        for lower, upper, expected in [(0, 1, 0.25), (0, None, 0.5), (None, 0, 0.25)]:
+            result = BandRatioFeatureExtractor(lower, upper).extract(point_cloud, [range(4)], targets, 0, Cell(4))
+            np.testing.assert_allclose(result, [expected])
+
     def test_provides_with_zero_lower_limit(self):
         self.assertEqual(['band_ratio_0_z'], BandRatioFeatureExtractor(0, None).provides())
 
@@ -105,6 +113,57 @@ class TestBandRatioFeatureExtractorSimpleArtificialData(unittest.TestCase):
                          BandRatioFeatureExtractor(1, 3, data_key=keys.normalized_height).provides())
 
 
+class TestBandRatioSetFeatureExtractor(unittest.TestCase):
+    """Test the extractor of a set of bands against separate band ratio extractors."""
+    break_points = [None, 1, 2, 3, None]
+
+    def test_same_as_separate_extractors(self):
+        z = np.random.RandomState(0).rand(200) * 5 - 1
+        z[:5] = [1, 2, 3, 0, np.nan]
+        point_cloud = create_point_cloud(np.zeros(200), np.zeros(200), z)
+        neighborhoods = [list(range(0, 50)), list(range(50, 200)), list(range(3, 12)), []]
+        targets = create_point_cloud(np.zeros(4), np.zeros(4), np.zeros(4))
+
+        for break_points in [self.break_points, [0, 1, 3, None], [None, 0, 2]]:
+            results = BandRatioSetFeatureExtractor(break_points).extract(point_cloud, neighborhoods, targets, None,
+                                                                         Cell(4))
+
+            for lower, upper, result in zip(break_points[:-1], break_points[1:], results):
+                expected = BandRatioFeatureExtractor(lower, upper).extract(point_cloud, neighborhoods, targets, None,
+                                                                           Cell(4))
+                np.testing.assert_allclose(result, expected)
+
+    def test_bounded_bands_exclude_outside_values(self):
+        point_cloud = create_point_cloud(np.zeros(5), np.zeros(5), np.array([-1, 0.25, 0.75, 1.25, 2]))
+        targets = create_point_cloud(np.zeros(1), np.zeros(1), np.zeros(1))
+        results = BandRatioSetFeatureExtractor([0, 0.5, 1]).extract(point_cloud, [range(5)], targets, 0, Cell(4))
+        np.testing.assert_allclose(results, [[0.2], [0.2]])
+
+    def test_single_band(self):
+        point_cloud = create_point_cloud(np.zeros(4), np.zeros(4), np.array([0., 1., 2., 3.]))
+        targets = create_point_cloud(np.zeros(1), np.zeros(1), np.zeros(1))
+        result = BandRatioSetFeatureExtractor([0.5, None]).extract(point_cloud, [range(4)], targets, 0, Cell(4))
+        np.testing.assert_allclose(result, [0.75])
+
+    def test_provides(self):
+        self.assertEqual(['band_ratio_normalized_height_1', 'band_ratio_1_normalized_height_2',
+                          'band_ratio_2_normalized_height_3', 'band_ratio_3_normalized_height'],
+                         BandRatioSetFeatureExtractor(self.break_points, data_key=keys.normalized_height).provides())
+
+    def test_none_between_break_points_raises(self):
+        with pytest.raises(ValueError):
+            BandRatioSetFeatureExtractor([0, None, 2])
+
+    def test_decreasing_break_points_raises(self):
+        with pytest.raises(ValueError):
+            BandRatioSetFeatureExtractor([0, 2, 1])
+
+    def test_sphere_volume_raise(self):
+        point_cloud = create_point_cloud(np.zeros(1), np.zeros(1), np.zeros(1))
+        with pytest.raises(ValueError):
+            BandRatioSetFeatureExtractor(self.break_points).extract(point_cloud, [[0]], point_cloud, 0, Sphere(5))
+
+
 def assert_expected_ratio(expected_ratio=0.4, n_below_limit=10, n_within=40, n_above_limit=50, volume=Cell(4)):
     assert_expected_ratios(np.array([expected_ratio]),
                            np.array([n_below_limit]),
@@ -23,6 +23,28 @@ class TestDensityAbsoluteMeanZFeatureExtractorArtificialData(unittest.TestCase):
 
         self.assertAlmostEqual(density_absolute_mean, 25)
 
+    def test_same_as_np_mean_per_neighborhood(self):
+        """Points should be compared to np.mean of their neighborhood, also when they are within rounding of it"""
+        random = np.random.RandomState(0)
+        z = np.round(random.rand(300) * 4, 1)
+        # Neighborhoods for which a segmented sum gives a mean on the other side of some values than np.mean
+        z[:8] = 0.2
+        z[8:40] = [3.6, 3.3, 3.6, 2.8, 3.3, 3.6, 3.6, 3.2, 3.6, 1.7, 0.8, 0.8, 3.1, 0.2, 3.6, 0.2,
+                   3.9, 3.6, 3.6, 3.6, 3.6, 3.6, 1.4, 3.6, 3.6, 2.7, 0.6, 3.6, 3.6, 3.6, 3.6, 0.4]
+        point_cloud = create_point_cloud(z, z, z)
+        classification = random.choice([2, 4], 300)
+        classification[:40] = 4
+        point_cloud[point]['raw_classification'] = {'data': classification, 'type': 'double'}
+        neighborhoods = [list(range(8)), list(range(8, 40))] + \
+                        [list(random.choice(300, size, replace=False)) for size in random.randint(1, 150, 50)]
+
+        density_absolute_mean = self.extractor.extract(point_cloud, neighborhoods, None, None, None)
+
+        for i, neighborhood in enumerate(neighborhoods):
+            values = z[neighborhood][classification[neighborhood] != 2]
+            expected = np.sum(values > np.mean(values)) / len(values) * 100 if len(values) > 0 else 0
+            self.assertEqual(density_absolute_mean[i], expected)
+
     def test_default_provides_correct(self):
         feature_names = self.extractor.provides()
         self.assertIn('density_absolute_mean_z', feature_names)
@@ -6,8 +6,10 @@ import numpy as np
 
 from laserchicken import keys, load, utils
 from laserchicken.compute_neighbors import compute_neighborhoods
-from laserchicken.volume_specification import Sphere, InfiniteCylinder, Cell, Cube
+from laserchicken.feature_extractor.feature_extraction import compute_features
+from laserchicken.volume_specification import Sphere, InfiniteCylinder, Cell, Cube, KNearest
 from laserchicken.feature_extractor.density_feature_extractor import PointDensityFeatureExtractor
+from laserchicken.neighborhoods import Neighborhoods
 from laserchicken.test_tools import create_point_cloud
 
 
@@ -162,6 +164,78 @@ class TestDensityFeatureForCube(unittest.TestCase):
         np.testing.assert_allclose(densities, n_included)
 
 
+class TestDensityFeatureForKNearest(unittest.TestCase):
+    def setUp(self):
+        x = np.array([0., 1., 2., 3., 10.])
+        self.environment = create_point_cloud(x, np.zeros(5), np.zeros(5))
+        self.target = create_point_cloud(np.zeros(1), np.zeros(1), np.zeros(1))
+
+    def test_k_nearest_3d(self):
+        """Density should be k divided by the volume of the sphere through the k-th neighbor."""
+        volume = KNearest(3)
+        neighborhoods = compute_neighborhoods(self.environment, self.target, volume)
+        densities = PointDensityFeatureExtractor().extract(self.environment, neighborhoods, self.target, [0], volume)
+        np.testing.assert_allclose(densities, 3 / (4 / 3 * np.pi * 2 ** 3))
+
+    def test_k_nearest_2d(self):
+        volume = KNearest(4, dimensions=2)
+        neighborhoods = compute_neighborhoods(self.environment, self.target, volume)
+        densities = PointDensityFeatureExtractor().extract(self.environment, neighborhoods, self.target, [0], volume)
+        np.testing.assert_allclose(densities, 4 / (np.pi * 3 ** 2))
+
+    def test_k_nearest_max_radius(self):
+        """Density should use the maximum radius when less than k neighbors are found."""
+        volume = KNearest(5, max_radius=2.5)
+        neighborhoods = compute_neighborhoods(self.environment, self.target, volume)
+        densities = PointDensityFeatureExtractor().extract(self.environment, neighborhoods, self.target, [0], volume)
+        np.testing.assert_allclose(densities, 3 / (4 / 3 * np.pi * 2.5 ** 3))
+
+    def test_k_nearest_no_neighbors(self):
+        volume = KNearest(2)
+        densities = PointDensityFeatureExtractor().extract(self.environment, [[]], self.target, [0], volume)
+        np.testing.assert_allclose(densities, 0)
+
+
+class TestDensityFeatureCountOnly(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.environment = create_point_cloud(random.rand(100), random.rand(100), random.rand(100))
+        self.volume = InfiniteCylinder(0.2)
+
+    def test_counts_same_as_neighborhoods(self):
+        expected = self._compute_point_density(compute_neighborhoods(self.environment, self._copy(), self.volume))
+        counts = compute_neighborhoods(self.environment, self._copy(), self.volume, count_only=True)
+        np.testing.assert_allclose(self._compute_point_density(counts), expected)
+
+    def test_neighborhoods_computed_by_compute_features(self):
+        expected = self._compute_point_density(compute_neighborhoods(self.environment, self._copy(), self.volume))
+        np.testing.assert_allclose(self._compute_point_density(None), expected)
+
+    def test_given_neighborhoods_only_counted(self):
+        neighborhoods = list(compute_neighborhoods(self.environment, self._copy(), self.volume))
+        expected = self._compute_point_density(neighborhoods)
+        np.testing.assert_allclose(self._compute_point_density(iter(neighborhoods)), expected)
+        np.testing.assert_allclose(self._compute_point_density(Neighborhoods.from_lists(neighborhoods)), expected)
+
+    def test_counts_for_other_features_raises(self):
+        counts = compute_neighborhoods(self.environment, self._copy(), self.volume, count_only=True)
+        with self.assertRaises(ValueError):
+            compute_features(self.environment, counts, self._copy(), ['point_density', 'mean_z'], self.volume,
+                             verbose=False)
+
+    def test_needs_only_counts(self):
+        self.assertTrue(PointDensityFeatureExtractor().needs_only_counts(self.volume))
+        self.assertFalse(PointDensityFeatureExtractor().needs_only_counts(KNearest(3)))
+
+    def _compute_point_density(self, neighborhoods):
+        target = self._copy()
+        compute_features(self.environment, neighborhoods, target, ['point_density'], self.volume, verbose=False)
+        return target[keys.point]['point_density']['data']
+
+    def _copy(self):
+        return utils.copy_point_cloud(self.environment)
+
+
 class TestDensityFeatureOnRealData(unittest.TestCase):
     """Test density extractor on real data and make sure it doesn't crash."""
 
@@ -122,6 +122,13 @@ class TestEchoRatioFeatureExtractorSimpleArtificialData(unittest.TestCase):
         result = extractor.extract(self.environment_pc, self.neighbors, self.target_pc, range(4), self.cylinder)
         np.testing.assert_allclose(result, self.echo_ratios)
 
+    def test_empty_neighborhood(self):
+        """Targets without neighbors should get an echo ratio of 0."""
+        extractor = EchoRatioFeatureExtractor()
+        neighbors = [[]] + self.neighbors[1:]
+        result = extractor.extract(self.environment_pc, neighbors, self.target_pc, range(4), self.cylinder)
+        np.testing.assert_allclose(result, [0.] + list(self.echo_ratios[1:]))
+
     def setUp(self):
         """
         Create a grid of 4 targets and an environment point cloud and neighbors and the echo ratios of those targets.
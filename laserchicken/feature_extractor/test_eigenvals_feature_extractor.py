@@ -11,7 +11,7 @@ from laserchicken.feature_extractor.feature_extraction import compute_features
 from laserchicken.test_tools import create_point_cloud
 from laserchicken.utils import copy_point_cloud
 from laserchicken.volume_specification import InfiniteCylinder
-from .eigenvals_feature_extractor import EigenValueVectorizeFeatureExtractor
+from .eigenvals_feature_extractor import EigenValueVectorizeFeatureExtractor, EigenGeometryFeatureExtractor
 
 
 class TestExtractEigenValues(unittest.TestCase):
@@ -43,6 +43,67 @@ class TestExtractEigenValues(unittest.TestCase):
         assert not np.any(np.isnan(eigen_val_123))
         assert not np.any(np.isinf(eigen_val_123))
 
+    @staticmethod
+    def test_normals_of_too_few_points_are_nan():
+        """Neighborhoods with fewer than 3 points have no defined normal or slope."""
+        neighborhood, pc = create_point_cloud_in_plane_and_neighborhood()
+        result = EigenValueVectorizeFeatureExtractor().extract(pc, [[], [1], [1, 2], [1, 2, 7]], None, None, None)
+        eigen_values, normals, slope = np.array(result[:3]), np.array(result[3:6]), result[6]
+        np.testing.assert_array_equal(eigen_values[:, :3], 0)
+        assert np.all(np.isnan(normals[:, :3]))
+        assert np.all(np.isnan(slope[:3]))
+        assert not np.any(np.isnan(normals[:, 3]))
+
+    @staticmethod
+    def test_eigenvalues_sorted_and_same_as_numpy():
+        """Eigen values should be sorted from large to small and equal those of the sample covariance matrix."""
+        points = np.random.RandomState(0).rand(50, 3) * [10, 5, 1] + [1e5, 4e5, 10]
+        pc = create_point_cloud(points[:, 0], points[:, 1], points[:, 2])
+        eigen_values = np.array(EigenValueVectorizeFeatureExtractor().extract(pc, [list(range(50))], None, None,
+                                                                              None)[:3])[:, 0]
+        expected = np.sort(np.linalg.eigvalsh(np.cov(points.T)))[::-1]
+        np.testing.assert_allclose(eigen_values, expected)
+
+
+class TestExtractEigenGeometry(unittest.TestCase):
+    def test_from_eigen_values(self):
+        pc = create_point_cloud(np.zeros(3), np.zeros(3), np.zeros(3))
+        for name, values in zip(['eigenv_1', 'eigenv_2', 'eigenv_3'], [[1., 4., 2.], [0., 2., 2.], [0., 1., 2.]]):
+            pc[keys.point][name] = {'type': 'float64', 'data': np.array(values)}
+
+        linearity, planarity, sphericity, omnivariance, anisotropy, eigenentropy, change_of_curvature = \
+            EigenGeometryFeatureExtractor().extract(None, None, pc, np.arange(3), None)
+
+        np.testing.assert_allclose(linearity, [1, 0.5, 0])
+        np.testing.assert_allclose(planarity, [0, 0.25, 0])
+        np.testing.assert_allclose(sphericity, [0, 0.25, 1])
+        np.testing.assert_allclose(anisotropy, [1, 0.75, 0])
+        np.testing.assert_allclose(change_of_curvature, [0, 1 / 7, 1 / 3])
+        np.testing.assert_allclose(omnivariance, [0, np.cbrt(8 / 7 ** 3), 1 / 3])
+        np.testing.assert_allclose(eigenentropy, [0, -np.sum([p * np.log(p) for p in [4 / 7, 2 / 7, 1 / 7]]),
+                                                  np.log(3)])
+
+    @staticmethod
+    def test_compute_features_plane():
+        """Points in a plane should have a planarity of almost 1 and no sphericity."""
+        neighborhood, pc = create_point_cloud_in_plane_and_neighborhood(np.array([0., 1., 1.]))
+        target = copy_point_cloud(pc, [0])
+        compute_features(pc, [list(range(100))], target, ['planarity', 'sphericity'], InfiniteCylinder(5))
+        np.testing.assert_allclose(target[keys.point]['sphericity']['data'], 0, atol=1e-10)
+        assert target[keys.point]['planarity']['data'][0] > 0.2
+
+    @staticmethod
+    def test_too_few_points_nan():
+        a = np.array([5])
+        pc = create_point_cloud(a, a, a)
+        compute_features(pc, [[0]], pc, ['linearity', 'eigenentropy'], InfiniteCylinder(5))
+        assert np.isnan(pc[keys.point]['linearity']['data'][0])
+        assert np.isnan(pc[keys.point]['eigenentropy']['data'][0])
+
+    def test_target_required(self):
+        with self.assertRaises(ValueError):
+            EigenGeometryFeatureExtractor().extract(None, [[0]], None, None, None)
+
 
 class TestExtractEigenvaluesComparison(unittest.TestCase):
     point_cloud = None
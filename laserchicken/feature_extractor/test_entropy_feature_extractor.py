@@ -1,5 +1,6 @@
 import os
 import random
+import threading
 import unittest
 
 import numpy as np
@@ -7,7 +8,7 @@ import numpy as np
 from laserchicken import compute_features, keys, load, utils
 from laserchicken.compute_neighbors import compute_cylinder_neighborhood
 from laserchicken.feature_extractor.entropy_feature_extractor import EntropyFeatureExtractor
-from laserchicken.feature_extractor.feature_extraction import compute_features
+from laserchicken.feature_extractor.feature_extraction import compute_features, FEATURES
 from laserchicken.test_tools import create_point_cloud
 from laserchicken.volume_specification import InfiniteCylinder
 
@@ -48,6 +49,32 @@ class TestExtractEntropy(unittest.TestCase):
                          InfiniteCylinder(5), layer_thickness=0.1)
         return target_point_cloud
 
+    def test_layer_thickness_not_set_on_registered_extractor(self):
+        self._find_neighbors_for_random_targets_and_compute_entropy()
+        self.assertEqual(FEATURES['entropy_z'].layer_thickness, EntropyFeatureExtractor.layer_thickness)
+
+    def test_concurrent_calls_use_own_layer_thickness(self):
+        """Calls in different threads should not see each other's keyword arguments."""
+        point_cloud = create_point_cloud(np.zeros(100), np.zeros(100), np.linspace(0, 10, 100))
+        neighborhoods = [list(range(100))] * 10
+        results = {}
+
+        def compute(layer_thickness):
+            for _ in range(20):
+                target = create_point_cloud(np.zeros(10), np.zeros(10), np.zeros(10))
+                compute_features(point_cloud, neighborhoods, target, ['entropy_z'], InfiniteCylinder(5),
+                                 verbose=False, layer_thickness=layer_thickness)
+                results.setdefault(layer_thickness, set()).add(target[keys.point]['entropy_z']['data'][0])
+
+        threads = [threading.Thread(target=compute, args=(layer_thickness,)) for layer_thickness in [0.1, 5]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results[0.1]), 1)
+        self.assertEqual(len(results[5]), 1)
+        self.assertNotEqual(results[0.1], results[5])
+
     def test_default_provides_correct(self):
         feature_names = EntropyFeatureExtractor().provides()
         self.assertIn('entropy_z', feature_names)
@@ -75,3 +102,57 @@ class TestExtractNormalizedEntropy(unittest.TestCase):
 
     def setUp(self):
         self.extractor = EntropyFeatureExtractor(data_key=keys.normalized_height)
+
+
+class TestExtractEntropyBatched(unittest.TestCase):
+    def test_same_as_histogram_per_neighborhood(self):
+        for layer_thickness, min_val, max_val in [(0.5, None, None), (0.1, None, None), (0.3, 2, 15)]:
+            self.extractor.layer_thickness = layer_thickness
+            self.extractor.min_val = min_val
+            self.extractor.max_val = max_val
+            entropy = self.extractor.extract(self.point_cloud, self.neighborhoods, None, None, None)
+            expected = [_get_histogram_entropy(self.point_cloud[keys.point]['z']['data'][neighborhood],
+                                               layer_thickness, min_val, max_val)
+                        for neighborhood in self.neighborhoods]
+            np.testing.assert_allclose(entropy, expected, rtol=1e-12, atol=1e-12)
+
+    def test_first_bin_empty(self):
+        """Entropy should not be truncated when the first bin of a fixed range is empty."""
+        self.extractor.min_val = 0
+        self.extractor.max_val = 2
+        point_cloud = create_point_cloud(np.zeros(2), np.zeros(2), np.array([0.75, 1.75]))
+        entropy = self.extractor.extract(point_cloud, [[0, 1]], None, None, None)[0]
+        self.assertAlmostEqual(entropy, 1)
+
+    def test_single_neighborhood(self):
+        point_cloud = create_point_cloud(np.zeros(4), np.zeros(4), np.array([0.1, 0.2, 0.7, 1.2]))
+        entropy = self.extractor.extract(point_cloud, [[0, 1, 2, 3]], None, None, None)
+        np.testing.assert_allclose(entropy, [1.5])
+
+    def test_nan_raises(self):
+        point_cloud = create_point_cloud(np.zeros(2), np.zeros(2), np.array([1., np.nan]))
+        with self.assertRaises(ValueError):
+            self.extractor.extract(point_cloud, [[0], [0, 1]], None, None, None)
+
+    def setUp(self):
+        self.extractor = EntropyFeatureExtractor()
+        random = np.random.RandomState(0)
+        n_points = 1000
+        z = random.rand(n_points) * 20
+        z[::5] = np.round(z[::5] * 2) / 2  # values on bin edges
+        self.point_cloud = create_point_cloud(np.zeros(n_points), np.zeros(n_points), z)
+        self.neighborhoods = [random.choice(n_points, size, replace=False) for size in random.randint(0, 60, 100)]
+
+
+def _get_histogram_entropy(values, layer_thickness, min_val, max_val):
+    """Entropy of the histogram of the values of a single neighborhood, computed with np.histogram."""
+    if len(values) == 0:
+        return 0
+    data_min = np.min(values) if min_val is None else min_val
+    data_max = np.max(values) if max_val is None else max_val
+    if data_min == data_max:
+        return 0
+    n_bins = int(np.ceil((data_max - data_min) / layer_thickness))
+    density = np.histogram(values, bins=n_bins, range=(data_min, data_max), density=True)[0]
+    probabilities = density / np.sum(density)
+    return -np.sum(probabilities[probabilities > 0] * np.log2(probabilities[probabilities > 0]))
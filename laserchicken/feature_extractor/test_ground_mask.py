@@ -0,0 +1,46 @@
+import unittest
+
+import numpy as np
+from numpy.testing import assert_equal
+
+from laserchicken.feature_extractor.ground_mask import get_ground_mask, get_ground_per_neighbor
+from laserchicken.keys import point
+from laserchicken.neighborhoods import Neighborhoods
+from laserchicken.test_tools import create_point_cloud
+
+
+class TestGroundMask(unittest.TestCase):
+    def test_values(self):
+        assert_equal(get_ground_mask(self.point_cloud), [False, True, False, True, False])
+
+    def test_other_tags(self):
+        assert_equal(get_ground_mask(self.point_cloud, [2, 9]), [False, True, False, True, True])
+
+    def test_cached(self):
+        self.assertIs(get_ground_mask(self.point_cloud), get_ground_mask(self.point_cloud))
+
+    def test_cached_per_tags(self):
+        mask = get_ground_mask(self.point_cloud)
+        assert_equal(get_ground_mask(self.point_cloud, [9]), [False, False, False, False, True])
+        self.assertIs(get_ground_mask(self.point_cloud), mask)
+
+    def test_changed_in_place(self):
+        get_ground_mask(self.point_cloud)
+        self.point_cloud[point]['raw_classification']['data'][0] = 2
+        assert_equal(get_ground_mask(self.point_cloud), [True, True, False, True, False])
+
+    def test_read_only(self):
+        with self.assertRaises(ValueError):
+            get_ground_mask(self.point_cloud)[0] = True
+
+    def test_list(self):
+        self.point_cloud[point]['raw_classification']['data'] = [1, 2, 3, 2, 9]
+        assert_equal(get_ground_mask(self.point_cloud), [False, True, False, True, False])
+
+    def test_per_neighbor(self):
+        neighborhoods = Neighborhoods.from_lists([[3, 0], [], [1]])
+        assert_equal(get_ground_per_neighbor(self.point_cloud, neighborhoods), [True, False, True])
+
+    def setUp(self):
+        self.point_cloud = create_point_cloud(np.zeros(5), np.zeros(5), np.zeros(5))
+        self.point_cloud[point]['raw_classification'] = {'data': np.array([1, 2, 3, 2, 9]), 'type': 'int'}
@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+import scipy.stats as stats
+
+from laserchicken.feature_extractor.moments import get_mean, get_moments, is_constant
+from laserchicken.neighborhoods import Neighborhoods
+from laserchicken.test_tools import create_point_cloud
+
+
+class TestMoments(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        # Large offset like heights in a national coordinate system, to test numerical stability
+        self.z = 1e5 + random.rand(200)
+        self.point_cloud = create_point_cloud(np.zeros(200), np.zeros(200), self.z)
+        self.neighborhoods = [list(random.randint(0, 200, n)) for n in [2, 3, 10, 50, 199]]
+
+    def test_same_as_scipy(self):
+        moments = get_moments(self.point_cloud, self.neighborhoods, 'z')
+        for i, neighborhood in enumerate(self.neighborhoods):
+            values = self.z[neighborhood]
+            np.testing.assert_allclose(moments.mean[i], np.mean(values))
+            np.testing.assert_allclose(moments.m2[i], np.var(values), rtol=1e-7)
+            np.testing.assert_allclose(moments.m3[i], stats.moment(values, 3), rtol=1e-6, atol=1e-12)
+            np.testing.assert_allclose(moments.m4[i], stats.moment(values, 4), rtol=1e-6)
+
+    def test_empty_neighborhood(self):
+        moments = get_moments(self.point_cloud, [[]], 'z')
+        self.assertEqual(moments.n[0], 0)
+        self.assertTrue(np.all(np.isnan([moments.mean[0], moments.m2[0], moments.m3[0], moments.m4[0]])))
+
+    def test_is_constant(self):
+        point_cloud = create_point_cloud(np.zeros(3), np.zeros(3), np.array([10., 10., 11.]))
+        moments = get_moments(point_cloud, [[0, 1], [0, 2], [2]], 'z')
+        np.testing.assert_array_equal(is_constant(moments), [True, False, True])
+
+    def test_shared_by_chunk(self):
+        """Moments of the same attribute should be computed only once for a Neighborhoods object."""
+        neighborhoods = Neighborhoods.from_lists(self.neighborhoods)
+        first = get_moments(self.point_cloud, neighborhoods, 'z')
+        self.assertIs(get_moments(self.point_cloud, neighborhoods, 'z'), first)
+        neighborhoods.clear_gathered(['z'])
+        self.assertIsNot(get_moments(self.point_cloud, neighborhoods, 'z'), first)
+
+    def test_mean_without_moments(self):
+        """The mean alone should not compute the higher moments, and should be reused by them."""
+        neighborhoods = Neighborhoods.from_lists(self.neighborhoods + [[]])
+        mean = get_mean(self.point_cloud, neighborhoods, 'z')
+        np.testing.assert_allclose(mean[:-1], [np.mean(self.z[neighborhood]) for neighborhood in self.neighborhoods])
+        self.assertTrue(np.isnan(mean[-1]))
+        self.assertEqual([key[0] for key in neighborhoods._derived], ['mean'])
+        self.assertIs(get_moments(self.point_cloud, neighborhoods, 'z').mean, mean)
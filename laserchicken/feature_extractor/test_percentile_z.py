@@ -5,7 +5,9 @@ import unittest
 import numpy as np
 
 from laserchicken import load, keys
-from laserchicken.feature_extractor.percentile_feature_extractor import PercentileFeatureExtractor
+from laserchicken.feature_extractor import feature_extraction
+from laserchicken.feature_extractor.percentile_feature_extractor import PercentileFeatureExtractor, \
+    GroupedPercentileFeatureExtractor
 from laserchicken.test_tools import create_point_cloud
 
 
@@ -61,3 +63,37 @@ class TestPercentileNormZFeatureExtractorArtificialData(unittest.TestCase):
     def test_default_provides_correct(self):
         feature_names = PercentileFeatureExtractor(54, data_key=keys.normalized_height).provides()
         self.assertIn('perc_54_normalized_height', feature_names)
+
+
+class TestGroupedPercentileFeatureExtractor(unittest.TestCase):
+    """Test computing several percentiles at once."""
+
+    def test_same_as_single_percentiles(self):
+        random = np.random.RandomState(0)
+        point_cloud = create_point_cloud(random.rand(100), random.rand(100), random.rand(100))
+        neighborhoods = [list(random.randint(0, 100, n)) for n in [0, 1, 2, 3, 10, 57]]
+        percentiles = [1, 10, 33, 50, 99, 100]
+
+        grouped = GroupedPercentileFeatureExtractor(percentiles).extract(point_cloud, neighborhoods, None, None, None)
+
+        for percentile, values in zip(percentiles, grouped):
+            expected = PercentileFeatureExtractor(percentile).extract(point_cloud, neighborhoods, None, None, None)
+            np.testing.assert_array_equal(values, expected)
+
+    def test_provides_names_of_single_percentiles(self):
+        extractor = GroupedPercentileFeatureExtractor([10, 90], data_key=keys.normalized_height)
+        self.assertEqual(extractor.provides(), ['perc_10_normalized_height', 'perc_90_normalized_height'])
+
+    def test_invalid_percentile(self):
+        point_cloud = create_point_cloud(np.zeros(3), np.zeros(3), np.arange(3))
+        with self.assertRaises(ValueError):
+            GroupedPercentileFeatureExtractor([50, 110]).extract(point_cloud, [[0, 1, 2]], None, None, None)
+
+    def test_compute_features_groups_percentiles(self):
+        """Percentiles of the same attribute should be computed by a single extractor."""
+        features_to_do = ['perc_10_z', 'perc_90_z', 'perc_50_normalized_height', 'mean_z']
+        extractor = feature_extraction._get_extractor('perc_10_z', features_to_do)
+        self.assertIsInstance(extractor, GroupedPercentileFeatureExtractor)
+        self.assertEqual(extractor.provides(), ['perc_10_z', 'perc_90_z'])
+        single = feature_extraction._get_extractor('perc_50_normalized_height', features_to_do)
+        self.assertIsInstance(single, PercentileFeatureExtractor)
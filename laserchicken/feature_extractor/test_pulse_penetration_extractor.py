@@ -19,6 +19,15 @@ class TestPulsePenetrationFeatureExtractorArtificialData(unittest.TestCase):
         pp_ratio = extractor.extract(self.point_cloud, [self.neighborhood], None, None, None)[0]
         self.assertEqual(pp_ratio, self.expected_pp_ratio)
 
+    def test_pulse_other_ground_tags(self):
+        """Points of all given ground tags should be counted as ground."""
+        extractor = PulsePenetrationFeatureExtractor()
+        extractor.ground_tags = [2, 3]
+        pp_ratio = extractor.extract(self.point_cloud, [self.neighborhood], None, None, None)[0]
+        n_ground = self.points_per_plane + np.sum(np.array(self.pt_type) == 3)
+        self.assertEqual(pp_ratio, float(n_ground) / len(self.neighborhood))
+        self.assertEqual(extractor.get_params(), ([2, 3],))
+
     def _set_plane_data(self):
         """Create two planes of ground point at z = +- 0.1."""
         n_points = 10
@@ -0,0 +1,50 @@
+import pickle
+import unittest
+
+import numpy as np
+from numpy.testing import assert_equal
+
+from laserchicken import keys
+from laserchicken.feature_extractor.shared_point_cloud import SharedPointCloud
+from laserchicken.test_tools import create_point_cloud
+
+
+class TestSharedPointCloud(unittest.TestCase):
+    def setUp(self):
+        self.point_cloud = create_point_cloud(np.arange(5.), np.zeros(5), np.arange(5.) * 2)
+        self.point_cloud[keys.point]['raw_classification'] = {'type': 'uint8',
+                                                              'data': np.array([1, 2, 2, 1, 9], dtype=np.uint8)}
+        self.point_cloud[keys.provenance] = [{'module': 'load'}]
+
+    def test_attach_sameValues(self):
+        with SharedPointCloud(self.point_cloud) as shared:
+            copy = pickle.loads(pickle.dumps(shared))
+            attached = copy.attach()
+            for name, attribute in self.point_cloud[keys.point].items():
+                assert_equal(attached[keys.point][name]['data'], attribute['data'])
+                assert_equal(attached[keys.point][name]['data'].dtype, attribute['data'].dtype)
+            assert_equal(attached[keys.provenance], self.point_cloud[keys.provenance])
+
+    def test_attach_readOnly(self):
+        with SharedPointCloud(self.point_cloud) as shared:
+            copy = pickle.loads(pickle.dumps(shared))
+            attached = copy.attach()
+            with self.assertRaises(ValueError):
+                attached[keys.point]['x']['data'][0] = 1
+
+    def test_pickle_withoutData(self):
+        self.point_cloud[keys.point]['x']['data'] = np.zeros(10 ** 6)
+        with SharedPointCloud(self.point_cloud) as shared:
+            assert len(pickle.dumps(shared)) < 10 ** 4
+
+    def test_object_attribute_pickled(self):
+        self.point_cloud[keys.point]['names'] = {'type': 'object', 'data': np.array(['a', 1, None, 'b', 'c'],
+                                                                                    dtype=object)}
+        with SharedPointCloud(self.point_cloud) as shared:
+            copy = pickle.loads(pickle.dumps(shared))
+            attached = copy.attach()
+            assert_equal(attached[keys.point]['names']['data'], self.point_cloud[keys.point]['names']['data'])
+
+    def test_empty_point_cloud(self):
+        with SharedPointCloud({}) as shared:
+            assert_equal(pickle.loads(pickle.dumps(shared)).attach(), {})
@@ -4,6 +4,7 @@ import numpy as np
 
 from laserchicken import keys
 from laserchicken.feature_extractor.feature_extraction import compute_features
+from laserchicken.feature_extractor.sigma_z_feature_extractor import SigmaZFeatureExtractor
 from laserchicken.test_tools import create_point_cloud, create_points_in_xy_grid
 from laserchicken.volume_specification import InfiniteCylinder
 
@@ -31,6 +32,29 @@ class TestExtractSigmaZ(unittest.TestCase):
 
         assert_std_for_z_function_in_xy_grid(z_checkered, 0.5)
 
+    def test_sameAsFittingEachNeighborhood(self):
+        """Batched plane fitting should give the same result as a least squares fit per neighborhood."""
+        random = np.random.RandomState(0)
+        n_points = 1000
+        point_cloud = create_point_cloud(random.rand(n_points) * 10 + 1e5, random.rand(n_points) * 10 + 4e5,
+                                         random.rand(n_points))
+        neighborhoods = [random.choice(n_points, size, replace=False) for size in random.randint(3, 50, 100)]
+        extractor = SigmaZFeatureExtractor()
+        sigma_z = extractor.extract(point_cloud, neighborhoods, None, None, None)
+        expected = [extractor._extract_one(*[point_cloud[keys.point][dim]['data'][neighborhood] for dim in 'xyz'])
+                    for neighborhood in neighborhoods]
+        np.testing.assert_allclose(sigma_z, expected, atol=1e-9)
+
+    def test_pointsOnALine_sameAsFittingNeighborhood(self):
+        """Neighborhoods with singular normal equations should be fitted one by one."""
+        point_cloud = create_point_cloud([0, 1, 2, 3, 0, 0, 1], [0, 1, 2, 3, 0, 1, 0], [1, 0, 3, 1, 1, 2, 0])
+        neighborhoods = [[0, 1, 2, 3], [4, 5], [4, 5, 6]]
+        extractor = SigmaZFeatureExtractor()
+        sigma_z = extractor.extract(point_cloud, neighborhoods, None, None, None)
+        expected = [extractor._extract_one(*[point_cloud[keys.point][dim]['data'][neighborhood] for dim in 'xyz'])
+                    for neighborhood in neighborhoods]
+        np.testing.assert_allclose(sigma_z, expected, atol=1e-12)
+
 
 def assert_std_for_z_function_in_xy_grid(z_checkered, expected):
     """Assert that the standard deviation of z values in a grid of unit x and y"""
@@ -1,7 +1,5 @@
-import numpy as np
-
 from laserchicken.feature_extractor.base_feature_extractor import FeatureExtractor
-from laserchicken.keys import point
+from laserchicken.feature_extractor.moments import get_moments
 
 
 class VarianceFeatureExtractor(FeatureExtractor):
@@ -17,12 +15,4 @@ class VarianceFeatureExtractor(FeatureExtractor):
         return ['var_' + self.data_key]
 
     def extract(self, point_cloud, neighborhoods, target_point_cloud, target_indices, volume_description):
-        return [self._extract_one(point_cloud, neighborhood) for neighborhood in neighborhoods]
-
-    def _extract_one(self, source_point_cloud, neighborhood):
-        if neighborhood:
-            source_data = source_point_cloud[point][self.data_key]['data'][neighborhood]
-            var_z = np.var(source_data)
-        else:
-            var_z = np.nan
-        return var_z
+        return get_moments(point_cloud, neighborhoods, self.data_key).m2
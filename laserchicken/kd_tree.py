@@ -1,9 +1,228 @@
-from scipy.spatial import cKDTree
-import numpy as np
+import collections
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
 import weakref
+
+import numpy as np
+from psutil import virtual_memory
+from scipy.spatial import cKDTree
+
 from laserchicken import keys
 
+# Default maximum size of all cached trees together as a fraction of the total memory
+DEFAULT_CACHE_MEMORY_FRACTION = 0.25
+# Estimated size in bytes of a single node of a cKDTree
+BYTES_PER_TREE_NODE = 72
+# Number of values of each attribute that are hashed to detect changes in the point cloud
+FINGERPRINT_SAMPLE_SIZE = 1000
+# Version of the file format of trees in the disk cache, part of the file names
+DISK_CACHE_FORMAT_VERSION = 1
+
 kd_tree_cache = None
+disk_cache = None
+
+logger = logging.getLogger(__name__)
+
+
+class KDTreeCache(object):
+    """
+    Least recently used cache of KD trees of point clouds, bounded by the total size of the trees in bytes.
+
+    Trees are identified by the attribute arrays they are built from. An entry is removed as soon as one of these arrays
+    is garbage collected. A fingerprint of the shape, type and an evenly spaced sample of the values of the arrays is
+    checked on every lookup, which is cheap also for very large point clouds. Changes in place that affect the sampled
+    values are detected, but other changes in place are not: call invalidate after changing the attribute arrays of a
+    point cloud in place, or replace the arrays instead.
+    """
+
+    def __init__(self, max_bytes=None):
+        """
+        Create an empty cache.
+
+        :param max_bytes: maximum size of all cached trees together; if None, a fraction of the total memory is used
+        """
+        self.max_bytes = int(DEFAULT_CACHE_MEMORY_FRACTION * virtual_memory().total) if max_bytes is None \
+            else max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, pc, attribute_names):
+        """
+        Get the tree of the given attributes of a point cloud, building it if it is not in the cache.
+
+        :param pc: point cloud
+        :param attribute_names: names of the attributes that are the dimensions of the tree, like ('x', 'y')
+        :return: kdtree object
+        """
+        arrays = [pc[keys.point][name]["data"] for name in attribute_names]
+        key = tuple(attribute_names) + tuple(id(array) for array in arrays)
+        fingerprint = _get_fingerprint(arrays)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.fingerprint == fingerprint:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.tree
+            self.misses += 1
+            if entry is not None:
+                self._remove(key)
+
+        tree = _load_or_build_kdtree(pc, attribute_names)
+        n_bytes = _get_tree_size(tree)
+        with self._lock:
+            if n_bytes <= self.max_bytes:
+                self._evict(self.max_bytes - n_bytes)
+                finalizers = [weakref.finalize(array, self._remove, key) for array in arrays]
+                self._entries[key] = _CacheEntry(tree, n_bytes, fingerprint, finalizers)
+        return tree
+
+    def invalidate(self, pc):
+        """
+        Remove the trees of a point cloud from the cache, for instance because its attributes were changed in place.
+
+        :param pc: point cloud
+        """
+        array_ids = {id(attribute['data']) for attribute in pc.get(keys.point, {}).values()}
+        with self._lock:
+            for key in list(self._entries):
+                if any(element in array_ids for element in key if not isinstance(element, str)):
+                    self._remove(key)
+
+    def clear(self):
+        """Remove all trees from the cache."""
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def stats(self):
+        """
+        Get statistics of the cache.
+
+        :return: dictionary with the number of hits, misses and evictions, and the number and total size of the trees
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'n_trees': len(self._entries),
+                    'n_bytes': self._get_total_bytes(),
+                    'max_bytes': self.max_bytes}
+
+    def _evict(self, max_bytes):
+        while self._entries and self._get_total_bytes() > max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            for finalizer in entry.finalizers:
+                finalizer.detach()
+
+    def _get_total_bytes(self):
+        return sum(entry.n_bytes for entry in self._entries.values())
+
+
+_CacheEntry = collections.namedtuple('_CacheEntry', ['tree', 'n_bytes', 'fingerprint', 'finalizers'])
+
+
+class KDTreeDiskCache(object):
+    """
+    Cache of KD trees in files in a directory, so that trees can be reused between runs.
+
+    A point cloud that was read with load and has not been processed since, is identified by the path, size and
+    modification time of its file, without reading the attribute arrays. Other point clouds, and loaded point clouds
+    that were invalidated (see invalidate), are identified by a hash of the complete attribute arrays. Stored trees are
+    checked against the number of points and the same sampled fingerprint as the in memory cache; files that can not
+    be read or that do not match are rebuilt and overwritten.
+
+    Trees are stored with pickle, because a cKDTree can not be restored from plain arrays without building it again.
+    Reading a pickle file can run arbitrary code, so the directory must only be writable by trusted users.
+    """
+
+    def __init__(self, directory):
+        """
+        Create a disk cache in the given directory, which is created if it does not exist.
+
+        :param directory: path of the directory to store trees in
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._changed_arrays = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, pc):
+        """
+        Stop identifying a point cloud by the file it was loaded from, because its attributes were changed in place.
+
+        Trees of the point cloud are looked up by a hash of their complete attribute arrays from then on.
+
+        :param pc: point cloud
+        """
+        for attribute in pc.get(keys.point, {}).values():
+            array = attribute['data']
+            with self._lock:
+                if id(array) not in self._changed_arrays:
+                    self._changed_arrays[id(array)] = weakref.finalize(array, self._forget_array, id(array))
+
+    def _forget_array(self, array_id):
+        with self._lock:
+            self._changed_arrays.pop(array_id, None)
+
+    def _is_changed(self, arrays):
+        with self._lock:
+            return any(id(array) in self._changed_arrays for array in arrays)
+
+    def get(self, pc, attribute_names):
+        """
+        Get the tree of the given attributes of a point cloud from disk, building and storing it if needed.
+
+        :param pc: point cloud
+        :param attribute_names: names of the attributes that are the dimensions of the tree, like ('x', 'y')
+        :return: kdtree object
+        """
+        arrays = [pc[keys.point][name]["data"] for name in attribute_names]
+        key = _get_disk_cache_key(pc, attribute_names, arrays, use_source_path=not self._is_changed(arrays))
+        path = os.path.join(self.directory, key + '.pickle')
+        fingerprint = _get_fingerprint(arrays)
+        tree = self._read(path, fingerprint, len(arrays[0]))
+        if tree is None:
+            tree = _build_kdtree(pc, attribute_names)
+            self._write(path, tree, fingerprint)
+        return tree
+
+    @staticmethod
+    def _read(path, fingerprint, n_points):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                stored = pickle.load(f)
+            if stored['fingerprint'] == fingerprint and stored['tree'].n == n_points:
+                return stored['tree']
+            logger.warning('KD tree in %s does not match the point cloud, rebuilding it', path)
+        except Exception as e:
+            logger.warning('KD tree in %s could not be read (%s), rebuilding it', path, e)
+        return None
+
+    def _write(self, path, tree, fingerprint):
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as f:
+                pickle.dump({'fingerprint': fingerprint, 'tree': tree}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            logger.warning('KD tree could not be written to %s (%s)', path, e)
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
 
 
 def get_kdtree_for_pc(pc):
@@ -12,30 +231,109 @@ def get_kdtree_for_pc(pc):
     :param pc: point cloud
     :return: kdtree object
     """
-    index = -1
-    xref = weakref.ref(pc[keys.point]["x"]["data"])
-    yref = weakref.ref(pc[keys.point]["y"]["data"])
-    for i in range(len(kd_tree_cache[0])):
-        if xref is kd_tree_cache[0][i] and yref is kd_tree_cache[1][i]:
-            index = i
-    if index < 0:
-        # TODO: Check if kd-tree is serialized to file...
-        # If not, build it:
-        kd_tree_cache[0].append(xref)
-        kd_tree_cache[1].append(yref)
-        kd_tree_cache[2].append(_build_kdtree(pc))
-        index = len(kd_tree_cache[0]) - 1
-    return kd_tree_cache[2][index]
-
-
-def _build_kdtree(pc):
-    points = np.column_stack((pc[keys.point]["x"].get("data", []), pc[keys.point]["y"].get("data", [])))
+    return kd_tree_cache.get(pc, ('x', 'y'))
+
+
+def get_3d_kdtree_for_pc(pc):
+    """
+    Creates a kdtree of the point cloud based on its x, y and z attributes.
+    :param pc: point cloud
+    :return: kdtree object
+    """
+    return kd_tree_cache.get(pc, ('x', 'y', 'z'))
+
+
+def _load_or_build_kdtree(pc, attribute_names):
+    if disk_cache is None:
+        return _build_kdtree(pc, attribute_names)
+    return disk_cache.get(pc, attribute_names)
+
+
+def _build_kdtree(pc, attribute_names=('x', 'y')):
+    points = np.column_stack([pc[keys.point][name].get("data", []) for name in attribute_names])
     return cKDTree(points, compact_nodes=False, balanced_tree=False)
 
 
-def initialize_cache():
+def _get_tree_size(tree):
+    return tree.data.nbytes + tree.indices.nbytes + tree.size * BYTES_PER_TREE_NODE
+
+
+def _get_fingerprint(arrays):
+    """Hash of the shape, type and an evenly spaced sample of the values of each array."""
+    fingerprint = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        array = np.asarray(array)
+        fingerprint.update(str((array.shape, array.dtype.str)).encode())
+        if array.size > 0:
+            sample = np.linspace(0, array.size - 1, min(FINGERPRINT_SAMPLE_SIZE, array.size)).astype(int)
+            fingerprint.update(np.ascontiguousarray(array.ravel()[sample]).tobytes())
+    return fingerprint.digest()
+
+
+def _get_disk_cache_key(pc, attribute_names, arrays, use_source_path=True):
+    """Key of a point cloud that was loaded from a file and not processed since, or else a hash of its contents."""
+    key = hashlib.blake2b(digest_size=16)
+    key.update(str((DISK_CACHE_FORMAT_VERSION, tuple(attribute_names))).encode())
+    source_path = _get_source_path(pc) if use_source_path else None
+    if source_path is not None:
+        status = os.stat(source_path)
+        key.update(str((os.path.abspath(source_path), status.st_size, status.st_mtime_ns)).encode())
+    else:
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            key.update(str((array.shape, array.dtype.str)).encode())
+            key.update(array.data)
+    return key.hexdigest()
+
+
+def _get_source_path(pc):
+    """Path of the file the point cloud was read from, if loading was the last step in its provenance log."""
+    log = pc.get(keys.provenance, [])
+    if not log or log[-1].get('module') != 'laserchicken.io.load':
+        return None
+    path = log[-1].get('parameters', {}).get('path')
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return None
+    return path
+
+
+def invalidate(pc):
+    """
+    Forget the cached KD trees of a point cloud. Call this after changing its x, y or z arrays in place.
+
+    If a disk cache is used, trees of the point cloud are no longer identified by the file it was loaded from, so that
+    neither this run nor later runs get a tree of the unchanged file.
+
+    :param pc: point cloud
+    """
+    kd_tree_cache.invalidate(pc)
+    if disk_cache is not None:
+        disk_cache.invalidate(pc)
+
+
+def initialize_cache(max_bytes=None):
+    """
+    Replace the KD tree cache by a new, empty cache.
+
+    :param max_bytes: maximum size of all cached trees together; if None, a fraction of the total memory is used
+    """
     global kd_tree_cache
-    kd_tree_cache = ([], [], [])
+    if kd_tree_cache is not None:
+        kd_tree_cache.clear()
+    kd_tree_cache = KDTreeCache(max_bytes)
+
+
+def initialize_disk_cache(directory=None):
+    """
+    Store KD trees in files in the given directory and reuse them in later runs, or stop doing so.
+
+    The trees are stored with pickle, so the directory must be trusted: a file put there by someone else can run
+    arbitrary code when it is read.
+
+    :param directory: path of the cache directory; if None, trees are not stored on disk
+    """
+    global disk_cache
+    disk_cache = None if directory is None else KDTreeDiskCache(directory)
 
 
 initialize_cache()
@@ -0,0 +1,249 @@
+"""Compact storage of neighborhoods in compressed sparse row (CSR) format."""
+import itertools
+
+import numpy as np
+
+from laserchicken.keys import point
+
+BUILD_CHUNK_SIZE = 100000
+
+
+def get_index_dtype(n_points):
+    """
+    Get the smallest integer type that can hold indices of a point cloud with the given number of points.
+
+    :param n_points: number of points in the (environment) point cloud
+    :return: numpy integer type, either int32 or int64
+    """
+    return np.int32 if n_points <= np.iinfo(np.int32).max else np.int64
+
+
+class Neighborhoods(object):
+    """
+    Collection of neighborhoods stored as two flat arrays.
+
+    The indices of neighborhood i are indices[offsets[i]:offsets[i + 1]]. Offsets do not need to start at 0, so that
+    a slice of neighborhoods can share the indices array of the collection it was taken from without copying.
+
+    Iterating or indexing with a single integer gives lists of indices, which makes this class a drop in replacement
+    for a list of neighborhoods. Vectorized code can work on the offsets and indices arrays directly.
+
+    Attribute values of the points in the neighborhoods can be gathered with gather. The gathered values are kept, so
+    that feature extractors that work on the same neighborhoods do not gather the same attribute again. The caches can
+    be used by several threads at once; at worst, values are gathered or derived more than once.
+    """
+
+    def __init__(self, offsets, indices):
+        offsets = np.asarray(offsets)
+        indices = np.asarray(indices)
+        if offsets.ndim != 1 or offsets.size == 0:
+            raise ValueError('Offsets should be a non empty 1d array, got shape {}.'.format(offsets.shape))
+        if indices.ndim != 1:
+            raise ValueError('Indices should be a 1d array, got shape {}.'.format(indices.shape))
+        self.offsets = offsets
+        self.indices = indices
+        self._gathered = {}
+        self._derived = {}
+
+    @classmethod
+    def from_lists(cls, neighborhoods, dtype=np.int64, chunk_size=BUILD_CHUNK_SIZE):
+        """
+        Create neighborhoods from an iterable of index sequences, like the generator returned by compute_neighborhoods.
+
+        The iterable is consumed a chunk at a time, so that not all neighborhoods need to exist as lists at once.
+
+        :param neighborhoods: iterable of lists (or arrays) of indices
+        :param dtype: integer type of the indices array
+        :param chunk_size: number of neighborhoods that are converted at once
+        :return: neighborhoods object
+        """
+        if isinstance(neighborhoods, Neighborhoods):
+            return neighborhoods
+        neighborhoods = iter(neighborhoods)
+        length_chunks = []
+        index_chunks = []
+        while True:
+            chunk = [np.ravel(neighborhood) for neighborhood in itertools.islice(neighborhoods, chunk_size)]
+            if not chunk:
+                break
+            length_chunks.append(np.fromiter((len(neighborhood) for neighborhood in chunk), dtype=np.int64,
+                                             count=len(chunk)))
+            index_chunks.append(np.concatenate(chunk).astype(dtype, copy=False))
+        lengths = np.concatenate(length_chunks) if length_chunks else np.zeros(0, dtype=np.int64)
+        indices = np.concatenate(index_chunks) if index_chunks else np.zeros(0, dtype=dtype)
+        return cls.from_lengths(lengths, indices)
+
+    @classmethod
+    def from_lengths(cls, lengths, indices):
+        """
+        Create neighborhoods from the number of points in each neighborhood and the concatenated indices.
+
+        :param lengths: number of indices in each neighborhood
+        :param indices: concatenated indices of all neighborhoods
+        :return: neighborhoods object
+        """
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(offsets, indices)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.indices[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('Neighborhoods can only be sliced with step 1, got step {}.'.format(step))
+            stop = max(start, stop)
+            return Neighborhoods(self.offsets[start:stop + 1], self.indices)
+        return self.get_indices(key).tolist()
+
+    def get_indices(self, i):
+        """
+        Get the indices of a single neighborhood as a view on the indices array.
+
+        :param i: index of the neighborhood
+        :return: array of indices
+        """
+        n_neighborhoods = len(self)
+        if not -n_neighborhoods <= i < n_neighborhoods:
+            raise IndexError('Neighborhood index {} out of range for {} neighborhoods.'.format(i, n_neighborhoods))
+        i = i % n_neighborhoods
+        return self.indices[self.offsets[i]:self.offsets[i + 1]]
+
+    @property
+    def lengths(self):
+        """Number of points in each neighborhood."""
+        return np.diff(self.offsets)
+
+    @property
+    def flat_indices(self):
+        """Concatenated indices of all neighborhoods in this collection (a view, also for slices)."""
+        return self.indices[self.offsets[0]:self.offsets[-1]]
+
+    @property
+    def local_offsets(self):
+        """Offsets of the neighborhoods into flat_indices, starting at 0."""
+        return self.offsets - self.offsets[0]
+
+    def gather(self, point_cloud, attribute_name):
+        """
+        Get the values of an attribute of the points in all neighborhoods, aligned with flat_indices.
+
+        The values are gathered from the point cloud once and then cached on this object. They are returned as a read
+        only array that is shared between callers. The cache is refreshed when the attribute is replaced by another
+        array, but not when its data is changed in place (see clear_gathered).
+
+        :param point_cloud: point cloud that the indices refer to
+        :param attribute_name: name of the point attribute
+        :return: array with the same length as flat_indices
+        """
+        if self.offsets[-1] == self.offsets[0]:
+            return np.zeros(0)
+        data = point_cloud[point][attribute_name]['data']
+        key = (id(point_cloud), attribute_name)
+        cached = self._gathered.get(key)
+        if cached is not None and cached[0] is data:
+            return cached[1]
+        values = np.asarray(data)[self.flat_indices]
+        values.flags.writeable = False
+        self._gathered[key] = (data, values)
+        return values
+
+    def gather_per_neighborhood(self, point_cloud, attribute_name):
+        """
+        Get the values of an attribute of the points in each neighborhood.
+
+        :param point_cloud: point cloud that the indices refer to
+        :param attribute_name: name of the point attribute
+        :return: list with an array of values for each neighborhood
+        """
+        return np.split(self.gather(point_cloud, attribute_name), self.local_offsets[1:-1])
+
+    def get_derived(self, name, values, compute):
+        """
+        Get a result that is derived from gathered values, computing it only once for these values.
+
+        The result is cached as long as the values are not replaced, for instance because the attribute they were
+        gathered from was cleared with clear_gathered.
+
+        :param name: name of the kind of result, like 'moments'
+        :param values: gathered values, as returned by gather, that the result is computed from
+        :param compute: function without arguments that computes the result
+        :return: the cached or newly computed result
+        """
+        key = (name, id(values))
+        cached = self._derived.get(key)
+        if cached is not None and cached[0] is values:
+            return cached[1]
+        result = compute()
+        self._derived[key] = (values, result)
+        return result
+
+    def clear_gathered(self, attribute_names=None):
+        """
+        Remove gathered attribute values, and the results derived from them, from the cache.
+
+        :param attribute_names: names of the attributes to remove; if None (default), all are removed
+        """
+        # Work on snapshots and tolerate missing keys, as extractors in other threads may use the caches meanwhile
+        for key in list(self._gathered):
+            if attribute_names is None or key[1] in attribute_names:
+                self._gathered.pop(key, None)
+        remaining_ids = {id(values) for _, values in list(self._gathered.values())}
+        for key in list(self._derived):
+            if key[1] not in remaining_ids:
+                self._derived.pop(key, None)
+
+    def get_owners(self):
+        """
+        Get the neighborhood number of every element of flat_indices.
+
+        :return: array with the same length as flat_indices
+        """
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def reduce(self, ufunc, values, empty_value=np.nan):
+        """
+        Reduce values per neighborhood with a numpy ufunc, for instance np.add or np.maximum.
+
+        :param ufunc: numpy ufunc that supports reduceat
+        :param values: array of values aligned with flat_indices
+        :param empty_value: result for neighborhoods without points
+        :return: array with one value per neighborhood
+        """
+        lengths = self.lengths
+        result = np.full(len(self), empty_value, dtype=float)
+        is_non_empty = lengths > 0
+        if np.any(is_non_empty):
+            result[is_non_empty] = ufunc.reduceat(values, self.local_offsets[:-1][is_non_empty])
+        return result
+
+
+class NeighborhoodCounts(object):
+    """
+    Number of points in each neighborhood, without the indices of the points.
+
+    Feature extractors that only need the number of points (see FeatureExtractor.needs_only_counts) get an object of
+    this class when the neighborhoods were computed with compute_neighborhoods(..., count_only=True). Like a
+    Neighborhoods object, it has a length, a lengths array and can be sliced.
+    """
+
+    def __init__(self, lengths):
+        lengths = np.asarray(lengths)
+        if lengths.ndim != 1 or not np.issubdtype(lengths.dtype, np.integer):
+            raise ValueError('Lengths should be a 1d integer array, got shape {} and type {}.'
+                             .format(lengths.shape, lengths.dtype))
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('Neighborhood counts can only be sliced, the indices of the points are not known.')
+        return NeighborhoodCounts(self.lengths[key])
@@ -1,10 +1,10 @@
 from unittest import TestCase
 
 from laserchicken.build_volume import VOLUMES, build_volume
-from laserchicken.volume_specification import Cell, Cube, InfiniteCylinder, Sphere, Volume
+from laserchicken.volume_specification import Cell, Cube, InfiniteCylinder, Sphere, Volume, KNearest
 
 
-_shapes = [Cell, Cube, InfiniteCylinder, Sphere]
+_shapes = [Cell, Cube, InfiniteCylinder, Sphere, KNearest]
 
 
 class BuildVolumeTest(TestCase):
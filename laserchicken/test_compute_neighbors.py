@@ -7,9 +7,11 @@ from numpy.testing import assert_equal
 
 from laserchicken import kd_tree, keys, load, utils
 from laserchicken.compute_neighbors import compute_neighborhoods, compute_cylinder_neighborhood, \
-    compute_sphere_neighborhood
+    compute_sphere_neighborhood, compute_cube_neighborhood, _filter_neighborhoods, estimate_point_density, \
+    plan_target_batch_size, compute_cell_neighborhood, _get_target_grid_cells, _subsample
+from laserchicken.neighborhoods import Neighborhoods
 from laserchicken.test_tools import create_point_cloud, create_points_in_xy_grid
-from laserchicken.volume_specification import Sphere, InfiniteCylinder, Cell, Cube
+from laserchicken.volume_specification import Sphere, InfiniteCylinder, Cell, Cube, KNearest
 
 
 class TestComputeNeighbors(unittest.TestCase):
@@ -79,6 +81,73 @@ class TestComputeNeighbors(unittest.TestCase):
         neighborhoods = list(compute_neighborhoods(point_cloud, targets, Cell(1.99)))
         assert_equal(len(neighborhoods[0]), 1)
 
+    def test_cell_grid_targets_same_as_filtered_cylinder(self):
+        """Binning on a grid of targets should give the same neighbors as filtering cylinders, also on cell borders."""
+        _, points = create_points_in_xy_grid(lambda x, y: np.random.rand())
+        point_cloud = create_point_cloud(points[:, 0], points[:, 1], points[:, 2])
+        grid_x, grid_y = np.meshgrid(np.arange(0, 10, 2), np.arange(0, 10, 2))
+        targets = create_point_cloud(grid_x.ravel(), grid_y.ravel(), np.zeros(grid_x.size))
+        expected = list(_filter_neighborhoods(
+            point_cloud, targets, compute_cylinder_neighborhood(point_cloud, targets, 2),
+            lambda dx, dy, dz: (np.abs(dx) <= 1) & (np.abs(dy) <= 1)))
+        neighborhoods = list(compute_cell_neighborhood(point_cloud, targets, 2))
+        assert_equal([sorted(n) for n in neighborhoods], [sorted(n) for n in expected])
+        assert_equal(len(neighborhoods[grid_x.shape[1] + 1]), 9)
+
+    def test_cell_grid_origin_given(self):
+        _, points = create_points_in_xy_grid(lambda x, y: np.random.rand())
+        point_cloud = create_point_cloud(points[:, 0], points[:, 1], points[:, 2])
+        targets = create_point_cloud(np.array([4.5, 6.5]), np.array([4.5, 4.5]), np.array([0, 0]))
+        neighborhoods = list(compute_neighborhoods(point_cloud, targets, Cell(2), grid_origin=(-0.5, 1.5)))
+        assert_equal([sorted(n) for n in neighborhoods], [[44, 45, 54, 55], [46, 47, 56, 57]])
+
+    def test_cell_grid_origin_not_matching_targets(self):
+        targets = create_point_cloud(np.array([4.5]), np.array([4.5]), np.array([0]))
+        with self.assertRaises(ValueError):
+            compute_neighborhoods(self.point_cloud, targets, Cell(2), grid_origin=(0, 0))
+
+    def test_target_grid_cells_irregular_targets(self):
+        targets = create_point_cloud(np.array([0, 1.5]), np.array([0, 0]), np.array([0, 0]))
+        self.assertIsNone(_get_target_grid_cells(targets, 1))
+
+    def test_k_nearest_sorted_by_distance(self):
+        """Neighborhoods should be the k nearest environment points, nearest first."""
+        target_point_cloud = self._get_random_targets()
+        neighborhoods = list(compute_neighborhoods(self.point_cloud, target_point_cloud, KNearest(10)))
+        env_xyz = np.column_stack(utils.get_point(self.point_cloud, slice(None)))
+        for i, neighborhood in enumerate(neighborhoods):
+            distances = np.linalg.norm(env_xyz - np.array(utils.get_point(target_point_cloud, i)), axis=1)
+            assert_equal(len(neighborhood), 10)
+            np.testing.assert_allclose(distances[neighborhood], np.sort(distances)[:10])
+
+    def test_k_nearest_2d_ignores_z(self):
+        _, points = create_points_in_xy_grid(lambda x, y: 10 * (x % 2))
+        point_cloud = create_point_cloud(points[:, 0], points[:, 1], points[:, 2])
+        targets = create_point_cloud(np.array([4]), np.array([4]), np.array([0]))
+        neighborhoods = list(compute_neighborhoods(point_cloud, targets, KNearest(5, dimensions=2)))
+        assert_equal(sorted(neighborhoods[0]), [34, 43, 44, 45, 54])
+
+    def test_k_nearest_max_radius(self):
+        _, points = create_points_in_xy_grid(lambda x, y: 0)
+        point_cloud = create_point_cloud(points[:, 0], points[:, 1], points[:, 2])
+        targets = create_point_cloud(np.array([4, 0]), np.array([4, 0]), np.array([0, 20]))
+        neighborhoods = list(compute_neighborhoods(point_cloud, targets, KNearest(9, max_radius=1.1)))
+        assert_equal(sorted(neighborhoods[0]), [34, 43, 44, 45, 54])
+        assert_equal(neighborhoods[1], [])
+
+    def test_k_nearest_as_csr(self):
+        target_point_cloud = self._get_random_targets()
+        volume = KNearest(7, max_radius=0.3)
+        expected = list(compute_neighborhoods(self.point_cloud, target_point_cloud, volume))
+        neighborhoods = compute_neighborhoods(self.point_cloud, target_point_cloud, volume, as_csr=True)
+        self.assertIsInstance(neighborhoods, Neighborhoods)
+        assert_equal(list(neighborhoods), expected)
+
+    def test_k_nearest_no_points(self):
+        targets = create_point_cloud(np.zeros(2), np.zeros(2), np.zeros(2))
+        neighborhoods = list(compute_neighborhoods(create_emtpy_point_cloud(), targets, KNearest(3)))
+        assert_equal(neighborhoods, [[], []])
+
     def test_cube_no_points(self):
         point_cloud = create_emtpy_point_cloud()
         targets = create_point_cloud(np.zeros(1), np.zeros(1), np.zeros(1))
@@ -92,6 +161,174 @@ class TestComputeNeighbors(unittest.TestCase):
         neighborhoods = list(compute_neighborhoods(point_cloud, targets, Cube(2)))
         assert_equal(len(neighborhoods[0]), 2)
 
+    def test_sphere_neighbors_same_as_filtered_cylinder(self):
+        """The 3D tree query should find the same points as filtering the cylinder neighborhood by distance."""
+        target_point_cloud = self._get_random_targets()
+        radius = 0.5
+        cylinders = compute_cylinder_neighborhood(self.point_cloud, target_point_cloud, radius)
+        spheres = compute_sphere_neighborhood(self.point_cloud, target_point_cloud, radius)
+        for i, (cylinder, sphere) in enumerate(zip(cylinders, spheres)):
+            target_x, target_y, target_z = utils.get_point(target_point_cloud, i)
+            x, y, z = utils.get_point(self.point_cloud, cylinder)
+            is_inside = (x - target_x) ** 2 + (y - target_y) ** 2 + (z - target_z) ** 2 <= radius ** 2
+            assert_equal(sorted(sphere), sorted(np.array(cylinder)[is_inside]))
+
+    def test_cube_neighbors_within_box(self):
+        """Compute neighbors should only return points within the cell in xy and within side length in z."""
+        target_point_cloud = self._get_random_targets()
+        side_length = 1.
+        neighborhoods = list(compute_cube_neighborhood(self.point_cloud, target_point_cloud, side_length))
+        for i, neighborhood in enumerate(neighborhoods):
+            target_x, target_y, target_z = utils.get_point(target_point_cloud, i)
+            x, y, z = utils.get_point(self.point_cloud, neighborhood)
+            self.assertTrue(np.all(np.abs(x - target_x) <= 0.5 * side_length))
+            self.assertTrue(np.all(np.abs(y - target_y) <= 0.5 * side_length))
+            self.assertTrue(np.all(np.abs(z - target_z) <= side_length))
+
+    def test_filter_neighborhoods_chunk_size_does_not_change_result(self):
+        """Filtering in small chunks should give the same neighborhoods as filtering all targets at once."""
+        target_point_cloud = self._get_random_targets()
+        candidates = list(compute_cylinder_neighborhood(self.point_cloud, target_point_cloud, 1))
+
+        def is_inside(dx, dy, dz):
+            return dx ** 2 + dy ** 2 + dz ** 2 <= 0.25
+
+        in_one_chunk = list(_filter_neighborhoods(self.point_cloud, target_point_cloud, candidates, is_inside))
+        in_small_chunks = list(_filter_neighborhoods(self.point_cloud, target_point_cloud, candidates, is_inside,
+                                                     chunk_size=3))
+        assert_equal(in_small_chunks, in_one_chunk)
+
+    def test_compute_neighbors_asCsr(self):
+        """Neighborhoods in CSR format should contain the same neighbors as the generator of lists."""
+        target_point_cloud = self._get_random_targets()
+        sphere = Sphere(0.5)
+        expected = list(compute_neighborhoods(self.point_cloud, target_point_cloud, sphere))
+        neighborhoods = compute_neighborhoods(self.point_cloud, target_point_cloud, sphere, as_csr=True)
+        self.assertIsInstance(neighborhoods, Neighborhoods)
+        assert_equal(neighborhoods.indices.dtype, np.int32)
+        assert_equal(list(neighborhoods), expected)
+
+    def test_cylinder_small_memory_budget_same_neighbors(self):
+        """Computing neighborhoods in many small batches should give the same neighbors as a single batch."""
+        target_point_cloud = self._get_random_targets()
+        radius = 0.5
+        single_batch = list(compute_cylinder_neighborhood(self.point_cloud, target_point_cloud, radius))
+        small_batches = list(compute_cylinder_neighborhood(self.point_cloud, target_point_cloud, radius,
+                                                           memory_budget=1))
+        assert_equal([sorted(n) for n in small_batches], [sorted(n) for n in single_batch])
+
+    def test_multiple_workers_same_neighbors_all_volumes(self):
+        """Using multiple workers should give the same neighbors for each target, in the same target order."""
+        target_point_cloud = self._get_random_targets()
+        for volume in [Sphere(0.5), InfiniteCylinder(0.5), Cell(1), Cube(1)]:
+            expected = list(compute_neighborhoods(self.point_cloud, target_point_cloud, volume))
+            parallel = list(compute_neighborhoods(self.point_cloud, target_point_cloud, volume, n_workers=2,
+                                                  memory_budget=10 ** 4))
+            assert_equal([sorted(n) for n in parallel], [sorted(n) for n in expected])
+
+    def test_count_only_same_as_lengths_all_volumes(self):
+        """Counting neighbors should give the lengths of the neighborhoods, also with subsampling."""
+        target_point_cloud = self._get_random_targets()
+        for volume in [Sphere(0.5), InfiniteCylinder(0.5), Cell(1), Cube(1), KNearest(5, max_radius=0.3)]:
+            for sample_size in [None, 3]:
+                expected = [len(n) for n in compute_neighborhoods(self.point_cloud, target_point_cloud, volume,
+                                                                  sample_size=sample_size)]
+                counts = compute_neighborhoods(self.point_cloud, target_point_cloud, volume, sample_size=sample_size,
+                                               count_only=True)
+                assert_equal(counts, expected)
+
+    def test_count_only_cell_grid(self):
+        n_points, points = create_points_in_xy_grid(lambda x, y: 0)
+        environment = create_point_cloud(points[:, 0], points[:, 1], points[:, 2])
+        targets = create_point_cloud([0.5, 1.5, 20.5], [0.5, 0.5, 0.5], [0, 0, 0])
+        expected = [len(n) for n in compute_neighborhoods(environment, targets, Cell(1))]
+        assert_equal(compute_neighborhoods(environment, targets, Cell(1), count_only=True), expected)
+
+    def test_count_only_no_points(self):
+        environment = create_point_cloud([], [], [])
+        counts = compute_neighborhoods(environment, self._get_random_targets(), Sphere(1), count_only=True)
+        assert_equal(counts, np.zeros(20))
+
+    def test_count_only_as_csr_raises(self):
+        with self.assertRaises(ValueError):
+            compute_neighborhoods(self.point_cloud, self._get_random_targets(), Sphere(1), count_only=True,
+                                  as_csr=True)
+
+    def test_multiple_workers_deterministic(self):
+        """Repeated runs with multiple workers should give identical neighborhoods."""
+        target_point_cloud = self._get_random_targets()
+        first = list(compute_neighborhoods(self.point_cloud, target_point_cloud, Sphere(0.5), n_workers=-1))
+        second = list(compute_neighborhoods(self.point_cloud, target_point_cloud, Sphere(0.5), n_workers=-1))
+        assert_equal(first, second)
+
+    def test_sample_size_subset_without_duplicates(self):
+        """Subsampled neighborhoods should be random subsets of the full neighborhoods."""
+        target_point_cloud = self._get_random_targets()
+        full = list(compute_neighborhoods(self.point_cloud, target_point_cloud, Sphere(1)))
+        sampled = list(compute_neighborhoods(self.point_cloud, target_point_cloud, Sphere(1), sample_size=5,
+                                             random_state=0))
+        for full_neighborhood, sampled_neighborhood in zip(full, sampled):
+            assert_equal(len(sampled_neighborhood), min(5, len(full_neighborhood)))
+            assert_equal(len(set(sampled_neighborhood)), len(sampled_neighborhood))
+            self.assertTrue(set(sampled_neighborhood) <= set(full_neighborhood))
+
+    def test_sample_size_random_state_reproducible(self):
+        """The same seed should give the same samples, regardless of workers and batches."""
+        target_point_cloud = self._get_random_targets()
+        volume = Sphere(1)
+        first = list(compute_neighborhoods(self.point_cloud, target_point_cloud, volume, sample_size=5,
+                                           random_state=42))
+        parallel = list(compute_neighborhoods(self.point_cloud, target_point_cloud, volume, sample_size=5,
+                                              random_state=42, n_workers=2, memory_budget=10 ** 4))
+        other_seed = list(compute_neighborhoods(self.point_cloud, target_point_cloud, volume, sample_size=5,
+                                                random_state=43))
+        assert_equal(parallel, first)
+        self.assertNotEqual(other_seed, first)
+
+    def test_sample_size_random_state_generator(self):
+        target_point_cloud = self._get_random_targets()
+        first = compute_neighborhoods(self.point_cloud, target_point_cloud, Sphere(1), sample_size=5,
+                                      random_state=np.random.default_rng(1), as_csr=True)
+        second = compute_neighborhoods(self.point_cloud, target_point_cloud, Sphere(1), sample_size=5,
+                                       random_state=np.random.default_rng(1), as_csr=True)
+        assert_equal(first.indices, second.indices)
+
+    def test_subsample_chunks_use_different_samples(self):
+        """Identical neighborhoods in different chunks should get independent samples."""
+        neighborhoods = [list(range(100))] * 20001
+        samples = list(_subsample(neighborhoods, 10, np.random.SeedSequence(0)))
+        assert_equal(len(samples), 20001)
+        self.assertNotEqual(samples[0], samples[10000])
+        self.assertNotEqual(samples[0], samples[1])
+
+    def test_plan_target_batch_size_fits_budget(self):
+        """Batch size should be the budget divided by the estimated memory per target, logged as a plan."""
+        target_point_cloud = self._get_random_targets()
+        with self.assertLogs('laserchicken.compute_neighbors', level='INFO') as logs:
+            batch_size = plan_target_batch_size(self.point_cloud, target_point_cloud, 1, memory_budget=10 ** 4)
+        self.assertLess(batch_size, 20)
+        self.assertGreaterEqual(batch_size, 1)
+        self.assertTrue(any('Neighborhood plan' in line for line in logs.output))
+
+    def test_plan_target_batch_size_at_most_number_of_targets(self):
+        target_point_cloud = self._get_random_targets()
+        batch_size = plan_target_batch_size(self.point_cloud, target_point_cloud, 1, memory_budget=10 ** 12)
+        assert_equal(batch_size, 20)
+
+    def test_estimate_point_density_bounding_box(self):
+        _, points = create_points_in_xy_grid(lambda x, y: 0)
+        point_cloud = create_point_cloud(points[:, 0], points[:, 1], points[:, 2])
+        self.assertAlmostEqual(estimate_point_density(point_cloud), 100 / 81)
+
+    def test_estimate_point_density_sampled(self):
+        _, points = create_points_in_xy_grid(lambda x, y: 0)
+        point_cloud = create_point_cloud(points[:, 0], points[:, 1], points[:, 2])
+        targets = create_point_cloud(np.array([4.5]), np.array([4.5]), np.array([0]))
+        self.assertAlmostEqual(estimate_point_density(point_cloud, targets, radius=1), 4 / np.pi)
+
+    def test_estimate_point_density_empty(self):
+        assert_equal(estimate_point_density(create_emtpy_point_cloud()), 0)
+
     def test_target_number_matches_neighborhood_number(self):
         _, points = create_points_in_xy_grid(lambda x, y: 10 * (x % 2))
         environment_point_cloud = create_point_cloud(points[:, 0], points[:, 1], points[:, 2])
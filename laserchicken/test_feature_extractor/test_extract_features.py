@@ -8,6 +8,7 @@ from laserchicken import keys, test_tools
 from laserchicken.feature_extractor import feature_map, feature_extraction
 from laserchicken.feature_extractor.mean_std_coeff_feature_extractor import MeanStdCoeffFeatureExtractor
 from laserchicken.feature_extractor.median_feature_extractor import MedianFeatureExtractor
+from laserchicken.neighborhoods import Neighborhoods, NeighborhoodCounts
 from laserchicken.test_feature_extractor import Test1FeatureExtractor
 from laserchicken.utils import get_attribute_value
 from laserchicken.volume_specification import Sphere
@@ -43,6 +44,13 @@ class TestExtractFeatures(unittest.TestCase):
         target = _compute_features(target, feature_names)
         assert all(target[keys.point]['test1_a']['data'] == 0.5 * target[keys.point]['z']['data'])
 
+    @staticmethod
+    def test_extract_dependencies_computed_first():
+        """Features should be computed after the features they require, also from extractors providing several."""
+        target = test_tools.ComplexTestData().get_point_cloud()
+        _compute_features(target, ['test3_a'])
+        np.testing.assert_allclose(target[keys.point]['test3_a']['data'], target[keys.point]['z']['data'])
+
     @staticmethod
     def test_extract_unknown_feature():
         with raises(ValueError):
@@ -80,6 +88,151 @@ class TestExtractFeatures(unittest.TestCase):
         neighborhoods = ([] for _ in range(len(target["vertex"]["x"]["data"])))
         feature_extraction.compute_features({}, neighborhoods, target, feature_names, Sphere(5))
 
+    @staticmethod
+    def test_with_neighborhoods_object():
+        """Neighborhoods in CSR format should give the same results as lists of neighborhoods."""
+        _assert_same_as_serial(['median_z', 'mean_z'], make_neighborhoods=Neighborhoods.from_lists)
+
+    @staticmethod
+    def test_chunk_attributes_gathered_once():
+        """Extractors working on the same chunk should share the gathered attribute values."""
+        env = test_tools.create_point_cloud(np.arange(10.), np.arange(10.), np.arange(10.))
+        chunk = feature_extraction._get_neighborhoods_chunk(iter([[0, 1], [2, 3, 4]]), 0, 2)
+        assert isinstance(chunk, Neighborhoods)
+        MedianFeatureExtractor().extract(env, chunk, None, None, None)
+        gathered = chunk.gather(env, 'z')
+        MeanStdCoeffFeatureExtractor().extract(env, chunk, None, None, None)
+        assert chunk.gather(env, 'z') is gathered
+
+    @staticmethod
+    def test_chunk_count_only():
+        """Given neighborhoods should only be counted if all extractors only need counts."""
+        chunk = feature_extraction._get_neighborhoods_chunk(iter([[0, 1], [2, 3, 4], [5]]), 0, 2, count_only=True)
+        assert isinstance(chunk, NeighborhoodCounts)
+        np.testing.assert_array_equal(chunk.lengths, [2, 3])
+
+    @staticmethod
+    def test_n_jobs_same_as_serial():
+        """Features computed by worker processes should have the same values and provenance as computed serially."""
+        expected, target = _assert_same_as_serial(['test3_a', 'median_z', 'mean_z'], n_jobs=2)
+        assert [(entry['module'], entry.get('parameters')) for entry in target[keys.provenance]] == \
+               [(entry['module'], entry.get('parameters')) for entry in expected[keys.provenance]]
+
+    @staticmethod
+    def test_n_threads_same_as_serial():
+        """Extractors run concurrently should give the same values and provenance, also for dependent features."""
+        expected, target = _assert_same_as_serial(['test3_a', 'test2_b', 'median_z', 'mean_z'], n_threads=3)
+        assert [entry['module'] for entry in target[keys.provenance]] == \
+               [entry['module'] for entry in expected[keys.provenance]]
+
+    @staticmethod
+    def test_plan_waits_for_required_features():
+        extended_features = feature_extraction._make_extended_feature_list(['test3_a'])
+        extractors = feature_extraction._get_configured_extractors(extended_features, {})
+        plan = feature_extraction._plan_extractors(extended_features, extractors, {})
+        assert [type(extractor) for extractor in plan] == \
+               [Test1FeatureExtractor, Test2FeatureExtractor, Test3FeatureExtractor]
+
+    @staticmethod
+    def test_kwargs_set_on_copies():
+        target = test_tools.ComplexTestData().get_point_cloud()
+        feature_extraction.compute_features({}, [[] for _ in range(4)], target, ['test1_a'], Sphere(5),
+                                            some_parameter=1)
+        assert not hasattr(feature_extraction.FEATURES['test1_a'], 'some_parameter')
+
+    @staticmethod
+    def test_chunk_size_same_values():
+        """Smaller chunks should give the same values, with provenance of each extractor for every chunk."""
+        expected, target = _assert_same_as_serial(['test3_a', 'median_z'], chunk_size=3)
+        assert _count_extractor_entries(target, MedianFeatureExtractor) == 4
+        assert _count_extractor_entries(expected, MedianFeatureExtractor) == 1
+
+    @staticmethod
+    def test_in_chunks_same_as_compute_features():
+        """Chunks should cover all targets in order, with the same values as compute_features."""
+        _assert_same_as_serial(['test3_a', 'median_z'], compute=_compute_features_from_chunks, chunk_size=3)
+
+    @staticmethod
+    def test_in_chunks_target_unchanged():
+        target = test_tools.ComplexTestData().get_point_cloud()
+        original_attributes = set(target[keys.point])
+        original_log_length = len(target[keys.provenance])
+        for _, values in feature_extraction.compute_features_in_chunks({}, [[] for _ in range(4)], target,
+                                                                       ['test3_a'], Sphere(5), verbose=False):
+            assert list(values) == ['test3_a']
+        assert set(target[keys.point]) == original_attributes
+        assert len(target[keys.provenance]) == original_log_length
+
+    @staticmethod
+    def test_in_chunks_consumes_neighborhoods_lazily():
+        consumed = []
+
+        def generate_neighborhoods():
+            for i in range(10):
+                consumed.append(i)
+                yield [i]
+
+        x = y = z = np.arange(10, dtype=float)
+        env = test_tools.create_point_cloud(x, y, z)
+        target = test_tools.create_point_cloud(x, y, z)
+        chunks = feature_extraction.compute_features_in_chunks(env, generate_neighborhoods(), target, ['median_z'],
+                                                               Sphere(5), verbose=False, chunk_size=4)
+        target_range, values = next(chunks)
+        assert target_range == range(0, 4)
+        np.testing.assert_allclose(values['median_z'], [0, 1, 2, 3])
+        assert len(consumed) == 4
+
+    @staticmethod
+    def test_in_chunks_n_jobs_same_values():
+        _assert_same_as_serial(['mean_z'], compute=_compute_features_from_chunks, chunk_size=4, n_jobs=2)
+
+    @staticmethod
+    def test_in_chunks_invalid_arguments_raise_before_iterating():
+        target = test_tools.ComplexTestData().get_point_cloud()
+        with raises(ValueError):
+            feature_extraction.compute_features_in_chunks({}, [[] for _ in range(4)], target, ['test1_a'], Sphere(5),
+                                                          chunk_size=0)
+
+    @staticmethod
+    def test_chunk_size_auto_uses_memory_budget():
+        x = y = z = np.arange(2000, dtype=float)
+        neighborhoods = Neighborhoods.from_lengths(np.full(2000, 10), np.arange(20000) % 2000)
+        env = test_tools.create_point_cloud(x, y, z)
+        target = test_tools.create_point_cloud(x, y, z)
+        bytes_per_target = 10 * feature_extraction.BYTES_PER_NEIGHBOR_IN_CHUNK + \
+            feature_extraction.BYTES_PER_TARGET_IN_CHUNK + feature_extraction.BYTES_PER_FEATURE_VALUE
+        feature_extraction.compute_features(env, neighborhoods, target, ['median_z'], Sphere(5), verbose=False,
+                                            chunk_size='auto', memory_budget=250 * bytes_per_target)
+        # A first chunk of AUTO_FIRST_CHUNK_SIZE targets, then chunks of 250 targets
+        assert _count_extractor_entries(target, MedianFeatureExtractor) == 1 + 4
+
+    @staticmethod
+    def test_plan_chunk_size_counts():
+        chunk_size = feature_extraction._plan_chunk_size(NeighborhoodCounts(np.full(10, 1000)), 10 ** 6, 1, 1,
+                                                         memory_budget=10 ** 6)
+        assert chunk_size == 10 ** 6 // (feature_extraction.BYTES_PER_TARGET_IN_CHUNK +
+                                         feature_extraction.BYTES_PER_FEATURE_VALUE)
+
+    @staticmethod
+    def test_plan_chunk_size_threads():
+        neighborhoods = Neighborhoods.from_lengths(np.full(10, 100), np.zeros(1000, dtype=int))
+        single = feature_extraction._plan_chunk_size(neighborhoods, 10 ** 6, 1, 1, memory_budget=10 ** 8)
+        threaded = feature_extraction._plan_chunk_size(neighborhoods, 10 ** 6, 1, 4, memory_budget=10 ** 8)
+        assert 1 <= threaded < single
+
+    @staticmethod
+    def test_chunk_size_invalid():
+        target = test_tools.ComplexTestData().get_point_cloud()
+        with raises(ValueError):
+            feature_extraction.compute_features({}, [[] for _ in range(4)], target, ['test1_a'], Sphere(5),
+                                                chunk_size=0)
+
+    @staticmethod
+    def test_n_jobs_invalid():
+        target = test_tools.ComplexTestData().get_point_cloud()
+        with raises(ValueError):
+            feature_extraction.compute_features({}, [[] for _ in range(4)], target, ['test1_a'], Sphere(5), n_jobs=0)
+
     def setUp(self) -> None:
         self.original_function = feature_map._get_default_extractors
         feature_map._get_default_extractors = _get_test_extractors
@@ -104,6 +257,46 @@ def _assert_feature_name_all_valued(expected, feature_name, n, target):
     np.testing.assert_allclose(v, expected)
 
 
+def _assert_same_as_serial(feature_names, make_neighborhoods=iter, compute=feature_extraction.compute_features,
+                           **compute_kwargs):
+    """
+    Compute features of a small point cloud serially and with the given options, and assert that the values are equal.
+
+    :return: point cloud with the serially computed features, and point cloud with the features computed with options
+    """
+    x = y = z = np.arange(10, dtype=float)
+    neighborhoods = [[i, (i + 1) % 10, (i + 3) % 10] for i in range(10)]
+    env = test_tools.create_point_cloud(x, y, z)
+    expected = test_tools.create_point_cloud(x, y, z)
+    feature_extraction.compute_features(env, neighborhoods, expected, feature_names, Sphere(5), verbose=False)
+    target = test_tools.create_point_cloud(x, y, z)
+    compute(env, make_neighborhoods(neighborhoods), target, feature_names, Sphere(5), verbose=False, **compute_kwargs)
+    for feature_name in feature_names:
+        np.testing.assert_allclose(target[keys.point][feature_name]['data'],
+                                   expected[keys.point][feature_name]['data'])
+    return expected, target
+
+
+def _compute_features_from_chunks(env_point_cloud, neighborhoods, target, feature_names, volume, **kwargs):
+    """Add the features yielded by compute_features_in_chunks to the target, checking that chunks cover all targets."""
+    n_targets = len(target[keys.point]['x']['data'])
+    values_per_feature = {feature_name: [] for feature_name in feature_names}
+    i_next = 0
+    for target_range, values in feature_extraction.compute_features_in_chunks(env_point_cloud, neighborhoods, target,
+                                                                              feature_names, volume, **kwargs):
+        assert target_range.start == i_next and target_range.stop > target_range.start
+        i_next = target_range.stop
+        for feature_name in feature_names:
+            values_per_feature[feature_name].append(values[feature_name])
+    assert i_next == n_targets
+    for feature_name, values in values_per_feature.items():
+        target[keys.point][feature_name] = {'type': 'float64', 'data': np.concatenate(values)}
+
+
+def _count_extractor_entries(point_cloud, extractor_class):
+    return sum(1 for entry in point_cloud[keys.provenance] if entry['module'] == extractor_class.__module__)
+
+
 def _compute_features(target, feature_names):
     neighborhoods = [[] for _ in range(len(target["vertex"]["x"]["data"]))]
     feature_extraction.compute_features({}, neighborhoods, target, feature_names, Sphere(5))
@@ -1,7 +1,12 @@
+import gc
 import os
+import shutil
 import unittest
 
+import numpy as np
+
 from laserchicken import keys,kd_tree,load
+from laserchicken.test_tools import create_point_cloud
 
 
 class TestKDTree(unittest.TestCase):
@@ -20,6 +25,79 @@ class TestKDTree(unittest.TestCase):
         secondtree = kd_tree.get_kdtree_for_pc(self.pointcloud)
         self.assertEqual(firsttree,secondtree)
 
+    def test_3d_kd_tree_cache(self):
+        """ Tests the caching mechanism of 3D trees next to 2D trees """
+        first_tree = kd_tree.get_3d_kdtree_for_pc(self.pointcloud)
+        second_tree = kd_tree.get_3d_kdtree_for_pc(self.pointcloud)
+        self.assertIs(first_tree, second_tree)
+        self.assertEqual(first_tree.m, 3)
+        self.assertEqual(kd_tree.get_kdtree_for_pc(self.pointcloud).m, 2)
+
+    def test_kd_tree_cache_stats(self):
+        """ Tests the hit and miss counters """
+        kd_tree.get_kdtree_for_pc(self.pointcloud)
+        kd_tree.get_kdtree_for_pc(self.pointcloud)
+        stats = kd_tree.kd_tree_cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['n_trees'], 1)
+        self.assertGreater(stats['n_bytes'], 0)
+
+    def test_kd_tree_cache_clear(self):
+        first_tree = kd_tree.get_kdtree_for_pc(self.pointcloud)
+        kd_tree.kd_tree_cache.clear()
+        self.assertEqual(kd_tree.kd_tree_cache.stats()['n_trees'], 0)
+        self.assertIsNot(kd_tree.get_kdtree_for_pc(self.pointcloud), first_tree)
+
+    def test_kd_tree_cache_removed_with_point_cloud(self):
+        """ Trees should be removed from the cache when the point cloud is garbage collected """
+        pc = create_point_cloud(np.arange(10), np.arange(10), np.arange(10))
+        kd_tree.get_kdtree_for_pc(pc)
+        self.assertEqual(kd_tree.kd_tree_cache.stats()['n_trees'], 1)
+        del pc
+        gc.collect()
+        self.assertEqual(kd_tree.kd_tree_cache.stats()['n_trees'], 0)
+
+    def test_kd_tree_cache_lru_eviction(self):
+        """ Least recently used trees should be evicted when the cache is full """
+        pcs = [create_point_cloud(np.arange(100), np.arange(100), np.arange(100)) for _ in range(3)]
+        tree_size = kd_tree._get_tree_size(kd_tree._build_kdtree(pcs[0]))
+        kd_tree.initialize_cache(max_bytes=2 * tree_size)
+        first_tree = kd_tree.get_kdtree_for_pc(pcs[0])
+        kd_tree.get_kdtree_for_pc(pcs[1])
+        kd_tree.get_kdtree_for_pc(pcs[0])
+        kd_tree.get_kdtree_for_pc(pcs[2])
+        stats = kd_tree.kd_tree_cache.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['n_trees'], 2)
+        self.assertIs(kd_tree.get_kdtree_for_pc(pcs[0]), first_tree)
+
+    def test_kd_tree_cache_rebuilt_after_change(self):
+        """ Trees should be rebuilt when the point cloud was changed in place """
+        pc = create_point_cloud(np.arange(10), np.arange(10), np.arange(10))
+        first_tree = kd_tree.get_kdtree_for_pc(pc)
+        pc[keys.point]['x']['data'][:] += 1
+        second_tree = kd_tree.get_kdtree_for_pc(pc)
+        self.assertIsNot(second_tree, first_tree)
+        np.testing.assert_allclose(second_tree.data[:, 0], np.arange(10) + 1)
+
+    def test_kd_tree_cache_unsampled_change_needs_invalidate(self):
+        """ A change in place outside the fingerprint sample is only picked up after invalidating the point cloud """
+        pc = create_point_cloud(np.arange(5000.), np.zeros(5000), np.zeros(5000))
+        first_tree = kd_tree.get_kdtree_for_pc(pc)
+        pc[keys.point]['x']['data'][1] = 1e6
+        self.assertIs(kd_tree.get_kdtree_for_pc(pc), first_tree)
+        kd_tree.invalidate(pc)
+        second_tree = kd_tree.get_kdtree_for_pc(pc)
+        self.assertIsNot(second_tree, first_tree)
+        self.assertEqual(second_tree.query([1e6, 0]), (0, 1))
+
+    def test_kd_tree_cache_invalidate_other_point_cloud(self):
+        pc = create_point_cloud(np.arange(10.), np.arange(10.), np.arange(10.))
+        first_tree = kd_tree.get_kdtree_for_pc(pc)
+        kd_tree.invalidate(create_point_cloud(np.arange(10.), np.arange(10.), np.arange(10.)))
+        self.assertIs(kd_tree.get_kdtree_for_pc(pc), first_tree)
+
     def test_sphere_neighb_kd_tree(self):
         """ Tests whether sphere neighborhood gives good result """
         tree = kd_tree.get_kdtree_for_pc(self.pointcloud)
@@ -37,6 +115,96 @@ class TestKDTree(unittest.TestCase):
 
     def setUp(self):
         self.pointcloud = load(os.path.join(self._test_data_source,self._test_file_name))
+        kd_tree.initialize_cache()
 
     def tearDown(self):
         pass
+
+
+class TestKDTreeDiskCache(unittest.TestCase):
+    _test_dir = 'TMP_KD_TREE_CACHE'
+    _test_file_path = os.path.join('testdata', 'AHN3.las')
+
+    def test_disk_cache_writesFile(self):
+        kd_tree.get_kdtree_for_pc(create_point_cloud(np.arange(10), np.arange(10), np.arange(10)))
+        self.assertEqual(len(self._get_cache_files()), 1)
+
+    def test_disk_cache_reusedAfterRestart(self):
+        """ Trees should be read from disk by a fresh in memory cache instead of being rebuilt """
+        pc = create_point_cloud(np.arange(10.), np.arange(10.), np.arange(10.))
+        first_tree = kd_tree.get_kdtree_for_pc(pc)
+        kd_tree.initialize_cache()
+        second_tree = kd_tree.get_kdtree_for_pc(pc)
+        self.assertIsNot(second_tree, first_tree)
+        np.testing.assert_equal(second_tree.data, first_tree.data)
+        self.assertEqual(second_tree.query_ball_point([5, 5], 1.5), first_tree.query_ball_point([5, 5], 1.5))
+
+    def test_disk_cache_sameContentSameFile(self):
+        kd_tree.get_kdtree_for_pc(create_point_cloud(np.arange(10.), np.arange(10.), np.arange(10.)))
+        kd_tree.get_kdtree_for_pc(create_point_cloud(np.arange(10.), np.arange(10.), np.zeros(10)))
+        self.assertEqual(len(self._get_cache_files()), 1)
+
+    def test_disk_cache_loadedFileKeyedByPath(self):
+        pc = load(self._test_file_path)
+        self.assertEqual(kd_tree._get_source_path(pc), self._test_file_path)
+        kd_tree.get_kdtree_for_pc(pc)
+        kd_tree.initialize_cache()
+        kd_tree.get_kdtree_for_pc(load(self._test_file_path))
+        self.assertEqual(len(self._get_cache_files()), 1)
+
+    def test_disk_cache_loadedFileChangedInPlaceRebuilt(self):
+        """ An invalidated loaded point cloud should not get, or overwrite, the tree of the file """
+        kd_tree.get_kdtree_for_pc(load(self._test_file_path))
+        kd_tree.initialize_cache()
+        pc = load(self._test_file_path)
+        pc[keys.point]['x']['data'][1] = 1e6
+        kd_tree.invalidate(pc)
+        tree = kd_tree.get_kdtree_for_pc(pc)
+        self.assertEqual(tree.data[1, 0], 1e6)
+        self.assertEqual(len(self._get_cache_files()), 2)
+        kd_tree.initialize_cache()
+        self.assertNotEqual(kd_tree.get_kdtree_for_pc(load(self._test_file_path)).data[1, 0], 1e6)
+
+    def test_disk_cache_loadedFileKeyReadsNoValues(self):
+        """ The key of a loaded point cloud should not need a hash of its attribute values """
+        pc = load(self._test_file_path)
+        unreadable_arrays = [object(), object()]
+        self.assertEqual(kd_tree._get_disk_cache_key(pc, ('x', 'y'), unreadable_arrays),
+                         kd_tree._get_disk_cache_key(load(self._test_file_path), ('x', 'y'), unreadable_arrays))
+
+    def test_disk_cache_corruptedFileRebuilt(self):
+        pc = create_point_cloud(np.arange(10.), np.arange(10.), np.arange(10.))
+        kd_tree.get_kdtree_for_pc(pc)
+        cache_file = self._get_cache_files()[0]
+        with open(cache_file, 'wb') as f:
+            f.write(b'not a tree')
+        kd_tree.initialize_cache()
+        tree = kd_tree.get_kdtree_for_pc(pc)
+        np.testing.assert_equal(tree.data[:, 0], np.arange(10.))
+        with open(cache_file, 'rb') as f:
+            self.assertNotEqual(f.read(), b'not a tree')
+
+    def test_disk_cache_staleFileRebuilt(self):
+        """ A tree of another point cloud stored under the same key should not be used """
+        pc = create_point_cloud(np.arange(10.), np.arange(10.), np.arange(10.))
+        kd_tree.get_kdtree_for_pc(pc)
+        other_pc = create_point_cloud(np.arange(10.) + 1, np.arange(10.), np.arange(10.))
+        os.replace(self._get_cache_files()[0], self._get_cache_path(other_pc))
+        kd_tree.initialize_cache()
+        tree = kd_tree.get_kdtree_for_pc(other_pc)
+        np.testing.assert_equal(tree.data[:, 0], np.arange(10.) + 1)
+
+    def _get_cache_files(self):
+        return [os.path.join(self._test_dir, name) for name in os.listdir(self._test_dir)]
+
+    def _get_cache_path(self, pc):
+        arrays = [pc[keys.point][name]['data'] for name in ('x', 'y')]
+        return os.path.join(self._test_dir, kd_tree._get_disk_cache_key(pc, ('x', 'y'), arrays) + '.pickle')
+
+    def setUp(self):
+        kd_tree.initialize_cache()
+        kd_tree.initialize_disk_cache(self._test_dir)
+
+    def tearDown(self):
+        kd_tree.initialize_disk_cache(None)
+        shutil.rmtree(self._test_dir)
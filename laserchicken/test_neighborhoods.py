@@ -0,0 +1,150 @@
+import unittest
+
+import numpy as np
+from numpy.testing import assert_equal
+
+from laserchicken.neighborhoods import Neighborhoods, NeighborhoodCounts, get_index_dtype
+from laserchicken.test_tools import create_point_cloud
+
+
+class TestNeighborhoods(unittest.TestCase):
+    lists = [[3, 1], [], [0, 2, 4], [5]]
+
+    def test_from_lists_iteratesAsLists(self):
+        neighborhoods = Neighborhoods.from_lists(self.lists)
+        assert_equal(list(neighborhoods), self.lists)
+
+    def test_from_generator_smallChunks(self):
+        neighborhoods = Neighborhoods.from_lists((n for n in self.lists), chunk_size=3)
+        assert_equal(list(neighborhoods), self.lists)
+
+    def test_from_lists_empty(self):
+        neighborhoods = Neighborhoods.from_lists([])
+        assert_equal(len(neighborhoods), 0)
+        assert_equal(list(neighborhoods), [])
+
+    def test_from_lists_dtype(self):
+        neighborhoods = Neighborhoods.from_lists(self.lists, dtype=np.int32)
+        assert_equal(neighborhoods.indices.dtype, np.int32)
+
+    def test_len(self):
+        assert_equal(len(Neighborhoods.from_lists(self.lists)), 4)
+
+    def test_getitem_integer(self):
+        neighborhoods = Neighborhoods.from_lists(self.lists)
+        assert_equal(neighborhoods[2], [0, 2, 4])
+        assert_equal(neighborhoods[-1], [5])
+
+    def test_getitem_outOfRange(self):
+        neighborhoods = Neighborhoods.from_lists(self.lists)
+        with self.assertRaises(IndexError):
+            _ = neighborhoods[4]
+
+    def test_slice_values(self):
+        neighborhoods = Neighborhoods.from_lists(self.lists)
+        assert_equal(list(neighborhoods[1:3]), self.lists[1:3])
+
+    def test_slice_sharesIndices(self):
+        neighborhoods = Neighborhoods.from_lists(self.lists)
+        chunk = neighborhoods[2:4]
+        assert np.shares_memory(chunk.indices, neighborhoods.indices)
+        assert np.shares_memory(chunk.offsets, neighborhoods.offsets)
+
+    def test_slice_flatIndicesAndLocalOffsets(self):
+        chunk = Neighborhoods.from_lists(self.lists)[2:4]
+        assert_equal(chunk.flat_indices, [0, 2, 4, 5])
+        assert_equal(chunk.local_offsets, [0, 3, 4])
+        assert_equal(chunk.lengths, [3, 1])
+        assert_equal(chunk.get_owners(), [0, 0, 0, 1])
+
+    def test_slice_stepRaises(self):
+        neighborhoods = Neighborhoods.from_lists(self.lists)
+        with self.assertRaises(ValueError):
+            _ = neighborhoods[::2]
+
+    def test_slice_beyondEnd(self):
+        neighborhoods = Neighborhoods.from_lists(self.lists)
+        assert_equal(len(neighborhoods[3:10]), 1)
+        assert_equal(len(neighborhoods[10:20]), 0)
+
+    def test_from_lengths(self):
+        neighborhoods = Neighborhoods.from_lengths([2, 0, 1], np.array([7, 8, 9]))
+        assert_equal(list(neighborhoods), [[7, 8], [], [9]])
+
+    def test_init_invalidOffsets(self):
+        with self.assertRaises(ValueError):
+            Neighborhoods(np.zeros(0), np.zeros(0))
+
+    def test_get_index_dtype(self):
+        assert_equal(get_index_dtype(1000), np.int32)
+        assert_equal(get_index_dtype(2 ** 32), np.int64)
+
+    def test_reduce(self):
+        neighborhoods = Neighborhoods.from_lists(self.lists)
+        values = np.array([3., 1., 0., 2., 4., 5.])
+        np.testing.assert_allclose(neighborhoods.reduce(np.maximum, values, empty_value=-1), [3, -1, 4, 5])
+
+    def test_reduce_slice(self):
+        chunk = Neighborhoods.from_lists(self.lists)[1:3]
+        np.testing.assert_allclose(chunk.reduce(np.add, np.array([1., 2., 3.])), [np.nan, 6])
+
+    def test_gather_values(self):
+        point_cloud = create_point_cloud(np.arange(6.), np.zeros(6), np.arange(6.) * 10)
+        chunk = Neighborhoods.from_lists(self.lists)[2:4]
+        assert_equal(chunk.gather(point_cloud, 'z'), [0, 20, 40, 50])
+
+    def test_gather_cached(self):
+        point_cloud = create_point_cloud(np.arange(6.), np.zeros(6), np.arange(6.))
+        neighborhoods = Neighborhoods.from_lists(self.lists)
+        self.assertIs(neighborhoods.gather(point_cloud, 'x'), neighborhoods.gather(point_cloud, 'x'))
+
+    def test_gather_readOnly(self):
+        point_cloud = create_point_cloud(np.arange(6.), np.zeros(6), np.arange(6.))
+        with self.assertRaises(ValueError):
+            Neighborhoods.from_lists(self.lists).gather(point_cloud, 'x')[0] = 1
+
+    def test_gather_replacedAttribute(self):
+        point_cloud = create_point_cloud(np.arange(6.), np.zeros(6), np.arange(6.))
+        neighborhoods = Neighborhoods.from_lists(self.lists)
+        neighborhoods.gather(point_cloud, 'x')
+        point_cloud['vertex']['x']['data'] = np.arange(6.) + 1
+        assert_equal(neighborhoods.gather(point_cloud, 'x'), [4, 2, 1, 3, 5, 6])
+
+    def test_clear_gathered(self):
+        point_cloud = create_point_cloud(np.arange(6.), np.zeros(6), np.arange(6.))
+        neighborhoods = Neighborhoods.from_lists(self.lists)
+        x = neighborhoods.gather(point_cloud, 'x')
+        z = neighborhoods.gather(point_cloud, 'z')
+        neighborhoods.clear_gathered(['x'])
+        self.assertIsNot(neighborhoods.gather(point_cloud, 'x'), x)
+        self.assertIs(neighborhoods.gather(point_cloud, 'z'), z)
+
+    def test_gather_per_neighborhood(self):
+        point_cloud = create_point_cloud(np.arange(6.), np.zeros(6), np.arange(6.))
+        values = Neighborhoods.from_lists(self.lists).gather_per_neighborhood(point_cloud, 'x')
+        assert_equal([list(v) for v in values], self.lists)
+
+    def test_get_derived_cached(self):
+        point_cloud = create_point_cloud(np.arange(6.), np.zeros(6), np.arange(6.))
+        neighborhoods = Neighborhoods.from_lists(self.lists)
+        x = neighborhoods.gather(point_cloud, 'x')
+        first = neighborhoods.get_derived('sum', x, lambda: [np.sum(x)])
+        self.assertIs(neighborhoods.get_derived('sum', x, lambda: [np.sum(x)]), first)
+        neighborhoods.clear_gathered(['x'])
+        x = neighborhoods.gather(point_cloud, 'x')
+        self.assertIsNot(neighborhoods.get_derived('sum', x, lambda: [np.sum(x)]), first)
+
+
+class TestNeighborhoodCounts(unittest.TestCase):
+    def test_slice(self):
+        counts = NeighborhoodCounts(np.array([3, 0, 2]))[1:]
+        assert_equal(len(counts), 2)
+        assert_equal(counts.lengths, [0, 2])
+
+    def test_index_raises(self):
+        with self.assertRaises(TypeError):
+            _ = NeighborhoodCounts(np.array([3, 0, 2]))[1]
+
+    def test_not_integer_raises(self):
+        with self.assertRaises(ValueError):
+            NeighborhoodCounts(np.array([3., 0., 2.]))
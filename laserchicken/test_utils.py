@@ -3,6 +3,7 @@ import unittest
 import datetime
 import pytest
 from laserchicken import utils, test_tools, keys
+from laserchicken.neighborhoods import Neighborhoods
 from laserchicken.utils import fit_plane
 from time import time
 
@@ -201,6 +202,35 @@ class TestUtils(unittest.TestCase):
 
 class TestPlaneFit(unittest.TestCase):
 
+    def test_AttributesPerNeighborhoodFromNeighborhoodsObject(self):
+        """ Padded attributes should be the same for lists of neighborhoods and neighborhoods in CSR format. """
+        pc = test_tools.ComplexTestData().get_point_cloud()
+        neighborhood_lists = [[1, 4], [], [0, 1, 2]]
+        neighborhoods = Neighborhoods.from_lists(neighborhood_lists)
+        expected = utils.get_attributes_per_neighborhood(pc, neighborhood_lists, ['z', 'return'])
+        result = utils.get_attributes_per_neighborhood(pc, neighborhoods, ['z', 'return'])
+        np.testing.assert_array_equal(result.data, expected.data)
+        np.testing.assert_array_equal(result.mask, expected.mask)
+
+    def test_XyzPerNeighborhoodFromNeighborhoodsObjectSlice(self):
+        """ Padded coordinates should be the same for a slice of neighborhoods in CSR format. """
+        pc = test_tools.ComplexTestData().get_point_cloud()
+        neighborhood_lists = [[3], [1, 4], [], [0, 1, 2]]
+        neighborhoods = Neighborhoods.from_lists(neighborhood_lists)[1:]
+        expected = utils.get_xyz_per_neighborhood(pc, neighborhood_lists[1:])
+        result = utils.get_xyz_per_neighborhood(pc, neighborhoods)
+        np.testing.assert_array_equal(result.data, expected.data)
+        np.testing.assert_array_equal(result.mask, expected.mask)
+
+    def test_AttributeValuesPerNeighborhoodFromNeighborhoodsObject(self):
+        """ Attribute values per neighborhood should be the same for lists and neighborhoods in CSR format. """
+        pc = test_tools.ComplexTestData().get_point_cloud()
+        neighborhood_lists = [[1, 4], [], [0, 1, 2]]
+        expected = utils.get_attribute_values_per_neighborhood(pc, neighborhood_lists, 'z')
+        result = utils.get_attribute_values_per_neighborhood(pc, Neighborhoods.from_lists(neighborhood_lists), 'z')
+        for result_values, expected_values in zip(result, expected):
+            np.testing.assert_array_equal(result_values, expected_values)
+
     def test_leastsqr(self):
         # n_points = 100
         # points = np.zeros((n_points, 3))
@@ -2,7 +2,7 @@ from unittest import TestCase
 
 from numpy.testing import assert_equal, assert_almost_equal
 
-from laserchicken.volume_specification import Sphere, InfiniteCylinder, Cell, Cube
+from laserchicken.volume_specification import Sphere, InfiniteCylinder, Cell, Cube, KNearest
 
 
 class VolumeTests(TestCase):
@@ -37,3 +37,23 @@ class VolumeTests(TestCase):
     @staticmethod
     def test_cube_calculateVolume():
         assert_almost_equal(Cube(2).calculate_volume(), 8.0)
+
+    @staticmethod
+    def test_kNearest_correctType():
+        assert_equal(KNearest(5).get_type(), KNearest.TYPE)
+
+    @staticmethod
+    def test_kNearest2d_calculateArea():
+        assert_almost_equal(KNearest(5, dimensions=2).calculate_area_or_volume(2), 12.56637061436)
+
+    @staticmethod
+    def test_kNearest3d_calculateVolumeAtMaxRadius():
+        assert_almost_equal(KNearest(5, max_radius=2).calculate_area_or_volume(), 33.510321638)
+
+    def test_kNearest_calculateVolumeWithoutRadius(self):
+        with self.assertRaises(ValueError):
+            KNearest(5).calculate_area_or_volume()
+
+    def test_kNearest_invalidDimensions(self):
+        with self.assertRaises(ValueError):
+            KNearest(5, dimensions=4)
@@ -5,6 +5,7 @@ import datetime
 import numpy as np
 
 from laserchicken import keys, _version
+from laserchicken.neighborhoods import Neighborhoods
 
 
 def get_point(point_cloud, index):
@@ -26,6 +27,9 @@ def get_xyz_per_neighborhood(sourcepc, neighborhoods):
     :param neighborhoods:
     :return: 3d tensor as a masked array
     """
+    if isinstance(neighborhoods, Neighborhoods):
+        return _get_padded_attributes(sourcepc, neighborhoods, ['x', 'y', 'z'])
+
     max_length = max(map(lambda x: len(x), neighborhoods))
 
     xyz_grp = np.zeros((len(neighborhoods), 3, max_length))
@@ -50,6 +54,9 @@ def get_attributes_per_neighborhood(point_cloud, neighborhoods, attribute_names)
     :param attribute_names: list of attribute names
     :return: 3d tensor as a masked array
     """
+    if isinstance(neighborhoods, Neighborhoods):
+        return _get_padded_attributes(point_cloud, neighborhoods, attribute_names)
+
     max_length = max(map(lambda x: len(x), neighborhoods))
 
     xyz_grp = np.zeros((len(neighborhoods), (len(attribute_names)), max_length))
@@ -65,6 +72,38 @@ def get_attributes_per_neighborhood(point_cloud, neighborhoods, attribute_names)
     return np.ma.MaskedArray(xyz_grp, mask == 0)
 
 
+def _get_padded_attributes(point_cloud, neighborhoods, attribute_names):
+    """Vectorized version of get_attributes_per_neighborhood for neighborhoods stored in CSR format."""
+    lengths = neighborhoods.lengths
+    max_length = max(lengths)
+    indices = neighborhoods.flat_indices
+    rows = neighborhoods.get_owners()
+    columns = np.arange(len(indices)) - np.repeat(neighborhoods.local_offsets[:-1], lengths)
+
+    values = np.zeros((len(neighborhoods), len(attribute_names), max_length))
+    mask = np.ones_like(values, dtype=bool)
+    for i_attribute, attribute_name in enumerate(attribute_names):
+        values[rows, i_attribute, columns] = neighborhoods.gather(point_cloud, attribute_name)
+        mask[rows, i_attribute, columns] = False
+    return np.ma.MaskedArray(values, mask)
+
+
+def get_attribute_values_per_neighborhood(point_cloud, neighborhoods, attribute_name):
+    """
+    Get the values of a single attribute of the points in each neighborhood.
+
+    For a Neighborhoods object, the values are taken from its cache of gathered attributes.
+
+    :param point_cloud: point cloud that the neighborhood indices refer to
+    :param neighborhoods: list of lists of indices, or a Neighborhoods object
+    :param attribute_name: attribute name
+    :return: list with an array of values for each neighborhood
+    """
+    if isinstance(neighborhoods, Neighborhoods):
+        return neighborhoods.gather_per_neighborhood(point_cloud, attribute_name)
+    return [get_attribute_value(point_cloud, neighborhood, attribute_name) for neighborhood in neighborhoods]
+
+
 def get_attribute_value(point_cloud, index, attribute_name):
     """
     Get value of a single attribute of a single point in a point cloud.
@@ -113,3 +113,35 @@ class Cube(Volume):
 
     def calculate_area_or_volume(self):
         return self.calculate_volume()
+
+
+class KNearest(Volume):
+    """The k nearest neighbors of a target, using distances in the xy plane (2d) or in xyz (3d)."""
+
+    TYPE = 'k nearest'
+
+    def __init__(self, k, dimensions=3, max_radius=None):
+        if dimensions not in (2, 3):
+            raise ValueError('Number of dimensions should be 2 or 3, got {}.'.format(dimensions))
+        self.k = k
+        self.dimensions = dimensions
+        self.max_radius = max_radius
+
+    def get_type(self):
+        return self.TYPE
+
+    def calculate_area_or_volume(self, radius=None):
+        """
+        Calculate the area (2d) or volume (3d) of a circle or sphere that contains the neighbors.
+
+        :param radius: radius of the circle or sphere, can be an array; if None, the maximum radius is used
+        :return: area or volume
+        """
+        if radius is None:
+            if self.max_radius is None:
+                raise ValueError('A radius is needed to calculate the area or volume of k nearest neighbors without '
+                                 'maximum radius.')
+            radius = self.max_radius
+        if self.dimensions == 2:
+            return np.power(radius, 2) * np.pi
+        return np.power(radius, 3) * SPHERE_VOLUME_FACTOR